@@ -0,0 +1,252 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Reads Fortio access log files (one json object per request) into numpy
+# columns and computes exact latency statistics from them.
+
+from __future__ import print_function
+import argparse
+import collections
+import json
+import os
+import re
+import numpy as np
+import fortio
+import steadystate
+
+ACCESS_LOG = collections.namedtuple('AccessLog', ['timestamp', 'latency', 'thread', 'ok', 'status'])
+
+# Fortio writes the keys of every access log line in this order, lines that
+# do not match are parsed with the json module instead
+ACCESS_LOG_LINE = re.compile(
+    rb'\{"latency":([-+0-9.eE]+),"timestamp":(\d+),"thread":(\d+),"ok":(true|false),"details":"([^"]*)"')
+
+# bytes read from the file at a time
+CHUNK_SIZE = 1 << 22
+
+PERCENTILES = [50, 75, 90, 99, 99.9]
+
+
+def empty_access_log():
+    return ACCESS_LOG(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64),
+                      np.empty(0, dtype=np.uint16), np.empty(0, dtype=bool), np.empty(0, dtype=np.uint16))
+
+
+def status_codes(details):
+    details = np.asarray(details, dtype='S')
+    status = np.zeros(len(details), dtype=np.uint16)
+    numeric = np.char.isdigit(details)
+    if numeric.any():
+        status[numeric] = details[numeric].astype(np.int64)
+    return status
+
+
+def parse_lines_slow(lines):
+    columns = ([], [], [], [], [])
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        entry = json.loads(line)
+        columns[0].append(int(entry["timestamp"]))
+        columns[1].append(float(entry["latency"]))
+        columns[2].append(int(entry.get("thread", 0)))
+        columns[3].append(bool(entry.get("ok", False)))
+        columns[4].append(str(entry.get("details", "")).encode())
+    return ACCESS_LOG(np.array(columns[0], dtype=np.int64), np.array(columns[1], dtype=np.float64),
+                      np.array(columns[2], dtype=np.uint16), np.array(columns[3], dtype=bool),
+                      status_codes(columns[4]))
+
+
+def parse_chunk(chunk):
+    matches = ACCESS_LOG_LINE.findall(chunk)
+    lines = chunk.count(b"\n") + (0 if chunk.endswith(b"\n") else 1)
+    if len(matches) != lines:
+        return parse_lines_slow(chunk.splitlines())
+    if not matches:
+        return empty_access_log()
+    m = np.array(matches, dtype='S')
+    return ACCESS_LOG(m[:, 1].astype(np.int64), m[:, 0].astype(np.float64),
+                      m[:, 2].astype(np.uint16), m[:, 3] == b'true', status_codes(m[:, 4]))
+
+
+def iter_access_log_chunks(path, chunk_size=CHUNK_SIZE):
+    rest = b""
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            data = rest + data
+            end = data.rfind(b"\n")
+            if end < 0:
+                rest = data
+                continue
+            rest = data[end + 1:]
+            yield parse_chunk(data[:end + 1])
+    if rest.strip():
+        yield parse_chunk(rest)
+
+
+# reads the access log in one pass, only the parsed columns are kept in
+# memory. The columns are sorted by timestamp.
+def read_access_log(path, chunk_size=CHUNK_SIZE, start=None, end=None):
+    chunks = []
+    for chunk in iter_access_log_chunks(path, chunk_size):
+        if start is not None or end is not None:
+            chunk = trim(chunk, start, end)
+        chunks.append(chunk)
+    if not chunks:
+        return empty_access_log()
+    log = ACCESS_LOG(*[np.concatenate(column) for column in zip(*chunks)])
+    order = np.argsort(log.timestamp, kind="stable")
+    return ACCESS_LOG(*[column[order] for column in log])
+
+
+# keeps requests with start <= timestamp < end, start and end in unix seconds
+def trim(log, start=None, end=None):
+    keep = np.ones(len(log.timestamp), dtype=bool)
+    if start is not None:
+        keep &= log.timestamp >= int(start * 10 ** 9)
+    if end is not None:
+        keep &= log.timestamp < int(end * 10 ** 9)
+    return ACCESS_LOG(*[column[keep] for column in log])
+
+
+def access_log_filename(data):
+    # e.g. "mode json to /var/lib/access-logs/access-log-file_baseline-1.json"
+    info = data.get("AccessLoggerInfo", "")
+    if " to " not in info:
+        return None
+    return os.path.basename(info.split(" to ", 1)[1].strip())
+
+
+# sorts values by key and returns the unique keys, counts and a
+# (len(keys), len(percentiles)) matrix of linearly interpolated percentiles
+def grouped_percentiles(keys, values, percentiles=PERCENTILES):
+    order = np.lexsort((values, keys))
+    keys = keys[order]
+    values = values[order]
+    unique_keys, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    q = np.asarray(percentiles, dtype=np.float64) / 100.0
+    pos = (counts[:, None] - 1) * q[None, :]
+    lower = np.floor(pos).astype(np.int64)
+    upper = np.minimum(lower + 1, counts[:, None] - 1)
+    frac = pos - lower
+    lo = values[first[:, None] + lower]
+    hi = values[first[:, None] + upper]
+    return unique_keys, counts, lo + (hi - lo) * frac
+
+
+def summarize(log, percentiles=PERCENTILES):
+    out = {"count": len(log.latency)}
+    if out["count"] == 0:
+        return out
+    latency = log.latency
+    out["min"] = float(latency.min())
+    out["max"] = float(latency.max())
+    out["avg"] = float(latency.mean())
+    out["errorPercent"] = 100.0 * float(np.count_nonzero(~log.ok)) / out["count"]
+    duration = (log.timestamp[-1] - log.timestamp[0]) / 10 ** 9
+    if duration > 0:
+        out["qps"] = out["count"] / duration
+    for p, v in zip(percentiles, np.percentile(latency, percentiles)):
+        out["p" + str(p)] = float(v)
+    return out
+
+
+# per second latency percentiles and request rate
+def per_second(log, percentiles=(50, 99, 99.9)):
+    seconds = log.timestamp // 10 ** 9
+    keys, counts, values = grouped_percentiles(seconds, log.latency, percentiles)
+    errors = np.bincount(np.searchsorted(keys, seconds[~log.ok]), minlength=len(keys))
+    return keys, counts, errors, values
+
+
+def per_thread(log, percentiles=(50, 99, 99.9)):
+    keys, counts, values = grouped_percentiles(log.thread.astype(np.int64), log.latency, percentiles)
+    sums = np.bincount(np.searchsorted(keys, log.thread), weights=log.latency, minlength=len(keys))
+    errors = np.bincount(np.searchsorted(keys, log.thread[~log.ok]), minlength=len(keys))
+    return keys, counts, errors, sums / counts, values
+
+
+def load_run(json_output_dir, filename, skip=True):
+    with open(os.path.join(json_output_dir, filename), "r") as f:
+        data = json.load(f, strict=False)
+    gd = fortio.convert_data(data)
+    steadystate.apply_cuts(json_output_dir, filename, gd)
+    access_log = access_log_filename(data)
+    if access_log is None or not os.path.exists(os.path.join(json_output_dir, access_log)):
+        return gd, None
+    start = end = None
+    if skip:
+        start, duration = fortio.metrics_window(gd)
+        end = start + duration
+    return gd, read_access_log(os.path.join(json_output_dir, access_log), start=start, end=end)
+
+
+def write_per_second_csv(log, csv_output, percentiles=(50, 99, 99.9)):
+    keys, counts, errors, values = per_second(log, percentiles)
+    with open(csv_output, "w+") as out:
+        out.write("timestamp,count,errors," + ",".join("p" + str(p) for p in percentiles) + "\n")
+        for i in range(len(keys)):
+            out.write(",".join([str(keys[i]), str(counts[i]), str(errors[i])] +
+                               [str(v) for v in values[i]]) + "\n")
+    print("Wrote {} per second records to {}".format(len(keys), csv_output))
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    for filename in sorted(os.listdir(args.json_output_dir)):
+        if not fortio.is_fortio_result(filename):
+            continue
+        gd, log = load_run(args.json_output_dir, filename, skip=not args.no_skip)
+        if log is None:
+            print(gd["Labels"], "access log not found")
+            continue
+        print(gd["Labels"], json.dumps(summarize(log)))
+        if args.per_thread:
+            keys, counts, errors, means, values = per_thread(log)
+            for i in range(len(keys)):
+                print("  thread {} count={} errors={} avg={} p50={} p99={} p99.9={}".format(
+                    keys[i], counts[i], errors[i], means[i], *values[i]))
+        if args.per_second_dir:
+            write_per_second_csv(log, os.path.join(args.per_second_dir, "per-second_" + gd["Labels"] + ".csv"))
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Compute latency statistics from Fortio access logs")
+    parser.add_argument(
+        "--json_output_dir",
+        help="directory containing the Fortio json results and access logs",
+        required=True)
+    parser.add_argument(
+        "--no_skip",
+        help="do not skip the beginning and the end of the run like the prometheus metrics do",
+        action="store_true")
+    parser.add_argument(
+        "--per_thread",
+        help="print statistics per Fortio thread",
+        action="store_true")
+    parser.add_argument(
+        "--per_second_dir",
+        help="directory to write per second p50/p99/p99.9 csv files to",
+        default="")
+    return parser
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,271 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmarks the analysis pipeline against the stand-ins of standin.py. Every
+# stage runs in its own process so that its peak RSS is not hidden by the
+# earlier stages, and reports the wall time of the stage and the peak RSS of
+# the process before and after it:
+#
+#   sync_fortio:  fortio.sync_fortio into an empty json output directory,
+#                 pulling, columnar conversion, prometheus and csv
+#   convert_data: reading the Fortio results and convert_data
+#   prom:         prometheus fetch and aggregation of every run
+#   write_csv:    writing --csv_rows summary rows
+
+from __future__ import print_function
+import argparse
+import concurrent.futures
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import fortio
+import prom
+import standin
+
+STAGES = ["sync_fortio", "convert_data", "prom", "write_csv"]
+
+# the last line a stage process prints
+RESULT_PREFIX = "BENCH "
+
+COLUMNS = ["stage", "repetition", "wall_s", "rss_start_MiB", "peak_rss_MiB", "items"]
+
+
+# VmHWM is the peak RSS of this process image, ru_maxrss also counts the
+# peak of the parent at the time of the fork
+def peak_rss_mebibytes():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    # kilobytes on linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024.0 * 1024.0) if sys.platform == "darwin" else maxrss / 1024.0
+
+
+def fortio_results(root):
+    results_dir = os.path.join(root, standin.REMOTE_ROOT, "fortio")
+    return [os.path.join(results_dir, f) for f in sorted(os.listdir(results_dir)) if fortio.is_fortio_result(f)]
+
+
+def load_converted(root):
+    rows = []
+    for path in fortio_results(root):
+        with open(path, "r") as f:
+            rows.append((os.path.basename(path), fortio.convert_data(json.load(f, strict=False))))
+    return rows
+
+
+def fresh_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
+
+
+def stage_sync_fortio(args):
+    json_output_dir = fresh_dir(os.path.join(args.work_dir, "sync_fortio"))
+    fortio.sync_fortio(args.prom_url, fortio.default_csv(),
+                       os.path.join(json_output_dir, "summary.csv"), json_output_dir=json_output_dir,
+                       resource_usage_targets=args.resource_usage_targets, concurrency=args.concurrency, full=True)
+    return len([f for f in os.listdir(json_output_dir) if fortio.is_fortio_result(f)])
+
+
+def stage_convert_data(args):
+    return len(load_converted(args.root))
+
+
+def stage_prom(args):
+    json_output_dir = fresh_dir(os.path.join(args.work_dir, "prom"))
+    runs = load_converted(args.root)
+    session = prom.new_session(pool_size=args.concurrency)
+    fetches = []
+    for filename, gd in runs:
+        start, duration = fortio.metrics_window(gd)
+        fetches.append(prom.Prom(args.prom_url, duration, start=start, resource_usage_targets=args.resource_usage_targets,
+                                 json_output_dir=json_output_dir, filename_suffix=filename, session=session))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(args.concurrency, 1)) as executor:
+        results = list(executor.map(lambda p: p.fetch_targets_metrics(), fetches))
+    return len(results)
+
+
+def stage_write_csv(args):
+    rows = [gd for _, gd in load_converted(args.root)]
+    if not rows:
+        raise Exception("no Fortio results in " + args.root)
+    data = [rows[i % len(rows)] for i in range(args.csv_rows)]
+    fortio.write_csv(fortio.default_csv(), data,
+                     os.path.join(fresh_dir(os.path.join(args.work_dir, "write_csv")), "summary.csv"))
+    return len(data)
+
+
+STAGE_FUNCTIONS = {
+    "sync_fortio": stage_sync_fortio,
+    "convert_data": stage_convert_data,
+    "prom": stage_prom,
+    "write_csv": stage_write_csv,
+}
+
+
+# runs one stage in this process and prints its result as the last line
+def run_stage(args):
+    rss_start = peak_rss_mebibytes()
+    start = time.perf_counter()
+    items = STAGE_FUNCTIONS[args.stage](args)
+    wall = time.perf_counter() - start
+    print(RESULT_PREFIX + json.dumps({"stage": args.stage, "wall_s": wall, "rss_start_MiB": rss_start,
+                                      "peak_rss_MiB": peak_rss_mebibytes(), "items": items}), flush=True)
+    return 0
+
+
+def run_stage_process(stage, repetition, args, prom_url, bin_dir):
+    cmd = [sys.executable, os.path.abspath(__file__), "--stage", stage, "--root", args.root, "--work_dir", args.work_dir,
+           "--prom_url", prom_url, "--resource_usage_targets", args.resource_usage_targets,
+           "--concurrency", str(args.concurrency), "--csv_rows", str(args.csv_rows)]
+    env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ.get("PATH", ""))
+    process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, env=env,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    lines = process.stdout.splitlines()
+    if args.verbose:
+        print("\n".join(lines[:-1]))
+    if process.returncode != 0 or not lines or not lines[-1].startswith(RESULT_PREFIX):
+        print(process.stdout)
+        raise Exception("stage {} failed with exit code {}".format(stage, process.returncode))
+    result = json.loads(lines[-1][len(RESULT_PREFIX):])
+    result["repetition"] = repetition
+    return result
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    if args.stage:
+        return run_stage(args)
+
+    cleanup = args.work_dir == ""
+    if cleanup:
+        args.work_dir = tempfile.mkdtemp(prefix="bench-")
+    if args.root == "":
+        args.root = os.path.join(args.work_dir, "standin")
+    try:
+        # the results of an existing root are reused
+        if os.path.isdir(os.path.join(args.root, standin.REMOTE_ROOT, "fortio")) and fortio_results(args.root):
+            bin_dir = standin.init_root(args.root)
+        else:
+            bin_dir = standin.prepare(args.root, args.replay, args.runs, args.requests, args.duration, args.conn)
+        server, prom_url = standin.start_prometheus(args.replay)
+
+        results = []
+        for stage in args.stages:
+            for repetition in range(args.repetitions):
+                result = run_stage_process(stage, repetition, args, prom_url, bin_dir)
+                print("{stage:<13} #{repetition} {wall_s:9.3f}s  rss {rss_start_MiB:8.1f} -> {peak_rss_MiB:8.1f} MiB  "
+                      "{items} items".format(**result), flush=True)
+                results.append(result)
+        server.shutdown()
+
+        if args.csv_output:
+            with open(args.csv_output, "w+") as out:
+                out.write(",".join(COLUMNS) + "\n")
+                for result in results:
+                    out.write(",".join(str(result[c]) for c in COLUMNS) + "\n")
+            print("Wrote", args.csv_output)
+    finally:
+        if cleanup:
+            shutil.rmtree(args.work_dir, ignore_errors=True)
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Benchmark the analysis pipeline against local stand-ins of the cluster")
+    parser.add_argument(
+        "--stages",
+        help="stages to run",
+        nargs="+",
+        choices=STAGES,
+        default=STAGES)
+    parser.add_argument(
+        "--replay",
+        help="json output directory of earlier runs to replay, e.g. ../data/sidecar-istio/json. "
+             "If blank, runs are generated",
+        default="")
+    parser.add_argument(
+        "--runs",
+        help="number of generated runs",
+        type=int,
+        default=3)
+    parser.add_argument(
+        "--requests",
+        help="number of requests of each generated run",
+        type=int,
+        default=1000000)
+    parser.add_argument(
+        "--duration",
+        help="duration in seconds of each generated run",
+        type=int,
+        default=300)
+    parser.add_argument(
+        "--conn",
+        help="number of connections of each generated run",
+        type=int,
+        default=10)
+    parser.add_argument(
+        "--resource_usage_targets",
+        help="resource usage targets: baseline, cilium, sidecar-istio or proxyless-istio",
+        default="sidecar-istio")
+    parser.add_argument(
+        "--concurrency",
+        help="number of concurrent prometheus queries",
+        type=int,
+        default=4)
+    parser.add_argument(
+        "--csv_rows",
+        help="number of rows written by the write_csv stage",
+        type=int,
+        default=100000)
+    parser.add_argument(
+        "--repetitions",
+        help="number of times each stage is run",
+        type=int,
+        default=1)
+    parser.add_argument(
+        "--root",
+        help="stand-in root directory, defaults to a directory in the work directory. The results of an existing "
+             "stand-in root are reused",
+        default="")
+    parser.add_argument(
+        "--work_dir",
+        help="directory of the stand-in and the stage outputs, a temporary directory is used and removed if blank",
+        default="")
+    parser.add_argument(
+        "--csv_output",
+        help="output path of the results",
+        default="")
+    parser.add_argument(
+        "--verbose",
+        help="print the output of the stages",
+        action="store_true")
+    # internal: runs a single stage in this process
+    parser.add_argument("--stage", help=argparse.SUPPRESS, default="")
+    parser.add_argument("--prom_url", help=argparse.SUPPRESS, default="")
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,209 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# High resolution resource usage from the cgroup counters of the containers.
+# Prometheus only has a point every scrape interval, smoothed by the rate
+# window. The sampler runs in the privileged ubuntu container of a pod, which
+# shares the process namespace of the pod, and reads the CPU and memory
+# counters of the other containers through /proc/<pid>/root/sys/fs/cgroup
+# every interval during the run. The samples of a run are saved as
+# cgroup-samples_<run id>.json and fortio.py converts them to the
+# cgroup-cpu-usage_ and cgroup-mem-usage_ files, which have the format of the
+# prometheus cpu-usage_ and mem-usage_ files.
+
+from __future__ import print_function
+import argparse
+import collections
+import json
+import os
+import subprocess
+import prom
+
+SAMPLER_CONTAINER = "ubuntu"
+SAMPLES_PREFIX = "cgroup-samples_"
+
+# seconds the samplers run longer than the run
+SAMPLER_SLACK = 10
+
+# arguments: interval, duration and the container ids. A process of every
+# container is found by the container id in its /proc/<pid>/cgroup. Prints
+# "<unix time> <container id> <cpu ns> <memory bytes>" lines of cgroup v2
+# (cpu.stat and memory.current) or v1 (cpuacct.usage and
+# memory.usage_in_bytes), the counters cAdvisor reads.
+SAMPLER_SCRIPT = r'''
+interval=$1; duration=$2; shift 2
+ids=("$@"); pids=()
+for id in "${ids[@]}"; do
+  pid=$(grep -l -- "$id" /proc/[0-9]*/cgroup 2>/dev/null | head -n 1 | cut -d/ -f3)
+  echo "# $id ${pid:-none}"
+  pids+=("$pid")
+done
+end=$(( $(date +%s) + duration ))
+while [ "$(date +%s)" -lt "$end" ]; do
+  now=$(date +%s.%N)
+  for i in "${!ids[@]}"; do
+    cg=/proc/${pids[$i]}/root/sys/fs/cgroup
+    [ -n "${pids[$i]}" ] && [ -d "$cg" ] || continue
+    if [ -f "$cg/cpu.stat" ]; then
+      cpu=$(awk '$1 == "usage_usec" { print $2 "000" }' "$cg/cpu.stat")
+      mem=$(cat "$cg/memory.current")
+    else
+      cpu=$(cat "$cg"/cpu*/cpuacct.usage 2>/dev/null | head -n 1)
+      mem=$(cat "$cg/memory/memory.usage_in_bytes")
+    fi
+    echo "$now ${ids[$i]} $cpu $mem"
+  done
+  sleep "$interval"
+done
+'''
+
+
+class Sampler:
+    # targets maps the target keys to the container ids in the pod
+    def __init__(self, pod, namespace, targets, interval, duration):
+        self.pod = pod
+        self.targets = targets
+        self.cmd = ["kubectl", "-n", namespace, "exec", pod, "-c", SAMPLER_CONTAINER, "--",
+                    "bash", "-c", SAMPLER_SCRIPT, "sampler", str(interval), str(int(duration))] + list(targets.values())
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                        universal_newlines=True)
+
+    # waits for the sampler to finish and returns {target key: [[time, cpu ns, memory bytes]]}
+    def collect(self, timeout=SAMPLER_SLACK):
+        try:
+            output, _ = self.process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.terminate()
+            output, _ = self.process.communicate()
+        return parse_samples(output, self.targets)
+
+
+def parse_samples(output, targets):
+    keys = {container_id: key for key, container_id in targets.items()}
+    samples = collections.OrderedDict((key, []) for key in targets)
+    for line in output.splitlines():
+        if line.startswith("#"):
+            if line.endswith(" none"):
+                print("cgroup sampler: no process found of container " + keys.get(line.split()[1], line))
+            continue
+        fields = line.split()
+        if len(fields) != 4 or fields[1] not in keys:
+            continue
+        try:
+            samples[keys[fields[1]]].append([float(fields[0]), int(fields[2]), int(fields[3])])
+        except ValueError:
+            continue
+    return samples
+
+
+# a sampler for every pod that has the sampler container and some of the
+# targets, the other targets are only in the prometheus files
+def new_samplers(pods, target_keys, interval, duration, namespace="default"):
+    samplers = []
+    sampled = set()
+    for pod in pods.pods(namespace):
+        if SAMPLER_CONTAINER not in pod.containers:
+            continue
+        targets = collections.OrderedDict()
+        for key in target_keys:
+            target = prom.TARGETS[key]
+            if target.namespace == pod.namespace and pod.name.startswith(target.pod) and \
+                    pod.containers.get(target.container):
+                targets[key] = pod.containers[target.container]
+        if targets:
+            samplers.append(Sampler(pod.name, pod.namespace, targets, interval, duration))
+            sampled.update(targets)
+    missing = [key for key in target_keys if key not in sampled]
+    if missing:
+        print("cgroup sampler: no {} container next to {}".format(SAMPLER_CONTAINER, ", ".join(missing)))
+    return samplers
+
+
+def save_samples(output_dir, run_id, interval, samples):
+    path = os.path.join(output_dir, SAMPLES_PREFIX + run_id + ".json")
+    with open(path, "w+") as f:
+        f.write(json.dumps({"interval": interval, "samples": samples}))
+    print("Wrote {} cgroup samples to {}".format(sum(len(s) for s in samples.values()), path))
+    return path
+
+
+# the datasets of the cpu and mem usage files within [start, end]. The CPU
+# usage at a sample is the rate since the previous sample, like a prometheus
+# rate over a window of one interval
+def to_usage(samples, interval, start, end):
+    cpu = collections.OrderedDict()
+    mem = collections.OrderedDict()
+    for key, points in samples.items():
+        cpu[key] = []
+        mem[key] = []
+        for (t0, cpu0, _), (t1, cpu1, mem1) in zip(points, points[1:]):
+            if t1 < start or t1 > end:
+                continue
+            # a restarted container starts its counter from zero
+            if t1 > t0 and cpu1 >= cpu0:
+                cpu[key].append({"timestamp": t1, "value": prom.to_milli_cpus((cpu1 - cpu0) / 1e9 / (t1 - t0))})
+            mem[key].append({"timestamp": t1, "value": prom.to_mebibytes(float(mem1))})
+    for datasets in [cpu, mem]:
+        datasets["source"] = "cgroup"
+        datasets["rate_window"] = interval
+    return cpu, mem
+
+
+# writes the cgroup usage files of a Fortio result from the samples of its
+# run, returns False if the run has no samples
+def write_usage_files(json_output_dir, filename, run_id, start, duration):
+    path = os.path.join(json_output_dir, SAMPLES_PREFIX + run_id + ".json")
+    if not os.path.exists(path):
+        return False
+    with open(path, "r") as f:
+        data = json.load(f)
+    usage = to_usage(data["samples"], data["interval"], start, start + duration)
+    for resource_type, datasets in zip(prom.RESOURCE_TYPES, usage):
+        output = os.path.join(json_output_dir, prom.usage_filename(resource_type, filename, "cgroup"))
+        with open(output, "w+") as f:
+            f.write(json.dumps(datasets, indent=2))
+        print(output)
+    return True
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    with open(args.samples, "r") as f:
+        data = json.load(f)
+    for key, points in data["samples"].items():
+        if len(points) < 2:
+            print("{} {} samples".format(key, len(points)))
+            continue
+        cpu, mem = to_usage({key: points}, data["interval"], points[0][0], points[-1][0])
+        values = [d["value"] for d in cpu[key]]
+        print("{} {} samples over {:.1f}s, cpu_milli avg {:.1f} max {:.1f}, mem_MiB max {:.1f}".format(
+            key, len(points), points[-1][0] - points[0][0], sum(values) / max(len(values), 1), max(values or [0]),
+            max(d["value"] for d in mem[key])))
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Summarize the cgroup samples of a run")
+    parser.add_argument(
+        "samples",
+        help="cgroup-samples_ file of a run")
+    return parser
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,196 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compares setups against a baseline setup. Latency statistics are computed
+# from the per-request latencies of the access logs and resource usage from
+# the per-run cpu-usage_ and mem-usage_ files. Confidence intervals of the
+# overhead are computed with a bootstrap that resamples within every run.
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import numpy as np
+import accesslog
+import fortio
+import histogram
+import prom
+
+LATENCY_STATS = ["mean", "p50", "p99", "p99.9"]
+
+# the load generator is not part of the setup under test
+LOAD_GENERATOR_TARGET = "main_fortioclient"
+
+# upper bound of resampled values held in memory at once
+BOOTSTRAP_BATCH_ELEMENTS = 1 << 23
+
+
+def statistic(samples, name):
+    if name == "mean":
+        return samples.mean(axis=-1)
+    return np.percentile(samples, float(name[1:]), axis=-1)
+
+
+# returns an (iterations,) array of the statistic of stratified resamples,
+# every run (a 1-d array) is resampled with replacement to its own size
+def bootstrap(runs, name, iterations, rng):
+    runs = [np.asarray(r, dtype=np.float64) for r in runs if len(r)]
+    n = sum(len(r) for r in runs)
+    batch = max(1, BOOTSTRAP_BATCH_ELEMENTS // max(n, 1))
+    out = np.empty(iterations)
+    for first in range(0, iterations, batch):
+        size = min(batch, iterations - first)
+        samples = np.concatenate([r[rng.integers(0, len(r), size=(size, len(r)))] for r in runs], axis=1)
+        out[first:first + size] = statistic(samples, name)
+    return out
+
+
+def load_latencies(json_output_dir):
+    runs = []
+    for filename in sorted(os.listdir(json_output_dir)):
+        if not fortio.is_fortio_result(filename):
+            continue
+        gd, log = accesslog.load_run(json_output_dir, filename)
+        if log is None:
+            print(gd["Labels"], "access log not found")
+            continue
+        runs.append(log.latency)
+    return runs
+
+
+# returns {target key: [values of every run]} of the per-run resource files
+def load_resource_usage(json_output_dir, resource_type, source="prometheus"):
+    usage = {}
+    for filename in sorted(os.listdir(json_output_dir)):
+        if not filename.startswith(prom.usage_filename(resource_type, "", source)):
+            continue
+        with open(os.path.join(json_output_dir, filename), "r") as f:
+            datasets = json.load(f)
+        for key in prom.TARGETS:
+            values = [d["value"] for d in datasets.get(key) or []]
+            if values:
+                usage.setdefault(key, []).append(np.array(values))
+    return usage
+
+
+def compare(baseline, other, name, iterations, rng):
+    b = bootstrap(baseline, name, iterations, rng) if baseline else np.zeros(iterations)
+    o = bootstrap(other, name, iterations, rng) if other else np.zeros(iterations)
+    base_value = float(statistic(np.concatenate(baseline), name)) if baseline else 0.0
+    value = float(statistic(np.concatenate(other), name)) if other else 0.0
+    low, high = np.percentile(o - b, [2.5, 97.5])
+    return base_value, value, value - base_value, float(low), float(high)
+
+
+# sum of the means of the targets, bootstrapped per target
+def compare_total(baseline_usage, usage, iterations, rng):
+    def total(u):
+        keys = [k for k in u if k != LOAD_GENERATOR_TARGET]
+        value = sum(float(np.concatenate(u[k]).mean()) for k in keys)
+        draws = sum((bootstrap(u[k], "mean", iterations, rng) for k in keys), np.zeros(iterations))
+        return value, draws
+    base_value, b = total(baseline_usage)
+    value, o = total(usage)
+    low, high = np.percentile(o - b, [2.5, 97.5])
+    return base_value, value, value - base_value, float(low), float(high)
+
+
+def compare_setups(json_output_dirs, baseline_dir, iterations=1000, seed=0, source="prometheus"):
+    rng = np.random.default_rng(seed)
+    rows = []
+    baseline_latencies = load_latencies(baseline_dir)
+    baseline_usage = {r: load_resource_usage(baseline_dir, r, source) for r in prom.RESOURCE_TYPES}
+    for json_output_dir in json_output_dirs:
+        if os.path.abspath(json_output_dir) == os.path.abspath(baseline_dir):
+            continue
+        setup = histogram.setup_name(json_output_dir)
+        latencies = load_latencies(json_output_dir)
+        for name in LATENCY_STATS:
+            rows.append([setup, "latency_" + name + "_s"] + list(compare(baseline_latencies, latencies, name, iterations, rng)))
+        for resource_type, unit in [("cpu", "cpu_milli_avg_"), ("mem", "mem_MiB_avg_")]:
+            usage = load_resource_usage(json_output_dir, resource_type, source)
+            base = baseline_usage[resource_type]
+            for key in prom.TARGETS:
+                if key in usage or key in base:
+                    rows.append([setup, unit + key] + list(compare(base.get(key), usage.get(key), "mean", iterations, rng)))
+            rows.append([setup, unit + "total"] + list(compare_total(base, usage, iterations, rng)))
+    return rows
+
+
+COLUMNS = ["setup", "metric", "baseline", "value", "overhead", "ci95_low", "ci95_high", "overhead_percent"]
+
+
+def format_rows(rows):
+    out = []
+    for row in rows:
+        base = row[2]
+        percent = 100.0 * row[4] / base if base else float("nan")
+        out.append(row[:2] + ["{:.6g}".format(v) for v in row[2:]] + ["{:.1f}".format(percent)])
+    return out
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    baseline_dir = args.baseline or args.json_output_dirs[0]
+    rows = format_rows(compare_setups(args.json_output_dirs, baseline_dir, args.iterations, args.seed,
+                                      args.resource_source))
+    print("Overhead relative to {}, {} bootstrap iterations".format(histogram.setup_name(baseline_dir), args.iterations))
+    widths = [max(len(str(r[i])) for r in rows + [COLUMNS]) for i in range(len(COLUMNS))]
+    for row in [COLUMNS] + rows:
+        print("  ".join(str(v).ljust(w) for v, w in zip(row, widths)))
+    if args.csv_output:
+        with open(args.csv_output, "w+") as out:
+            out.write(",".join(COLUMNS) + "\n")
+            for row in rows:
+                out.write(",".join(str(v) for v in row) + "\n")
+        print("Wrote {} csv records to {}".format(len(rows), args.csv_output))
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Compare setups against a baseline setup with bootstrap confidence intervals")
+    parser.add_argument(
+        "json_output_dirs",
+        help="json output directories of the setups, e.g. ../data/*/json",
+        nargs="+")
+    parser.add_argument(
+        "--baseline",
+        help="json output directory of the baseline setup, defaults to the first directory",
+        default="")
+    parser.add_argument(
+        "--iterations",
+        help="number of bootstrap iterations",
+        type=int,
+        default=1000)
+    parser.add_argument(
+        "--seed",
+        help="seed of the bootstrap random number generator",
+        type=int,
+        default=0)
+    parser.add_argument(
+        "--resource_source",
+        help="resource usage files to compare, the prometheus series or the cgroup samples of runner.py "
+             "--cgroup_interval",
+        choices=list(prom.USAGE_SOURCES),
+        default="prometheus")
+    parser.add_argument(
+        "--csv_output",
+        help="output path of the comparison csv file",
+        default="")
+    return parser
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
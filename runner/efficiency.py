@@ -0,0 +1,201 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Normalizes resource usage by the throughput achieved at the same time. The
+# prometheus series of the cpu-usage_ and mem-usage_ files and the requests of
+# the access log are resampled onto a common one second grid within the
+# metrics window, from which the CPU cost per 1k requests per second and the
+# memory per connection of every container are derived.
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import re
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import accesslog
+import fortio
+import histogram
+import prom
+
+# rate window of the cpu query if it can not be read from the query_url
+DEFAULT_RATE_WINDOW = 60
+
+RATE_WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600}
+
+COLUMNS = ["setup", "run", "target", "ActualQPS", "NumThreads", "grid_seconds", "rps",
+           "cpu_milli_avg", "cpu_milli_per_1k_rps", "mem_MiB_avg", "mem_MiB_per_connection"]
+
+
+def rate_window(query_url):
+    query = parse_qs(urlparse(query_url).query).get("query", [""])[0]
+    m = re.search(r"\[(\d+)([smh])\]", query)
+    if m is None:
+        return DEFAULT_RATE_WINDOW
+    return int(m.group(1)) * RATE_WINDOW_UNITS[m.group(2)]
+
+
+def read_usage(json_output_dir, resource_type, filename, source="prometheus"):
+    path = os.path.join(json_output_dir, prom.usage_filename(resource_type, filename, source))
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+# returns (timestamps, values) of a target. A rate at time t covers the
+# preceding rate window, its samples are moved to the middle of the window
+def usage_series(datasets, key, shift=0):
+    points = datasets.get(key) or []
+    timestamps = np.array([p["timestamp"] for p in points], dtype=np.float64) - shift
+    values = np.array([p["value"] for p in points], dtype=np.float64)
+    return timestamps, values
+
+
+# linear interpolation of a series onto the grid, nan outside of the series
+def resample(grid, timestamps, values):
+    out = np.full(len(grid), np.nan)
+    if len(timestamps) == 0:
+        return out
+    inside = (grid >= timestamps[0]) & (grid <= timestamps[-1])
+    out[inside] = np.interp(grid[inside], timestamps, values)
+    return out
+
+
+# requests per second on the grid, seconds without requests count as zero
+def requests_per_second(grid, log):
+    seconds = log.timestamp // 10 ** 9
+    counts = np.bincount(seconds - int(grid[0]), minlength=len(grid))
+    return counts[:len(grid)].astype(np.float64)
+
+
+def run_efficiency(json_output_dir, filename, source="prometheus"):
+    gd, log = accesslog.load_run(json_output_dir, filename)
+    if log is None:
+        print(gd["Labels"], "access log not found")
+        return []
+    start, duration = fortio.metrics_window(gd)
+    grid = np.arange(start, start + duration, dtype=np.int64)
+    rps = requests_per_second(grid, log)
+    cpu = read_usage(json_output_dir, "cpu", filename, source) or {}
+    mem = read_usage(json_output_dir, "mem", filename, source) or {}
+    # the cgroup samples record their rate window
+    shift = cpu.get("rate_window", rate_window(cpu.get("query_url", ""))) / 2.0
+
+    rows = []
+    for key in prom.TARGETS:
+        cpu_values = resample(grid, *usage_series(cpu, key, shift))
+        mem_values = resample(grid, *usage_series(mem, key))
+        if np.isnan(cpu_values).all() and np.isnan(mem_values).all():
+            continue
+        # only the seconds covered by both series are compared
+        valid = ~np.isnan(cpu_values) & ~np.isnan(mem_values)
+        rows.append({
+            "setup": histogram.setup_name(json_output_dir),
+            "run": gd["Labels"],
+            "target": key,
+            "ActualQPS": gd["ActualQPS"],
+            "NumThreads": gd["NumThreads"],
+            "grid_seconds": int(valid.sum()),
+            "requests": float(rps[valid].sum()),
+            "cpu_milli_seconds": float(cpu_values[valid].sum()),
+            "mem_MiB_seconds": float(mem_values[valid].sum()),
+        })
+    return rows
+
+
+# derived columns of one or more rows of the same target, the sums are pooled
+# so that the setup row weights every second of every run equally
+def derive(rows, setup, run):
+    seconds = sum(r["grid_seconds"] for r in rows)
+    threads = [r["NumThreads"] for r in rows]
+    out = {
+        "setup": setup,
+        "run": run,
+        "target": rows[0]["target"],
+        "ActualQPS": int(round(np.mean([r["ActualQPS"] for r in rows]))),
+        "NumThreads": threads[0] if len(set(threads)) == 1 else -1,
+        "grid_seconds": seconds,
+    }
+    if seconds == 0:
+        out.update(rps=-1, cpu_milli_avg=-1, cpu_milli_per_1k_rps=-1, mem_MiB_avg=-1, mem_MiB_per_connection=-1)
+        return out
+    rps = sum(r["requests"] for r in rows) / seconds
+    cpu = sum(r["cpu_milli_seconds"] for r in rows) / seconds
+    mem = sum(r["mem_MiB_seconds"] for r in rows) / seconds
+    out["rps"] = rps
+    out["cpu_milli_avg"] = cpu
+    out["cpu_milli_per_1k_rps"] = 1000.0 * cpu / rps if rps else -1
+    out["mem_MiB_avg"] = mem
+    out["mem_MiB_per_connection"] = mem / out["NumThreads"] if out["NumThreads"] > 0 else -1
+    return out
+
+
+def setup_efficiency(json_output_dir, per_run=False, source="prometheus"):
+    runs = []
+    for filename in sorted(os.listdir(json_output_dir)):
+        if fortio.is_fortio_result(filename):
+            runs.extend(run_efficiency(json_output_dir, filename, source))
+    setup = histogram.setup_name(json_output_dir)
+    out = []
+    if per_run:
+        out.extend(derive([r], setup, r["run"]) for r in runs)
+    for key in prom.TARGETS:
+        rows = [r for r in runs if r["target"] == key]
+        if rows:
+            out.append(derive(rows, setup, "all"))
+    return out
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    rows = []
+    for json_output_dir in args.json_output_dirs:
+        rows.extend(setup_efficiency(json_output_dir, args.per_run, args.resource_source))
+    lines = [",".join(COLUMNS)] + [",".join(str(row[c]) for c in COLUMNS) for row in rows]
+    if args.csv_output:
+        with open(args.csv_output, "w+") as out:
+            out.write("\n".join(lines) + "\n")
+        print("Wrote {} csv records to {}".format(len(rows), args.csv_output))
+    else:
+        print("\n".join(lines))
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Print CPU and memory usage per throughput and per connection of every container")
+    parser.add_argument(
+        "json_output_dirs",
+        help="json output directories, e.g. ../data/*/json",
+        nargs="+")
+    parser.add_argument(
+        "--per_run",
+        help="also print every run",
+        action="store_true")
+    parser.add_argument(
+        "--resource_source",
+        help="resource usage files to use, the prometheus series or the cgroup samples of runner.py --cgroup_interval",
+        choices=list(prom.USAGE_SOURCES),
+        default="prometheus")
+    parser.add_argument(
+        "--csv_output",
+        help="output path of the csv file, printed if not set",
+        default="")
+    return parser
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
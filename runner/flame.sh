@@ -29,14 +29,11 @@ set -x
 WD=$(dirname "${0}")
 WD=$(cd "${WD}" && pwd)
 
-FLAMEDIR="${WD}/../../FlameGraph"
-
 # Given output of `perf script` produce a flamegraph
 FILE=${1:?"get_perfdata script output"}
 
 SVG_FILE_NAME=${2:?"svg output file name"}
 
-"${FLAMEDIR}/stackcollapse-perf.pl" "${FILE}" | "${FLAMEDIR}/flamegraph.pl" > "${SVG_FILE_NAME}"
-
-echo "Wrote CPU flame graph ${SVG_FILE_NAME}"
+# Also writes the folded stacks next to the svg file
+python3 "${WD}/flamegraph.py" "${FILE}" --output_dir "$(dirname "${SVG_FILE_NAME}")" --svg_output "${SVG_FILE_NAME}"
 
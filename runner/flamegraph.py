@@ -0,0 +1,281 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Flame graphs from `perf script` output without the FlameGraph checkout. The
+# perf output is streamed line by line and collapsed into folded stacks
+# ("comm;root;...;leaf count" per line, like stackcollapse-perf.pl), so memory
+# is bounded by the number of distinct stacks instead of the size of the perf
+# output. SVGs are rendered from the folded stacks in the same layout as
+# flamegraph.pl. Several perf files are processed in parallel.
+
+from __future__ import print_function
+import argparse
+import collections
+import gzip
+import multiprocessing
+import os
+import re
+import zlib
+from xml.sax.saxutils import escape
+
+FOLDED_SUFFIX = ".folded"
+SVG_SUFFIX = ".svg"
+
+# "envoy 1234/1240 [002] 12345.678901:   10101010 cpu-clock:pppH:"
+SAMPLE_HEADER = re.compile(r"^(\S.*?)\s+(\d+)(?:/(\d+))?\s")
+SAMPLE_PERIOD = re.compile(r":\s*(\d+)?\s+(\S+):\s*$")
+# "\t    55d2c3a4b1c2 Envoy::Network::ConnectionImpl::onRead(unsigned long)+0x2a (/usr/local/bin/envoy)"
+STACK_FRAME = re.compile(r"^\s*([0-9a-fA-F]+)\s+(.+) \((.*)\)\s*$")
+STACK_FRAME_NO_MODULE = re.compile(r"^\s*([0-9a-fA-F]+)\s+(.+?)\s*$")
+SYMBOL_OFFSET = re.compile(r"\+0x[0-9a-fA-F]+$")
+
+FRAME_HEIGHT = 16
+FONT_SIZE = 12
+FONT_WIDTH = 0.59
+PAD_TOP = 3 * FONT_SIZE
+PAD_BOTTOM = 2 * FONT_SIZE + 10
+PAD_SIDE = 10
+
+
+def open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", errors="replace")
+    return open(path, "r", errors="replace")
+
+
+# cleans up a symbol the way stackcollapse-perf.pl does: offsets and C++
+# argument lists are removed and unknown symbols are named by their module
+def tidy_symbol(symbol, module):
+    symbol = SYMBOL_OFFSET.sub("", symbol)
+    if symbol == "[unknown]" and module and module != "[unknown]":
+        symbol = "[" + os.path.basename(module) + "]"
+    i = symbol.find("(")
+    while i >= 0 and symbol.startswith("(anonymous namespace)", i):
+        i = symbol.find("(", i + len("(anonymous namespace)"))
+    if i > 0:
+        symbol = symbol[:i]
+    return symbol.replace(";", ":") or "[unknown]"
+
+
+# streams `perf script` lines and returns {folded stack: count}. The count of
+# a sample is its period if perf printed one, otherwise 1
+def collapse_perf(lines, include_pid=False):
+    counts = collections.defaultdict(int)
+    comm = None
+    period = 1
+    frames = []
+
+    def flush():
+        if comm is not None and frames:
+            counts[";".join([comm] + frames[::-1])] += period
+
+    for line in lines:
+        if not line.strip():
+            flush()
+            comm = None
+            frames = []
+            continue
+        if line.startswith("#"):
+            continue
+        if not line[0].isspace():
+            flush()
+            frames = []
+            m = SAMPLE_HEADER.match(line)
+            if m is None:
+                comm = None
+                continue
+            comm = m.group(1).replace(" ", "_").replace(";", ":")
+            if include_pid:
+                comm += "-" + m.group(2)
+            p = SAMPLE_PERIOD.search(line)
+            period = int(p.group(1)) if p is not None and p.group(1) else 1
+            continue
+        if comm is None:
+            continue
+        m = STACK_FRAME.match(line)
+        if m is not None:
+            frames.append(tidy_symbol(m.group(2), m.group(3)))
+            continue
+        m = STACK_FRAME_NO_MODULE.match(line)
+        if m is not None:
+            frames.append(tidy_symbol(m.group(2), ""))
+    flush()
+    return counts
+
+
+def read_folded(path):
+    counts = collections.defaultdict(int)
+    with open_text(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack:
+                counts[stack] += int(float(count))
+    return counts
+
+
+def write_folded(counts, path):
+    with open(path, "w+") as out:
+        for stack in sorted(counts):
+            out.write("{} {}\n".format(stack, counts[stack]))
+
+
+# returns the frames of the merged stacks as (path, start, end) tuples, where
+# path is the tuple of function names from the root to the frame and start
+# and end are sample offsets. The root frame "all" has the path ("all",)
+def build_frames(counts):
+    frames = []
+    open_frames = []  # [(name, start)] of the previous stack
+    offset = 0
+    for stack in sorted(counts):
+        names = stack.split(";")
+        common = 0
+        while common < len(names) and common < len(open_frames) and open_frames[common][0] == names[common]:
+            common += 1
+        path = tuple(name for name, _ in open_frames)
+        for depth in range(len(open_frames) - 1, common - 1, -1):
+            frames.append((("all",) + path[:depth + 1], open_frames[depth][1], offset))
+        del open_frames[common:]
+        open_frames.extend((name, offset) for name in names[common:])
+        offset += counts[stack]
+    path = tuple(name for name, _ in open_frames)
+    for depth in range(len(open_frames) - 1, -1, -1):
+        frames.append((("all",) + path[:depth + 1], open_frames[depth][1], offset))
+    frames.append((("all",), 0, offset))
+    return frames, offset
+
+
+# the "hot" palette of flamegraph.pl, the color only depends on the name
+def hot_color(path):
+    h = zlib.crc32(path[-1].encode())
+    v1 = (h & 0xff) / 255.0
+    v2 = ((h >> 8) & 0xff) / 255.0
+    v3 = ((h >> 16) & 0xff) / 255.0
+    return "rgb({},{},{})".format(int(205 + 50 * v3), int(230 * v1), int(55 * v2))
+
+
+def frame_title(path, samples, total):
+    return "{} ({:,} samples, {:.2f}%)".format(path[-1], samples, 100.0 * samples / total if total else 0.0)
+
+
+# renders folded stacks into an SVG. color_fn(path) returns the fill of a
+# frame and title_fn(path, samples, total) its tooltip, frames narrower than
+# min_width pixels are left out
+def render_svg(counts, title="Flame Graph", width=1200, min_width=0.1, color_fn=hot_color, title_fn=frame_title):
+    frames, total = build_frames(counts)
+    scale = (width - 2 * PAD_SIDE) / float(total) if total else 0.0
+    frames = [f for f in frames if (f[2] - f[1]) * scale >= min_width]
+    depth = max([len(path) for path, _, _ in frames] or [1])
+    height = depth * FRAME_HEIGHT + PAD_TOP + PAD_BOTTOM
+
+    out = []
+    out.append('<?xml version="1.0" standalone="no"?>')
+    out.append('<svg version="1.1" width="{w}" height="{h}" viewBox="0 0 {w} {h}" '
+               'xmlns="http://www.w3.org/2000/svg">'.format(w=width, h=height))
+    out.append('<style type="text/css">text {{ font-family:Verdana; font-size:{}px; fill:rgb(0,0,0); }} '
+               '#title {{ text-anchor:middle; font-size:17px; }}</style>'.format(FONT_SIZE))
+    out.append('<rect x="0.0" y="0" width="{}" height="{}" fill="rgb(238,238,238)" />'.format(width, height))
+    out.append('<text id="title" x="{:.2f}" y="24" >{}</text>'.format(width / 2.0, escape(title)))
+    out.append('<g id="frames">')
+    for path, start, end in frames:
+        x = PAD_SIDE + start * scale
+        w = (end - start) * scale
+        y = height - PAD_BOTTOM - len(path) * FRAME_HEIGHT
+        chars = int(w / (FONT_SIZE * FONT_WIDTH))
+        text = path[-1] if len(path[-1]) <= chars else (path[-1][:chars - 2] + ".." if chars >= 3 else "")
+        out.append('<g >\n<title>{}</title><rect x="{:.1f}" y="{}" width="{:.1f}" height="{:.1f}" fill="{}" '
+                   'rx="2" ry="2" />\n<text  x="{:.2f}" y="{:.1f}" >{}</text>\n</g>'.format(
+                       escape(title_fn(path, end - start, total)), x, y, w, FRAME_HEIGHT - 1.0, color_fn(path),
+                       x + 3, y + FRAME_HEIGHT - 4.5, escape(text)))
+    out.append('</g>')
+    out.append('</svg>')
+    return "\n".join(out) + "\n"
+
+
+def output_base(path, output_dir=""):
+    name = os.path.basename(path)
+    for suffix in [".gz", ".perf", FOLDED_SUFFIX]:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return os.path.join(output_dir or os.path.dirname(path), name)
+
+
+# collapses (unless the input is already folded) and renders one file
+def process_file(path, output_dir="", svg_output="", write_svg=True, title=""):
+    if output_base(path) + FOLDED_SUFFIX == path or path.endswith(FOLDED_SUFFIX + ".gz"):
+        counts = read_folded(path)
+    else:
+        with open_text(path) as f:
+            counts = collapse_perf(f)
+        write_folded(counts, output_base(path, output_dir) + FOLDED_SUFFIX)
+    if write_svg:
+        svg_output = svg_output or output_base(path, output_dir) + SVG_SUFFIX
+        with open(svg_output, "w+") as out:
+            out.write(render_svg(counts, title or os.path.basename(output_base(path))))
+        print("Wrote CPU flame graph", svg_output)
+    return path, len(counts), sum(counts.values())
+
+
+def process_file_args(args):
+    return process_file(*args)
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    if args.svg_output and len(args.files) != 1:
+        raise Exception("--svg_output requires a single input file")
+    jobs = [(path, args.output_dir, args.svg_output, not args.no_svg, args.title) for path in args.files]
+    processes = max(1, min(args.processes or multiprocessing.cpu_count(), len(jobs)))
+    if processes == 1:
+        results = [process_file_args(job) for job in jobs]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(process_file_args, jobs)
+    for path, stacks, samples in results:
+        print("{}: {} stacks, {} samples".format(path, stacks, samples))
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Collapse perf script output into folded stacks and render flame graphs")
+    parser.add_argument(
+        "files",
+        help="perf script output (.perf or .perf.gz) or folded stacks (.folded)",
+        nargs="+")
+    parser.add_argument(
+        "--output_dir",
+        help="output directory of the folded stacks and svgs, defaults to the directory of each input",
+        default="")
+    parser.add_argument(
+        "--svg_output",
+        help="output path of the svg if there is a single input file",
+        default="")
+    parser.add_argument(
+        "--no_svg",
+        help="only write the folded stacks",
+        action="store_true")
+    parser.add_argument(
+        "--title",
+        help="title of the flame graphs, defaults to the file name",
+        default="")
+    parser.add_argument(
+        "--processes",
+        help="number of files processed in parallel, defaults to the number of cores",
+        type=int,
+        default=0)
+    return parser
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
@@ -20,15 +20,25 @@
 from __future__ import print_function
 import json
 import os
+import re
 import shlex
 import requests
 from datetime import datetime
 import calendar
 import argparse
+import concurrent.futures
+import heapq
 import subprocess
+import tarfile
 import tempfile
 import prom
-from subprocess import getoutput
+import cgroupsampler
+import histogram
+import inventory
+import latencystore
+import accesslog
+import promcache
+import steadystate
 
 """
     returns data in a single line format
@@ -38,6 +48,10 @@ from subprocess import getoutput
 
 NAMESPACE = "fortio"
 
+# return codes of the successful requests of the gRPC and TCP runs
+OK_RET_CODES = ["SERVING", "OK"]
+
+
 def convert_data(data):
     obj = {}
 
@@ -74,6 +88,15 @@ def convert_data(data):
         obj["errorPercent"] = 100 * \
             (int(data["Sizes"]["Count"]) - success) / int(data["Sizes"]["Count"])
         obj["Payload"] = int(data['Sizes']['Avg'])
+    else:
+        # e.g. "GRPC Ping" and "TCP" count the successful requests as
+        # SERVING and OK
+        count = int(h["Count"])
+        success = sum(int(data["RetCodes"].get(code, 0)) for code in OK_RET_CODES)
+        obj["errorPercent"] = 100 * (count - success) / count if count > 0 else 0
+
+    # number of load generators of a merged run
+    obj["Clients"] = len(data.get("Clients") or []) or 1
     return obj
 
 
@@ -106,85 +129,417 @@ def run_command(command):
     process.wait()
 
 
-def sync_fortio(promUrl="", csv=None, csv_output="", namespace=NAMESPACE, json_output_dir="../data", resource_usage_targets=""):
-    get_fortioclient_pod_cmd = "kubectl -n {namespace} get pods | grep fortioclient".format(namespace=namespace)
-    fortioclient_pod_name = getoutput(get_fortioclient_pod_cmd).split(" ")[0]
-    copy_json_to_results_cmd = "kubectl cp -c shell {namespace}/{fortioclient}:/var/lib/fortio {dir}"\
-        .format(namespace=namespace, fortioclient=fortioclient_pod_name, dir=json_output_dir)
-    run_command(copy_json_to_results_cmd)
-    copy_access_logs_to_results_cmd = "kubectl cp -c shell {namespace}/{fortioclient}:/var/lib/access-logs {dir}"\
-        .format(namespace=namespace, fortioclient=fortioclient_pod_name, dir=json_output_dir)
-    run_command(copy_access_logs_to_results_cmd)
-
-    with tempfile.TemporaryDirectory() as temp_dir_path:
-        get_fortio_json_cmd = "kubectl cp -c shell {namespace}/{fortioclient}:/var/lib/fortio {tempdir}"\
-            .format(namespace=namespace, fortioclient=fortioclient_pod_name, tempdir=temp_dir_path)
-        run_command(get_fortio_json_cmd)
-
-        data = []
-        for filename in os.listdir(temp_dir_path):
-            print(filename)
-            with open(os.path.join(temp_dir_path, filename), 'r') as f:
+# Fortio result files are named like 2023-04-24-182826_f5e5d429_qps_100_c_10_d_300_baseline_1.json
+FORTIO_RESULT_FILENAME = re.compile(r"^\d{4}-\d{2}-\d{2}-\d{6}_.*\.json$")
+
+# the results of the load generators of a run with several of them end with
+# e.g. _client_2_of_3.json, they are merged into one result of the run
+CLIENT_RESULT_FILENAME = re.compile(r"^(.*)_client_(\d+)_of_(\d+)\.json$")
+CLIENT_LABELS = re.compile(r"_client-(\d+)-of-(\d+)$")
+
+
+def is_client_result(filename):
+    return CLIENT_RESULT_FILENAME.match(os.path.basename(filename)) is not None
+
+
+def is_fortio_result(filename):
+    return FORTIO_RESULT_FILENAME.match(os.path.basename(filename)) is not None and not is_client_result(filename)
+
+
+# start of the run in unix seconds
+def run_start(gd):
+    sd = datetime.strptime(gd['StartTime'][:19], "%Y-%m-%dT%H:%M:%S")
+    return calendar.timegm(sd.utctimetuple())
+
+
+# returns the measured window (start in unix seconds, duration in seconds)
+# after skipping the beginning and the end of the run. The skips are the
+# detected steady state cuts of the run if steadystate.py set them
+def metrics_window(gd):
+    warmup = gd.get('WarmupCut', METRICS_START_SKIP_DURATION)
+    cooldown = gd.get('CooldownCut', METRICS_END_SKIP_DURATION)
+    return run_start(gd) + warmup, gd['ActualDuration'] - warmup - cooldown
+
+
+REMOTE_RESULTS_ROOT = "/var/lib"
+REMOTE_RESULTS_DIRS = ["fortio", "access-logs"]
+
+
+def fortioclient_pod(namespace=NAMESPACE):
+    return inventory.INVENTORY.pod("loadgenerator", namespace).name
+
+
+def fortioclient_pods(namespace=NAMESPACE):
+    return [p.name for p in inventory.INVENTORY.pods_of("loadgenerator", namespace)]
+
+
+# returns {path relative to REMOTE_RESULTS_ROOT: size} of the result files in the load generator pod
+def list_remote_files(pod, namespace=NAMESPACE):
+    cmd = ["kubectl", "-n", namespace, "exec", pod, "-c", "shell", "--",
+           "find"] + [REMOTE_RESULTS_ROOT + "/" + d for d in REMOTE_RESULTS_DIRS] + [
+           "-type", "f", "-exec", "stat", "-c", "%n %s", "{}", "+"]
+    out = subprocess.check_output(cmd, universal_newlines=True)
+    files = {}
+    for line in out.splitlines():
+        path, _, size = line.rpartition(" ")
+        if path.startswith(REMOTE_RESULTS_ROOT + "/"):
+            files[path[len(REMOTE_RESULTS_ROOT) + 1:]] = int(size)
+    return files
+
+
+# files that are missing locally or whose size has changed, e.g. an access log
+# that was written again with the same label
+def new_remote_files(remote_files, json_output_dir):
+    new_files = []
+    for path, size in sorted(remote_files.items()):
+        local_path = os.path.join(json_output_dir, os.path.basename(path))
+        if not os.path.exists(local_path) or os.path.getsize(local_path) != size:
+            new_files.append(path)
+    return new_files
+
+
+# pulls the given files in one compressed tar stream into json_output_dir
+def pull_remote_files(pod, paths, json_output_dir, namespace=NAMESPACE):
+    cmd = ["kubectl", "-n", namespace, "exec", pod, "-c", "shell", "--",
+           "tar", "czf", "-", "-C", REMOTE_RESULTS_ROOT] + paths
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    with tarfile.open(fileobj=process.stdout, mode="r|gz") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            member.name = os.path.basename(member.name)
+            tar.extract(member, json_output_dir)
+    if process.wait() != 0:
+        raise Exception("failed to pull results from " + pod)
+
+
+# copies the results that are not yet in json_output_dir from the load
+# generator pods and returns their filenames
+def sync_results(json_output_dir, namespace=NAMESPACE):
+    os.makedirs(json_output_dir, exist_ok=True)
+    pulled = []
+    for pod in fortioclient_pods(namespace):
+        new_files = new_remote_files(list_remote_files(pod, namespace), json_output_dir)
+        print("Pulling {} new files from {}".format(len(new_files), pod))
+        if new_files:
+            pull_remote_files(pod, new_files, json_output_dir, namespace)
+        pulled += [os.path.basename(path) for path in new_files]
+    return pulled
+
+
+ACCESS_LOG_TIMESTAMP = re.compile(rb'"timestamp":(\d+)')
+ACCESS_LOG_THREAD = re.compile(rb'"thread":(\d+)')
+
+
+# (timestamp, line) of the requests of an access log, the thread ids are
+# offset so that the threads of the clients stay apart
+def access_log_lines(path, thread_offset=0):
+    def offset_thread(m):
+        return b'"thread":' + str(int(m.group(1)) + thread_offset).encode()
+
+    with open(path, "rb") as f:
+        for line in f:
+            m = ACCESS_LOG_TIMESTAMP.search(line)
+            if m is None:
+                continue
+            if thread_offset:
+                line = ACCESS_LOG_THREAD.sub(offset_thread, line, count=1)
+            yield int(m.group(1)), line
+
+
+# merges the access logs of the clients into one log ordered by timestamp and
+# returns the first request of every client in unix seconds
+def merge_access_logs(paths, thread_offsets, output):
+    firsts = []
+    for path in paths:
+        first = next(access_log_lines(path), None)
+        firsts.append(first[0] / 10 ** 9 if first is not None else None)
+    with open(output, "wb") as out:
+        for _, line in heapq.merge(*[access_log_lines(p, o) for p, o in zip(paths, thread_offsets)]):
+            out.write(line if line.endswith(b"\n") else line + b"\n")
+    return firsts
+
+
+def merge_counts(stats):
+    count = sum(int(s["Count"]) for s in stats)
+    total = sum(float(s["Sum"]) for s in stats)
+    return {"Count": count, "Min": min(s["Min"] for s in stats), "Max": max(s["Max"] for s in stats),
+            "Sum": total, "Avg": total / count if count else 0}
+
+
+def merge_histograms(histograms):
+    histograms = [h for h in histograms if h and h.get("Count")]
+    if not histograms:
+        return {"Count": 0, "Min": 0, "Max": 0, "Sum": 0, "Avg": 0, "Data": None}
+    return histogram.Histogram.merge([histogram.Histogram.from_fortio(h) for h in histograms]).to_fortio()
+
+
+# one result of the run from the results of its clients: the requested and
+# actual qps and the connections are summed, the histograms and return codes
+# merged and the run starts with the first client
+def merge_results(results):
+    merged = dict(results[0])
+    merged["Labels"] = CLIENT_LABELS.sub("", results[0]["Labels"])
+    merged["ID"] = CLIENT_RESULT_FILENAME.match(results[0]["ID"] + ".json").group(1)
+    merged["StartTime"] = min(r["StartTime"] for r in results)
+    if all(r["RequestedQPS"] != "max" for r in results):
+        merged["RequestedQPS"] = str(sum(int(round(float(r["RequestedQPS"]))) for r in results))
+    merged["ActualQPS"] = sum(float(r["ActualQPS"]) for r in results)
+    merged["ActualDuration"] = max(r["ActualDuration"] for r in results)
+    merged["NumThreads"] = sum(int(r["NumThreads"]) for r in results)
+    merged["DurationHistogram"] = merge_histograms([r["DurationHistogram"] for r in results])
+    merged["ErrorsDurationHistogram"] = merge_histograms([r.get("ErrorsDurationHistogram") for r in results])
+    ret_codes = {}
+    for r in results:
+        for code, count in r.get("RetCodes", {}).items():
+            ret_codes[code] = ret_codes.get(code, 0) + int(count)
+    merged["RetCodes"] = ret_codes
+    for key in ["Sizes", "HeaderSizes"]:
+        if all(r.get(key) for r in results):
+            merged[key] = merge_counts([r[key] for r in results])
+    return merged
+
+
+def client_breakdown(index, data, first_request):
+    gd = convert_data(data)
+    return {"Client": index, "Labels": data["Labels"], "StartTime": data["StartTime"], "FirstRequest": first_request,
+            "RequestedQPS": gd["RequestedQPS"], "ActualQPS": data["ActualQPS"], "NumThreads": gd["NumThreads"],
+            "Count": data["DurationHistogram"]["Count"], "errorPercent": gd.get("errorPercent"),
+            "p50": gd.get("p50"), "p99": gd.get("p99")}
+
+
+# merges the results and access logs of the runs with several clients whose
+# results are all in json_output_dir into a result of the run, with the
+# breakdown of the clients in "Clients" and the spread of their first
+# requests in "ClientStartSkew". Returns the filenames of the merged results
+def merge_client_results(json_output_dir):
+    runs = {}
+    for filename in sorted(os.listdir(json_output_dir)):
+        m = CLIENT_RESULT_FILENAME.match(filename)
+        if m is not None:
+            runs.setdefault(run_id_of_result(filename), {})[int(m.group(2))] = (filename, int(m.group(3)))
+    merged_files = []
+    for run_id, clients in sorted(runs.items()):
+        n = max(total for _, total in clients.values())
+        if sorted(clients) != list(range(1, n + 1)):
+            print("Run {} has results of clients {} of {}, not merging".format(run_id, sorted(clients), n))
+            continue
+        filenames = [clients[i][0] for i in range(1, n + 1)]
+        output = CLIENT_RESULT_FILENAME.match(filenames[0]).group(1) + ".json"
+        output_path = os.path.join(json_output_dir, output)
+        if os.path.exists(output_path) and all(
+                os.path.getmtime(os.path.join(json_output_dir, f)) <= os.path.getmtime(output_path) for f in filenames):
+            continue
+        results = []
+        for filename in filenames:
+            with open(os.path.join(json_output_dir, filename), "r") as f:
+                results.append(json.load(f, strict=False))
+        merged = merge_results(results)
+
+        access_logs = [accesslog.access_log_filename(r) for r in results]
+        firsts = [None] * n
+        if all(a is not None and os.path.exists(os.path.join(json_output_dir, a)) for a in access_logs):
+            merged_log = "access-log-file_{}-clients-{}.json".format(run_id, n)
+            offsets = [sum(int(r["NumThreads"]) for r in results[:i]) for i in range(n)]
+            firsts = merge_access_logs([os.path.join(json_output_dir, a) for a in access_logs], offsets,
+                                       os.path.join(json_output_dir, merged_log))
+            merged["AccessLoggerInfo"] = "mode json to /var/lib/access-logs/" + merged_log
+        else:
+            merged.pop("AccessLoggerInfo", None)
+        merged["Clients"] = [client_breakdown(i + 1, r, firsts[i]) for i, r in enumerate(results)]
+        seen = [t for t in firsts if t is not None]
+        merged["ClientStartSkew"] = max(seen) - min(seen) if len(seen) == n else None
+        with open(output_path, "w+") as out:
+            out.write(json.dumps(merged, indent=2))
+        print("Merged {} clients of run {} into {}, start skew {}s".format(n, run_id, output, merged["ClientStartSkew"]))
+        merged_files.append(output)
+    return merged_files
+
+
+def run_id_of_result(filename):
+    return os.path.basename(filename).split("_")[1]
+
+
+# run ids of the rows already in the csv file
+def read_csv_run_ids(csv_output):
+    run_ids = set()
+    if not csv_output or not os.path.exists(csv_output):
+        return run_ids
+    with open(csv_output, "r") as f:
+        header = f.readline().strip().split(",")
+        if "Labels" not in header:
+            return run_ids
+        labels = header.index("Labels")
+        for line in f:
+            row = line.strip().split(",")
+            if len(row) > labels:
+                run_ids.add(row[labels].split("_")[0])
+    return run_ids
+
+
+# runs that have no row in the csv file, e.g. because of too many errors, are
+# listed in <csv file>.skipped so that later syncs leave them out as well
+def skipped_filename(csv_output):
+    return csv_output + ".skipped"
+
+
+def read_skipped_run_ids(csv_output):
+    run_ids = set()
+    if not csv_output or not os.path.exists(skipped_filename(csv_output)):
+        return run_ids
+    with open(skipped_filename(csv_output), "r") as f:
+        for line in f:
+            if line.strip():
+                run_ids.add(json.loads(line)["run_id"])
+    return run_ids
+
+
+def write_skipped(skipped, csv_output, append=False):
+    if not csv_output or (append and not skipped):
+        return
+    with open(skipped_filename(csv_output), "a" if append else "w+") as out:
+        for labels, reason in skipped:
+            out.write(json.dumps({"run_id": labels.split("_")[0], "labels": labels, "reason": reason}) + "\n")
+
+
+def sync_fortio(promUrl="", csv=None, csv_output="", namespace=NAMESPACE, json_output_dir="../data", resource_usage_targets="", columnar_output_dir="", aggregate=True,
+                concurrency=4, retries=3, backoff=0.5, cache_dir="", cache_max_mb=1024, offline=False, full=False,
+                step=prom.DEFAULT_STEP, rate_window=prom.DEFAULT_RATE_WINDOW, steady_state=False):
+    # in offline mode the results already in json_output_dir are used and
+    # prometheus data is only read from the cache
+    if not offline:
+        sync_results(json_output_dir, namespace)
+    merge_client_results(json_output_dir)
+    if columnar_output_dir == "":
+        columnar_output_dir = os.path.join(json_output_dir, "columnar")
+    latencystore.convert_dir(json_output_dir, columnar_output_dir)
+    session = prom.new_session(pool_size=concurrency, retries=retries, backoff=backoff) if promUrl else None
+
+    cache = None
+    if cache_dir != "":
+        cache = promcache.QueryCache(cache_dir, max_bytes=cache_max_mb * 1024 * 1024, offline=offline)
+        cache.seed_from_dir(json_output_dir)
+    elif offline:
+        raise Exception("offline mode requires a cache directory")
+
+    # the runs without cgroup samples take the CPU usage of their steady state
+    # detection from prometheus
+    cpu_fetcher = None
+    if steady_state and promUrl:
+        cpu_fetcher = steadystate.prometheus_cpu_fetcher(promUrl, resource_usage_targets, aggregate, session, cache,
+                                                         step, rate_window)
+
+    # only the runs that are not yet in the csv or skipped are processed and
+    # appended unless the whole csv is rewritten
+    existing_run_ids = set() if full else read_csv_run_ids(csv_output)
+    skipped_run_ids = set() if full else read_skipped_run_ids(csv_output)
+    filenames = [f for f in sorted(os.listdir(json_output_dir))
+                 if is_fortio_result(f) and run_id_of_result(f) not in existing_run_ids | skipped_run_ids]
+    print("{} runs to process, {} already in {}, {} skipped before".format(
+        len(filenames), len(existing_run_ids), csv_output, len(skipped_run_ids)))
+
+    runs = []
+    # (labels, reason) of the runs left out of the csv
+    skipped = []
+    for filename in filenames:
+        print(filename)
+        with open(os.path.join(json_output_dir, filename), 'r') as f:
+            try:
+                data_dict = json.load(f, strict=False)
+                one_char = f.read(1)
+                if not one_char:
+                    print("json file is not empty")
+            except json.JSONDecodeError as e:
+                print(f.read())
+                while True:
+                    line = f.readline()
+                    print(line)
+                    if "" == line:
+                        print("file finished!")
+                        break
+                print(e)
+
+            gd = convert_data(data_dict)
+            if gd is None:
+                continue
+            st = gd['StartTime']
+            if steady_state:
+                if steadystate.read_cuts(json_output_dir, filename) is None:
+                    steadystate.detect(json_output_dir, filename, data_dict, gd, columnar_output_dir, cpu_fetcher)
+                if steadystate.apply_cuts(json_output_dir, filename, gd):
+                    steadystate.apply_to_latencies(json_output_dir, filename, data_dict, gd, columnar_output_dir)
+            gd.setdefault('WarmupCut', METRICS_START_SKIP_DURATION)
+            gd.setdefault('CooldownCut', METRICS_END_SKIP_DURATION)
+            # the high resolution usage of runs sampled by runner.py --cgroup_interval
+            cgroupsampler.write_usage_files(json_output_dir, filename, run_id_of_result(filename), *metrics_window(gd))
+
+            if promUrl:
+                sd = datetime.strptime(st[:19], "%Y-%m-%dT%H:%M:%S")
+                print("Fetching prometheus metrics for", sd, gd["Labels"])
+                if gd.get('errorPercent', 0) > 10:
+                    print("... Run resulted in", gd['errorPercent'], "% errors")
+                    skipped.append((gd["Labels"], "{}% errors".format(gd['errorPercent'])))
+                    continue
+                min_duration = gd['WarmupCut'] + gd['CooldownCut']
+                if min_duration > gd['ActualDuration']:
+                    print("... {} duration={}s is less than minimum {}s".format(
+                        gd["Labels"], gd['ActualDuration'], min_duration))
+                    skipped.append((gd["Labels"], "duration {}s is less than {}s".format(
+                        gd['ActualDuration'], min_duration)))
+                    continue
+                prom_start, duration = metrics_window(gd)
+                p = prom.Prom(promUrl, duration, start=prom_start, resource_usage_targets=resource_usage_targets, json_output_dir=json_output_dir, filename_suffix=filename, aggregate=aggregate, session=session, cache=cache, step=step, rate_window=rate_window)
+                runs.append((gd, p))
+                continue
+
+            runs.append((gd, None))
+
+    data = []
+    # the fetches may finish in any order, the rows keep the order of the runs
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        futures = [executor.submit(p.fetch_targets_metrics) if p is not None else None for gd, p in runs]
+        for (gd, p), future in zip(runs, futures):
+            if future is not None:
+                # runs of which the offline cache has neither the queries nor
+                # a seeded usage file are left out
                 try:
-                    data_dict = json.load(f, strict=False)
-                    one_char = f.read(1)
-                    if not one_char:
-                        print("json file is not empty")
-                except json.JSONDecodeError as e:
-                    print(f.read())
-                    while True:
-                        line = f.readline()
-                        print(line)
-                        if "" == line:
-                            print("file finished!")
-                            break
-                    print(e)
-
-                gd = convert_data(data_dict)
-                if gd is None:
+                    prom_metrics = future.result()
+                except prom.NotCached as e:
+                    print("... Not cached, skipped {}: {}".format(gd["Labels"], e))
+                    continue
+                if not prom_metrics:
+                    print("... Not found", gd["Labels"])
+                    skipped.append((gd["Labels"], "prometheus metrics not found"))
                     continue
-                st = gd['StartTime']
-
-                if promUrl:
-                    sd = datetime.strptime(st[:19], "%Y-%m-%dT%H:%M:%S")
-                    print("Fetching prometheus metrics for", sd, gd["Labels"])
-                    if gd.get('errorPercent', 0) > 10:
-                        print("... Run resulted in", gd['errorPercent'], "% errors")
-                        continue
-                    min_duration = METRICS_START_SKIP_DURATION + METRICS_END_SKIP_DURATION
-                    if min_duration > gd['ActualDuration']:
-                        print("... {} duration={}s is less than minimum {}s".format(
-                            gd["Labels"], gd['ActualDuration'], min_duration))
-                        continue
-                    prom_start = calendar.timegm(
-                        sd.utctimetuple()) + METRICS_START_SKIP_DURATION
-                    duration = gd['ActualDuration'] - min_duration
-                    p = prom.Prom(promUrl, duration, start=prom_start, resource_usage_targets=resource_usage_targets, json_output_dir=json_output_dir, filename_suffix=filename)
-                    prom_metrics = p.fetch_targets_cpu_and_mem()
-                    if not prom_metrics:
-                        print("... Not found")
-                        continue
-                    else:
-                        print("")
-
-                    gd.update(prom_metrics)
-
-                data.append(gd)
+                gd.update(prom_metrics)
+            data.append(gd)
 
     if csv is not None:
-        write_csv(csv, data, csv_output)
+        write_csv(csv, data, csv_output, append=not full)
+        write_skipped(skipped, csv_output, append=not full)
 
     return 0
 
-def write_csv(keys, data, csv_output):
+def write_csv(keys, data, csv_output, append=False):
+    write_header = True
     if csv_output is None or csv_output == "":
         fd, csv_output = tempfile.mkstemp(suffix=".csv")
         out = os.fdopen(fd, "wt")
+    elif append and os.path.exists(csv_output) and os.path.getsize(csv_output) > 0:
+        # the rows are appended with the columns of the existing file
+        with open(csv_output, "r") as f:
+            header = f.readline().strip()
+        if header != keys:
+            print("Appending with the existing columns of " + csv_output)
+            keys = header
+        out = open(csv_output, "a")
+        write_header = False
     else:
         out = open(csv_output, "w+")
 
     lst = keys.split(',')
-    out.write(keys + "\n")
+    if write_header:
+        out.write(keys + "\n")
 
     for gd in data:
         row = []
@@ -196,27 +551,46 @@ def write_csv(keys, data, csv_output):
     out.close()
     print("Wrote {} csv records to {}".format(len(data), csv_output))
 
+# the Fortio columns of the csv file, followed by the metric columns
+CSV_COLUMNS = "StartTime,ActualDuration,Labels,RunType,NumThreads,RequestedQPS,ActualQPS,errorPercent,avg,min,max,p50,p90,p99,p99.9,WarmupCut,CooldownCut"
+
+
+# the default columns of the csv file, after the targets are loaded
+def default_csv():
+    return ",".join([CSV_COLUMNS] + prom.metric_columns(prom.METRICS))
+
+
 def main(argv):
     args = get_parser().parse_args(argv)
+    if args.targets_file:
+        prom.load_targets(args.targets_file)
     return sync_fortio(
         args.prometheus,
-        args.csv,
+        args.csv or default_csv(),
         args.csv_output,
         NAMESPACE,
         args.json_output_dir,
-        args.resource_usage_targets)
+        args.resource_usage_targets,
+        args.columnar_output_dir,
+        not args.no_aggregate,
+        args.concurrency,
+        args.retries,
+        args.backoff,
+        args.cache_dir,
+        args.cache_max_mb,
+        args.offline,
+        args.full,
+        args.prom_step,
+        args.rate_window,
+        args.steady_state)
 
 
 def get_parser():
     parser = argparse.ArgumentParser("Fetch and upload results to bigQuery")
     parser.add_argument(
         "--csv",
-        help="columns in the csv file",
-        default="StartTime,ActualDuration,Labels,NumThreads,RequestedQPS,ActualQPS,errorPercent,avg,min,max,p50,p90,p99,p99.9,"
-                "cpu_milli_avg_main_fortioclient,cpu_milli_avg_http-server_http-server,cpu_milli_avg_demo-service_demo-service,"
-                "cpu_milli_avg_istio-proxy_istio-ingressgateway,cpu_milli_avg_istio-proxy_http-server,cpu_milli_avg_istio-proxy_demo-service,cpu_milli_avg_cilium_cilium-agent,"
-                "mem_MiB_avg_main_fortioclient,mem_MiB_avg_http-server_http-server,mem_MiB_avg_demo-service_demo-service,"
-                "mem_MiB_avg_istio-proxy_istio-ingressgateway,mem_MiB_avg_istio-proxy_http-server,mem_MiB_avg_istio-proxy_demo-service,mem_MiB_avg_cilium_cilium-agent")
+        help="columns in the csv file, defaults to the Fortio columns and the metric columns of all targets",
+        default="")
     parser.add_argument(
         "--csv_output",
         help="output path of csv file",
@@ -233,6 +607,58 @@ def get_parser():
         "--resource_usage_targets",
         help="resource usage targets",
         required=True)
+    parser.add_argument(
+        "--targets_file",
+        help="json file of the resource usage targets and setups, defaults to targets.json next to prom.py. "
+             "The default --csv has the metric columns of its targets",
+        default="")
+    parser.add_argument(
+        "--columnar_output_dir",
+        help="output directory of the columnar access log files, defaults to <json_output_dir>/columnar",
+        default="")
+    parser.add_argument(
+        "--no_aggregate",
+        help="do not sum the series of each pod and container in prometheus",
+        action="store_true")
+    parser.add_argument(
+        "--concurrency",
+        help="number of concurrent prometheus queries",
+        type=int,
+        default=4)
+    parser.add_argument(
+        "--retries",
+        help="number of retries of a failed prometheus query",
+        type=int,
+        default=3)
+    parser.add_argument(
+        "--backoff",
+        help="backoff factor in seconds between prometheus query retries",
+        type=float,
+        default=0.5)
+    parser.add_argument(
+        "--cache_dir",
+        help="directory of the prometheus query cache, disabled if blank",
+        default="")
+    parser.add_argument(
+        "--cache_max_mb",
+        help="maximum size of the prometheus query cache in MiB",
+        type=int,
+        default=1024)
+    parser.add_argument(
+        "--offline",
+        help="do not copy results from the load generator and only read prometheus data from the cache",
+        action="store_true")
+    parser.add_argument(
+        "--full",
+        help="rewrite the csv file with all runs instead of appending the new runs",
+        action="store_true")
+    parser.add_argument(
+        "--steady_state",
+        help="detect the warm-up and cool-down of every run and use them instead of the fixed {}s and {}s skips "
+             "for the prometheus window and the latency statistics".format(
+                 METRICS_START_SKIP_DURATION, METRICS_END_SKIP_DURATION),
+        action="store_true")
+    prom.add_resolution_arguments(parser)
     return parser
 
 
@@ -0,0 +1,266 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Regression gate of a new set of runs against a pinned reference set, e.g.
+# after a mesh, kernel or image upgrade. The runs of the summary csv files of
+# fortio.py are grouped by their requested qps and connections, and the
+# repetitions of each point give the noise of every metric. A metric
+# regresses if its mean got worse by more than its tolerance and by more than
+# the noise, tested with Welch's t-test at 95% confidence. Exits with 1 if any
+# metric regressed.
+
+from __future__ import print_function
+import argparse
+import collections
+import csv
+import fnmatch
+import glob
+import math
+import os
+
+# pattern of metric columns, direction that is worse, relative or absolute
+# tolerance. The first matching pattern applies
+TOLERANCE = collections.namedtuple('Tolerance', ['pattern', 'worse', 'kind', 'value'])
+TOLERANCES = [
+    TOLERANCE("ActualQPS", "lower", "relative", 0.02),
+    TOLERANCE("errorPercent", "higher", "absolute", 0.1),
+    TOLERANCE("avg", "higher", "relative", 0.1),
+    TOLERANCE("p50", "higher", "relative", 0.1),
+    TOLERANCE("p90", "higher", "relative", 0.1),
+    TOLERANCE("p99", "higher", "relative", 0.15),
+    TOLERANCE("p99.9", "higher", "relative", 0.25),
+    TOLERANCE("cpu_milli_avg_*", "higher", "relative", 0.1),
+    TOLERANCE("mem_MiB_avg_*", "higher", "relative", 0.1),
+    TOLERANCE("throttled_periods_avg_*", "higher", "relative", 0.25),
+    TOLERANCE("net_*_avg_*", "higher", "relative", 0.1),
+    TOLERANCE("cluster_cpu_milli_avg", "higher", "relative", 0.1),
+    TOLERANCE("cluster_context_switches_avg", "higher", "relative", 0.15),
+]
+
+# two-sided 95% critical values of Student's t by degrees of freedom
+T_975 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131,
+         2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+Z_975 = 1.96
+
+COLUMNS = ["qps", "conn", "metric", "reference_mean", "reference_sd", "reference_n", "candidate_mean", "candidate_sd",
+           "candidate_n", "change", "tolerance", "noise", "status"]
+
+STATUS_ORDER = ["REGRESSION", "NOISY", "IMPROVED", "OK"]
+
+
+def summary_csv(path):
+    if os.path.isdir(path):
+        found = sorted(glob.glob(os.path.join(path, "*-summary.csv")))
+        if len(found) != 1:
+            raise Exception("expected one *-summary.csv in {}, found {}".format(path, found))
+        return found[0]
+    return path
+
+
+def to_value(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    # prometheus metrics of targets that were not found are -1
+    return value if value >= 0 and not math.isnan(value) else None
+
+
+# {(qps, conn): {metric: [values of the repetitions]}}
+def load_points(path, tolerances):
+    points = collections.OrderedDict()
+    with open(summary_csv(path), "r") as f:
+        for row in csv.DictReader(f):
+            key = (int(float(row["RequestedQPS"])), int(float(row["NumThreads"])))
+            metrics = points.setdefault(key, collections.OrderedDict())
+            for column, value in row.items():
+                if find_tolerance(column, tolerances) is None:
+                    continue
+                value = to_value(value)
+                if value is not None:
+                    metrics.setdefault(column, []).append(value)
+    return points
+
+
+def find_tolerance(metric, tolerances):
+    for tolerance in tolerances:
+        if fnmatch.fnmatchcase(metric, tolerance.pattern):
+            return tolerance
+    return None
+
+
+def mean_sd(values):
+    mean = sum(values) / len(values)
+    if len(values) < 2:
+        return mean, None
+    return mean, math.sqrt(sum((v - mean) ** 2 for v in values) / (len(values) - 1))
+
+
+def t_critical(df):
+    if df is None or df >= len(T_975) + 1:
+        return Z_975
+    return T_975[max(int(df), 1) - 1]
+
+
+# standard error of the difference of the means and its Welch degrees of
+# freedom. A side with a single run is assumed as noisy as the other side
+def welch(ref_sd, ref_n, cand_sd, cand_n):
+    if ref_sd is None and cand_sd is None:
+        return 0.0, None
+    ref_sd = cand_sd if ref_sd is None else ref_sd
+    cand_sd = ref_sd if cand_sd is None else cand_sd
+    a = ref_sd ** 2 / ref_n
+    b = cand_sd ** 2 / cand_n
+    se = math.sqrt(a + b)
+    dofs = (a ** 2 / (ref_n - 1) if ref_n > 1 else 0) + (b ** 2 / (cand_n - 1) if cand_n > 1 else 0)
+    df = (a + b) ** 2 / dofs if dofs > 0 else None
+    return se, df
+
+
+def evaluate(tolerance, ref_values, cand_values):
+    ref_mean, ref_sd = mean_sd(ref_values)
+    cand_mean, cand_sd = mean_sd(cand_values)
+    se, df = welch(ref_sd, len(ref_values), cand_sd, len(cand_values))
+    noise = t_critical(df) * se
+    allowed = tolerance.value * abs(ref_mean) if tolerance.kind == "relative" else tolerance.value
+    # positive if the candidate is worse
+    worse = cand_mean - ref_mean if tolerance.worse == "higher" else ref_mean - cand_mean
+    if worse > allowed and worse > noise:
+        status = "REGRESSION"
+    elif worse > allowed:
+        status = "NOISY"
+    elif -worse > allowed and -worse > noise:
+        status = "IMPROVED"
+    else:
+        status = "OK"
+    return {"reference_mean": ref_mean, "reference_sd": ref_sd, "reference_n": len(ref_values),
+            "candidate_mean": cand_mean, "candidate_sd": cand_sd, "candidate_n": len(cand_values),
+            "change": cand_mean - ref_mean, "tolerance": allowed, "noise": noise, "status": status}
+
+
+def gate(reference, candidate, tolerances, ignore=()):
+    ref_points = load_points(reference, tolerances)
+    cand_points = load_points(candidate, tolerances)
+    results = []
+    for key in ref_points:
+        if key not in cand_points:
+            continue
+        for metric, ref_values in ref_points[key].items():
+            if any(fnmatch.fnmatchcase(metric, pattern) for pattern in ignore):
+                continue
+            cand_values = cand_points[key].get(metric)
+            if not cand_values:
+                continue
+            result = evaluate(find_tolerance(metric, tolerances), ref_values, cand_values)
+            result.update({"qps": key[0], "conn": key[1], "metric": metric})
+            results.append(result)
+    return results, [k for k in ref_points if k not in cand_points], [k for k in cand_points if k not in ref_points]
+
+
+def format_change(result):
+    if result["reference_mean"]:
+        return "{:+.1f}%".format(100.0 * result["change"] / abs(result["reference_mean"]))
+    return "{:+.4g}".format(result["change"])
+
+
+def format_side(mean, sd, n):
+    return "{:.6g} ±{} (n={})".format(mean, "{:.2g}".format(sd) if sd is not None else "?", n)
+
+
+def print_results(results, verbose=False):
+    shown = [r for r in results if verbose or r["status"] != "OK"]
+    shown.sort(key=lambda r: (STATUS_ORDER.index(r["status"]), r["qps"], r["conn"], r["metric"]))
+    width = max([len(r["metric"]) for r in shown] or [0])
+    for r in shown:
+        print("{status:<10} qps={qps} c={conn}  {metric:<{width}}  {ref} -> {cand}  {relative} "
+              "(tolerance {tolerance:.4g}, noise {noise:.4g})".format(
+                  width=width, ref=format_side(r["reference_mean"], r["reference_sd"], r["reference_n"]),
+                  cand=format_side(r["candidate_mean"], r["candidate_sd"], r["candidate_n"]),
+                  relative=format_change(r), **r))
+
+
+def parse_tolerances(overrides):
+    tolerances = list(TOLERANCES)
+    for override in overrides:
+        pattern, _, value = override.partition("=")
+        value = float(value)
+        existing = [i for i, t in enumerate(tolerances) if t.pattern == pattern]
+        if existing:
+            tolerances[existing[0]] = tolerances[existing[0]]._replace(value=value)
+        else:
+            # new metrics are relative and worse when higher, before the defaults
+            tolerances.insert(0, TOLERANCE(pattern, "higher", "relative", value))
+    return tolerances
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    results, missing, extra = gate(args.reference, args.candidate, parse_tolerances(args.tolerance), args.ignore)
+    print("Gate of {} against {}".format(summary_csv(args.candidate), summary_csv(args.reference)))
+    for key in missing:
+        print("Point qps={} c={} of the reference is missing from the candidate".format(*key))
+    for key in extra:
+        print("Point qps={} c={} of the candidate is not in the reference".format(*key))
+    if not results:
+        print("No common points and metrics to compare")
+        return 2
+    print_results(results, args.verbose)
+
+    if args.csv_output:
+        with open(args.csv_output, "w+") as out:
+            out.write(",".join(COLUMNS) + "\n")
+            for r in results:
+                out.write(",".join("" if r[c] is None else str(r[c]) for c in COLUMNS) + "\n")
+        print("Wrote", args.csv_output)
+
+    counts = collections.Counter(r["status"] for r in results)
+    print("{} metrics of {} points: {}".format(len(results), len(set((r["qps"], r["conn"]) for r in results)),
+                                              ", ".join("{} {}".format(counts[s], s.lower()) for s in STATUS_ORDER)))
+    return 1 if counts["REGRESSION"] else 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Fail if a set of runs regressed against a reference set")
+    parser.add_argument(
+        "reference",
+        help="summary csv of the reference runs or its setup directory, e.g. ../data/sidecar-istio")
+    parser.add_argument(
+        "candidate",
+        help="summary csv of the new runs or its setup directory")
+    parser.add_argument(
+        "--tolerance",
+        help="tolerance of a metric or column pattern as pattern=value, e.g. p99=0.2 or 'cpu_milli_avg_*=0.15'. "
+             "Relative tolerances are fractions of the reference mean, errorPercent is in percentage points. "
+             "Can be repeated",
+        action="append",
+        default=[])
+    parser.add_argument(
+        "--ignore",
+        help="metric or column patterns not to compare, e.g. '*_main_fortioclient'",
+        nargs="*",
+        default=[])
+    parser.add_argument(
+        "--verbose",
+        help="print the metrics within their tolerance too",
+        action="store_true")
+    parser.add_argument(
+        "--csv_output",
+        help="output path of the comparison of all metrics",
+        default="")
+    return parser
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
@@ -32,10 +32,47 @@ PERF_FILENAME=${1:?"perf filename is missing"}
 PERF_DURATION=${2:?"perf duration is missing"}
 SAMPLE_FREQUENCY=${3:-"99"}
 PROCESS_NAME=${4:?"process name is missing"}
+# unix time to start profiling at, 0 starts immediately
+START_TIME=${5:-"0"}
+# on-cpu samples the stacks at the sample frequency, the other modes record
+# the scheduler events of all CPUs for offcpu.py, which keeps those of the
+# threads of the process and the wakeups of them by any task or interrupt
+PROFILE_MODE=${6:-"on-cpu"}
 
 PID=$(pgrep ${PROCESS_NAME})
 
-perf record -o "${WD}/${PERF_FILENAME}" -F "${SAMPLE_FREQUENCY}" -p "${PID}" -g -- sleep "${PERF_DURATION}"
-perf script -i "${WD}/${PERF_FILENAME}" --demangle > "${WD}/${PERF_FILENAME}.perf"
+DELAY=$(awk -v start="${START_TIME}" -v now="$(date +%s.%N)" 'BEGIN { d = start - now; if (start > 0 && d > 0) printf "%.3f", d; else print 0 }')
+echo "Waiting ${DELAY}s before profiling"
+sleep "${DELAY}"
+
+PERF_START=$(date +%s.%N)
+case "${PROFILE_MODE}" in
+  on-cpu)
+    perf record -o "${WD}/${PERF_FILENAME}" -F "${SAMPLE_FREQUENCY}" -p "${PID}" -g -- sleep "${PERF_DURATION}"
+    ;;
+  off-cpu|wakeup)
+    perf record -o "${WD}/${PERF_FILENAME}" -e sched:sched_switch -e sched:sched_wakeup -e sched:sched_wakeup_new \
+      --switch-events -a -g -- sleep "${PERF_DURATION}"
+    ;;
+  runqlat)
+    perf record -o "${WD}/${PERF_FILENAME}" -e sched:sched_switch -e sched:sched_wakeup -e sched:sched_wakeup_new \
+      --switch-events -a -- sleep "${PERF_DURATION}"
+    ;;
+  *)
+    echo "unknown profile mode ${PROFILE_MODE}"
+    exit 1
+    ;;
+esac
+PERF_END=$(date +%s.%N)
+
+if [[ "${PROFILE_MODE}" == "on-cpu" ]]; then
+  perf script -i "${WD}/${PERF_FILENAME}" --demangle > "${WD}/${PERF_FILENAME}.perf"
+else
+  # the pid of the events is not in the default output of tracepoints
+  perf script -i "${WD}/${PERF_FILENAME}" --demangle --show-switch-events -F +pid > "${WD}/${PERF_FILENAME}.perf"
+fi
+
+printf '{"pid": "%s", "start": %s, "end": %s, "duration": %s, "frequency": %s, "mode": "%s"}\n' \
+  "${PID}" "${PERF_START}" "${PERF_END}" "${PERF_DURATION}" "${SAMPLE_FREQUENCY}" "${PROFILE_MODE}" > "${WD}/${PERF_FILENAME}.timing.json"
 
 echo "Wrote ${WD}/${PERF_FILENAME}.perf"
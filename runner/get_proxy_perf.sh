@@ -28,7 +28,7 @@ set -x
 
 function usage() {
   echo "usage:
-        ./get_proxy_perf.sh -p <pod_name> -n <pod_namespace> -d <duration> -f <sample_frequency> -a <perf_data_filename> -e <process_name> -r <results_dir>
+        ./get_proxy_perf.sh -p <pod_name> -n <pod_namespace> -d <duration> -f <sample_frequency> -a <perf_data_filename> -e <process_name> -r <results_dir> -s <start_time> -m <profile_mode>
     
     -p name of the pod.
     -n namespace of the given pod.
@@ -36,11 +36,13 @@ function usage() {
     -f sample frequency in Hz.
     -a perf data filename.
     -e process name.
-    -r results directory."
+    -r results directory.
+    -s unix time to start profiling at, 0 starts immediately.
+    -m profile mode: on-cpu, off-cpu, wakeup or runqlat."
   exit 1
 }
 
-while getopts p:n:d:f:a:e:r: arg ; do
+while getopts p:n:d:f:a:e:r:s:m: arg ; do
   case "${arg}" in
     p) POD_NAME="${OPTARG}";;
     n) POD_NAMESPACE="${OPTARG}";;
@@ -49,6 +51,8 @@ while getopts p:n:d:f:a:e:r: arg ; do
     a) PERF_DATA_FILENAME="${OPTARG}";;
     e) PROCESS_NAME="${OPTARG}";;
     r) RESULTS_DIR="${OPTARG}";;
+    s) START_TIME="${OPTARG}";;
+    m) PROFILE_MODE="${OPTARG}";;
     *) usage;;
   esac
 done
@@ -59,6 +63,8 @@ PERF_DURATION=${PERF_DURATION:-"20"}
 SAMPLE_FREQUENCY=${SAMPLE_FREQUENCY:-"99"}
 PERF_DATA_FILENAME=${PERF_DATA_FILENAME:?"perf data filename must be given"}
 PROCESS_NAME=${PROCESS_NAME:?"process name must be given"}
+START_TIME=${START_TIME:-"0"}
+PROFILE_MODE=${PROFILE_MODE:-"on-cpu"}
 
 WD=$(dirname "${0}")
 WD=$(cd "${WD}" && pwd)
@@ -69,13 +75,19 @@ echo "Copy profiling script ..."
 kubectl cp "${WD}"/get_perfdata.sh "${POD_NAME}":/tmp/get_perfdata.sh -n "${POD_NAMESPACE}" -c ubuntu
 
 echo "Start profiling ..."
-kubectl exec "${POD_NAME}" -n "${POD_NAMESPACE}" -c ubuntu -- /tmp/get_perfdata.sh "${PERF_DATA_FILENAME}" "${PERF_DURATION}" "${SAMPLE_FREQUENCY}" "${PROCESS_NAME}"
+kubectl exec "${POD_NAME}" -n "${POD_NAMESPACE}" -c ubuntu -- /tmp/get_perfdata.sh "${PERF_DATA_FILENAME}" "${PERF_DURATION}" "${SAMPLE_FREQUENCY}" "${PROCESS_NAME}" "${START_TIME}" "${PROFILE_MODE}"
 
 PERF_FILE_NAME="${PERF_DATA_FILENAME}.perf"
 SVG_FILE_NAME="${PERF_DATA_FILENAME}.svg"
 PERF_FILE="${RESULTS_DIR}/${PERF_FILE_NAME}"
 SVG_FILE="${RESULTS_DIR}/${SVG_FILE_NAME}"
 kubectl cp "${POD_NAME}:/tmp/${PERF_DATA_FILENAME}.perf" "${PERF_FILE}" -n "${POD_NAMESPACE}" -c ubuntu
+kubectl cp "${POD_NAME}:/tmp/${PERF_DATA_FILENAME}.timing.json" "${RESULTS_DIR}/${PERF_DATA_FILENAME}.timing.json" -n "${POD_NAMESPACE}" -c ubuntu
 
-echo "Generating svg file ${SVG_FILE_NAME}"
-"${WD}/flame.sh" "${PERF_FILE}" "${SVG_FILE}"
+if [[ "${PROFILE_MODE}" == "on-cpu" ]]; then
+  echo "Generating svg file ${SVG_FILE_NAME}"
+  "${WD}/flame.sh" "${PERF_FILE}" "${SVG_FILE}"
+else
+  echo "Analyzing scheduler events of ${PERF_FILE_NAME}"
+  python3 "${WD}/offcpu.py" "${PERF_FILE}" --mode "${PROFILE_MODE}"
+fi
@@ -0,0 +1,254 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Mergeable latency histograms. Repetitions of a setup (and runs of several
+# load generators) are pooled by merging their histograms, percentiles of the
+# pooled histogram are then computed the same way Fortio computes them.
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import numpy as np
+import accesslog
+import fortio
+
+PERCENTILES = [50, 75, 90, 99, 99.9]
+
+# relative bucket width of histograms built from access logs, 0.1%
+DEFAULT_PRECISION = 0.001
+# lowest bucket boundary of histograms built from access logs, 1 microsecond
+DEFAULT_LOWEST = 1e-6
+
+
+class Histogram:
+    # buckets [starts[i], ends[i]] with counts[i] values. The start of the
+    # first bucket is the minimum and the end of the last bucket the maximum
+    # value, the other boundaries are shared by histograms of the same kind
+    # (Fortio buckets of the same resolution or the same log-linear grid).
+    def __init__(self, starts, ends, counts, total=0.0):
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.total = float(total)
+
+    @classmethod
+    def from_fortio(cls, duration_histogram):
+        data = duration_histogram.get("Data") or []
+        return cls([d["Start"] for d in data], [d["End"] for d in data], [d["Count"] for d in data],
+                   duration_histogram.get("Sum", 0.0))
+
+    # HDR style histogram with buckets on a fixed log-linear grid, histograms
+    # built with the same precision and lowest boundary merge exactly
+    @classmethod
+    def from_values(cls, values, precision=DEFAULT_PRECISION, lowest=DEFAULT_LOWEST):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return cls([], [], [])
+        growth = np.log1p(precision)
+        index = np.floor(np.log(np.maximum(values, lowest) / lowest) / growth).astype(np.int64)
+        keys, counts = np.unique(index, return_counts=True)
+        starts = lowest * np.exp(keys * growth)
+        ends = lowest * np.exp((keys + 1) * growth)
+        starts[0] = values.min()
+        ends[-1] = values.max()
+        return cls(starts, ends, counts, values.sum())
+
+    # histogram of values with the bucket boundaries of another histogram,
+    # e.g. the requests of a window of a run in the Fortio buckets of the run,
+    # so that its percentiles are estimated the same way. Values outside of
+    # the boundaries go to the first and the last bucket.
+    @classmethod
+    def from_values_like(cls, values, like):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return cls([], [], [])
+        edges = np.unique(like.grid_edges())
+        counts = np.bincount(np.searchsorted(edges, values, side="right"), minlength=len(edges) + 1)
+        starts = np.concatenate([[values.min()], edges])
+        ends = np.concatenate([edges, [values.max()]])
+        keep = counts > 0
+        starts = starts[keep]
+        ends = ends[keep]
+        starts[0] = values.min()
+        ends[-1] = values.max()
+        return cls(starts, ends, counts[keep], values.sum())
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    @property
+    def min(self):
+        return float(self.starts[0]) if len(self.starts) else 0.0
+
+    @property
+    def max(self):
+        return float(self.ends[-1]) if len(self.ends) else 0.0
+
+    @property
+    def avg(self):
+        return self.total / self.count if self.count else 0.0
+
+    # the boundaries that are shared with other histograms, the first start
+    # and the last end are the minimum and maximum of this histogram only
+    def grid_edges(self):
+        if len(self.counts) == 0:
+            return np.empty(0)
+        return np.concatenate([self.starts[1:], self.ends[:-1]])
+
+    # merges histograms without losing counts. Every bucket is moved to the
+    # interval of the merged boundaries it belongs to. Only if histograms of
+    # different kinds are merged a bucket can span several intervals, then its
+    # count is split by the width of the intervals, the remainder of the
+    # split going to the intervals with the largest fractions.
+    @classmethod
+    def merge(cls, histograms):
+        histograms = [h for h in histograms if len(h.counts)]
+        if not histograms:
+            return cls([], [], [])
+        if len(histograms) == 1:
+            h = histograms[0]
+            return cls(h.starts.copy(), h.ends.copy(), h.counts.copy(), h.total)
+        lowest = min(h.min for h in histograms)
+        highest = max(h.max for h in histograms)
+        edges = np.unique(np.concatenate([[lowest, highest]] + [h.grid_edges() for h in histograms]))
+        edges = edges[(edges >= lowest) & (edges <= highest)]
+        counts = np.zeros(max(len(edges) - 1, 1), dtype=np.int64)
+        for h in histograms:
+            starts = h.starts.copy()
+            ends = h.ends.copy()
+            # the first and the last bucket are identified by their grid boundary
+            if len(starts) > 1:
+                first = np.searchsorted(edges, ends[0], side="left") - 1
+                starts[0] = edges[max(first, 0)]
+                last = np.searchsorted(edges, starts[-1], side="left")
+                ends[-1] = edges[min(last + 1, len(edges) - 1)]
+            lo = np.clip(np.searchsorted(edges, starts, side="left"), 0, len(counts) - 1)
+            hi = np.clip(np.searchsorted(edges, ends, side="left"), lo + 1, len(counts))
+            single = hi - lo == 1
+            np.add.at(counts, lo[single], h.counts[single])
+            for i in np.nonzero(~single)[0]:
+                widths = np.diff(edges[lo[i]:hi[i] + 1])
+                shares = h.counts[i] * widths / widths.sum()
+                split = np.floor(shares).astype(np.int64)
+                split[np.argsort(split - shares)[:h.counts[i] - split.sum()]] += 1
+                counts[lo[i]:hi[i]] += split
+        keep = counts > 0
+        return cls(edges[:-1][keep], edges[1:][keep], counts[keep], sum(h.total for h in histograms))
+
+    def __add__(self, other):
+        return Histogram.merge([self, other])
+
+    # vectorized percentiles, interpolated linearly from the end of the
+    # previous non-empty bucket to the end of the bucket like Fortio does
+    def percentiles(self, percentiles=PERCENTILES):
+        p = np.asarray(percentiles, dtype=np.float64)
+        if self.count == 0:
+            return np.zeros(len(p))
+        cumulative = np.cumsum(self.counts)
+        target = p / 100.0 * cumulative[-1]
+        i = np.minimum(np.searchsorted(cumulative, target, side="left"), len(cumulative) - 1)
+        previous = np.where(i > 0, cumulative[np.maximum(i - 1, 0)], 0)
+        low = np.where(i > 0, self.ends[np.maximum(i - 1, 0)], self.starts[0])
+        fraction = (target - previous) / self.counts[i]
+        values = low + (self.ends[i] - low) * fraction
+        values[p <= 0] = self.min
+        values[p >= 100] = self.max
+        return values
+
+    def summary(self, percentiles=PERCENTILES):
+        out = {"count": self.count, "min": self.min, "max": self.max, "avg": self.avg}
+        for p, v in zip(percentiles, self.percentiles(percentiles)):
+            out["p" + str(p)] = float(v)
+        return out
+
+    def to_fortio(self):
+        cumulative = np.cumsum(self.counts)
+        return {
+            "Count": self.count,
+            "Min": self.min,
+            "Max": self.max,
+            "Sum": self.total,
+            "Avg": self.avg,
+            "Data": [{"Start": float(s), "End": float(e), "Percent": 100.0 * float(c) / max(self.count, 1),
+                      "Count": int(n)} for s, e, c, n in zip(self.starts, self.ends, cumulative, self.counts)],
+            "Percentiles": [{"Percentile": p, "Value": float(v)}
+                            for p, v in zip(PERCENTILES, self.percentiles(PERCENTILES))],
+        }
+
+
+def load_histograms(json_output_dir, source="fortio"):
+    histograms = []
+    for filename in sorted(os.listdir(json_output_dir)):
+        if not fortio.is_fortio_result(filename):
+            continue
+        if source == "fortio":
+            with open(os.path.join(json_output_dir, filename), "r") as f:
+                data = json.load(f, strict=False)
+            histograms.append((data["Labels"], Histogram.from_fortio(data["DurationHistogram"])))
+        else:
+            gd, log = accesslog.load_run(json_output_dir, filename)
+            if log is None:
+                print(gd["Labels"], "access log not found")
+                continue
+            histograms.append((gd["Labels"], Histogram.from_values(log.latency)))
+    return histograms
+
+
+def setup_name(json_output_dir):
+    path = os.path.abspath(json_output_dir)
+    if os.path.basename(path) == "json":
+        path = os.path.dirname(path)
+    return os.path.basename(path)
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    columns = ["setup", "runs", "count", "min", "avg", "max"] + ["p" + str(p) for p in PERCENTILES]
+    print(",".join(columns))
+    for json_output_dir in args.json_output_dirs:
+        histograms = load_histograms(json_output_dir, args.source)
+        if args.per_run:
+            for labels, h in histograms:
+                row = dict(h.summary(), setup=labels, runs=1)
+                print(",".join(str(row[c]) for c in columns))
+        pooled = Histogram.merge([h for _, h in histograms])
+        row = dict(pooled.summary(), setup=setup_name(json_output_dir), runs=len(histograms))
+        print(",".join(str(row[c]) for c in columns))
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Print pooled latency of all runs of each setup")
+    parser.add_argument(
+        "json_output_dirs",
+        help="json output directories, e.g. ../data/baseline/json",
+        nargs="+")
+    parser.add_argument(
+        "--source",
+        help="fortio: DurationHistogram of the Fortio results, access-log: histogram of the access logs "
+             "within the same window as the prometheus metrics",
+        choices=["fortio", "access-log"],
+        default="fortio")
+    parser.add_argument(
+        "--per_run",
+        help="also print every run",
+        action="store_true")
+    return parser
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,150 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Inventory of the pods the runner uses. The application and load generator
+# pods are listed with a single kubectl call and the kube-system pods with
+# another one when they are first needed. The lists are kept for the whole
+# session and only listed again when a pod has been replaced or restarted.
+
+from __future__ import print_function
+import argparse
+import collections
+import json
+from subprocess import getoutput
+
+APP_LABEL = "app.kubernetes.io/name"
+
+# containers maps the container names to their container runtime ids
+POD = collections.namedtuple('Pod', ['name', 'namespace', 'ip', 'labels', 'node', 'uid', 'restarts', 'containers'])
+
+# group: (namespaces, kubectl arguments selecting the pods)
+GROUPS = collections.OrderedDict([
+    ("workload", (["default", "fortio"],
+                  "--all-namespaces -l '{} in (http-server,demo-service,loadgenerator)'".format(APP_LABEL))),
+    ("kube-system", (["kube-system"], "-n kube-system")),
+])
+
+# groups of which only the pods that were looked up are checked for restarts,
+# the other pods of kube-system are not used by the runs
+USED_ONLY_GROUPS = ["kube-system"]
+
+
+def parse_pods(output):
+    pods = []
+    for item in json.loads(output)["items"]:
+        metadata = item["metadata"]
+        status = item.get("status", {})
+        if metadata.get("deletionTimestamp") or status.get("phase") != "Running":
+            continue
+        restarts = sum(c.get("restartCount", 0) for c in status.get("containerStatuses", []))
+        # e.g. containerd://<id>
+        containers = collections.OrderedDict((c["name"], c.get("containerID", "").partition("://")[2])
+                                             for c in status.get("containerStatuses", []) if "name" in c)
+        pods.append(POD(metadata["name"], metadata["namespace"], status.get("podIP"), metadata.get("labels", {}),
+                        item.get("spec", {}).get("nodeName"), metadata.get("uid"), restarts, containers))
+    return pods
+
+
+class PodInventory:
+    def __init__(self, run=getoutput):
+        self.run = run
+        self.groups = {}
+        # names of the pods found by pod_by_name
+        self.used = set()
+
+    def list_group(self, group):
+        cmd = "kubectl get pods {} -o json".format(GROUPS[group][1])
+        output = self.run(cmd)
+        try:
+            return parse_pods(output)
+        except (ValueError, KeyError):
+            raise Exception("listing pods with [" + cmd + "] failed: " + output)
+
+    def pods(self, namespace):
+        for group, (namespaces, _) in GROUPS.items():
+            if namespace in namespaces:
+                if group not in self.groups:
+                    self.groups[group] = self.list_group(group)
+                return [p for p in self.groups[group] if p.namespace == namespace]
+        raise Exception("no pod inventory for namespace " + namespace)
+
+    # the pod of an application, e.g. "http-server" or "loadgenerator"
+    def pod(self, app, namespace):
+        return self.pods_of(app, namespace)[0]
+
+    # all pods of an application ordered by name, e.g. the load generators
+    def pods_of(self, app, namespace):
+        found = sorted((p for p in self.pods(namespace) if p.labels.get(APP_LABEL) == app), key=lambda p: p.name)
+        if not found:
+            raise Exception("no running {} pods found in {}".format(app, namespace))
+        return found
+
+    # a pod by name or name prefix, e.g. "cilium" for the cilium agent or
+    # "kube-proxy". Of several pods those whose k8s-app label is the name
+    # (the cilium agent rather than cilium-operator) and then the one on the
+    # given node are preferred
+    def pod_by_name(self, name, namespace, node=None):
+        pods = self.pods(namespace)
+        found = [p for p in pods if p.name == name] or [p for p in pods if p.name.startswith(name)]
+        if not found:
+            raise Exception("no running pods named {} found in {}".format(name, namespace))
+        found = [p for p in found if p.labels.get("k8s-app") == name] or found
+        pod = ([p for p in found if p.node == node] or found)[0]
+        self.used.add(pod.name)
+        return pod
+
+    # lists the pods again and returns True if a pod was replaced or restarted
+    # since they were listed
+    def refresh_if_restarted(self):
+        changed = False
+        for group in list(self.groups):
+            pods = self.list_group(group)
+            before = sorted((p.name, p.uid, p.restarts) for p in self.groups[group] if self.watched(group, p))
+            after = sorted((p.name, p.uid, p.restarts) for p in pods if self.watched(group, p))
+            if before != after:
+                print("Pods of {} changed: {} -> {}".format(group, before, after))
+                changed = True
+            self.groups[group] = pods
+        return changed
+
+    def watched(self, group, pod):
+        return group not in USED_ONLY_GROUPS or pod.name in self.used
+
+
+# shared by the runner, the Fortio sync and the perf launchers
+INVENTORY = PodInventory()
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    for namespace in args.namespaces:
+        for p in INVENTORY.pods(namespace):
+            print("{} {} node={} ip={} restarts={} {}={}".format(
+                p.namespace, p.name, p.node, p.ip, p.restarts, APP_LABEL, p.labels.get(APP_LABEL, "")))
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Print the pods the runner uses")
+    parser.add_argument(
+        "namespaces",
+        help="namespaces to print",
+        nargs="*",
+        default=["default", "fortio", "kube-system"])
+    return parser
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
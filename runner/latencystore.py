@@ -0,0 +1,170 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Converts Fortio access logs into fixed width columnar files that can be
+# memory mapped. Every run is stored in its own directory named by the run id:
+#
+#   <store_dir>/index.json
+#   <store_dir>/<run_id>/timestamp.npy  int64 unix time in nanoseconds, sorted
+#   <store_dir>/<run_id>/latency.npy    float32 seconds
+#   <store_dir>/<run_id>/thread.npy     uint16
+#   <store_dir>/<run_id>/status.npy     uint16 status code, 0 if not numeric
+#   <store_dir>/<run_id>/ok.npy         bool
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import numpy as np
+import accesslog
+import fortio
+
+INDEX_FILENAME = "index.json"
+COLUMNS = {"timestamp": np.int64, "latency": np.float32, "thread": np.uint16, "status": np.uint16, "ok": bool}
+
+
+def read_index(store_dir):
+    path = os.path.join(store_dir, INDEX_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_index(store_dir, index):
+    path = os.path.join(store_dir, INDEX_FILENAME)
+    with open(path + ".tmp", "w+") as f:
+        f.write(json.dumps(index, indent=2, sort_keys=True))
+    os.replace(path + ".tmp", path)
+
+
+def run_id_of(labels):
+    return labels.split("_")[0]
+
+
+def convert_run(json_output_dir, filename, store_dir):
+    with open(os.path.join(json_output_dir, filename), "r") as f:
+        data = json.load(f, strict=False)
+    access_log = accesslog.access_log_filename(data)
+    if access_log is None:
+        return None
+    access_log_path = os.path.join(json_output_dir, access_log)
+    if not os.path.exists(access_log_path):
+        return None
+
+    # Fortio appends to the access log of the labels, so a point that is run
+    # again has the requests of every run in it. Only the requests from the
+    # start of this run to its end are kept, the start is in whole seconds
+    start = fortio.run_start(data)
+    end = start + data["ActualDuration"] / 10.0 ** 9 + 1
+    log = accesslog.trim(accesslog.read_access_log(access_log_path), start, end)
+    run_id = run_id_of(data["Labels"])
+    run_dir = os.path.join(store_dir, run_id)
+    os.makedirs(run_dir, exist_ok=True)
+    for column, dtype in COLUMNS.items():
+        np.save(os.path.join(run_dir, column + ".npy"), getattr(log, column).astype(dtype, copy=False))
+
+    entry = {
+        "labels": data["Labels"],
+        "fortio_json": filename,
+        "access_log": access_log,
+        "access_log_size": os.path.getsize(access_log_path),
+        "count": len(log.timestamp),
+    }
+    if len(log.timestamp):
+        entry["start_ns"] = int(log.timestamp[0])
+        entry["end_ns"] = int(log.timestamp[-1])
+    print("Converted {} requests of run {} in {} to {}".format(entry["count"], run_id, access_log, run_dir))
+    return run_id, entry
+
+
+# converts the runs in json_output_dir that are not yet in the store or
+# whose access log has changed since they were converted
+def convert_dir(json_output_dir, store_dir):
+    os.makedirs(store_dir, exist_ok=True)
+    index = read_index(store_dir)
+    converted = 0
+    for filename in sorted(os.listdir(json_output_dir)):
+        if not fortio.is_fortio_result(filename):
+            continue
+        existing = [e for e in index.values() if e["fortio_json"] == filename]
+        if existing:
+            access_log_path = os.path.join(json_output_dir, existing[0]["access_log"])
+            if os.path.exists(access_log_path) and os.path.getsize(access_log_path) == existing[0]["access_log_size"]:
+                continue
+        result = convert_run(json_output_dir, filename, store_dir)
+        if result is None:
+            continue
+        index[result[0]] = result[1]
+        converted += 1
+    write_index(store_dir, index)
+    return converted
+
+
+# finds a run by run id or by (a unique suffix of) the Fortio labels,
+# e.g. "f5e5d429" or "baseline-1"
+def find_run(index, key):
+    if key in index:
+        return key
+    found = [run_id for run_id, entry in index.items()
+             if entry["labels"] == key or entry["labels"].endswith("_" + key)]
+    if len(found) != 1:
+        raise Exception("{} runs found for {}".format(len(found), key))
+    return found[0]
+
+
+# returns the columns of a run as read-only memory mapped arrays
+def open_run(store_dir, key):
+    run_id = find_run(read_index(store_dir), key)
+    run_dir = os.path.join(store_dir, run_id)
+    return accesslog.ACCESS_LOG(*[np.load(os.path.join(run_dir, column + ".npy"), mmap_mode="r")
+                                  for column in accesslog.ACCESS_LOG._fields])
+
+
+# slices the requests with start <= timestamp < end (unix seconds) without
+# copying, the timestamps are sorted
+def window(log, start=None, end=None):
+    lo = 0
+    hi = len(log.timestamp)
+    if start is not None:
+        lo = np.searchsorted(log.timestamp, int(start * 10 ** 9), side="left")
+    if end is not None:
+        hi = np.searchsorted(log.timestamp, int(end * 10 ** 9), side="left")
+    return accesslog.ACCESS_LOG(*[column[lo:hi] for column in log])
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    store_dir = args.store_dir or os.path.join(args.json_output_dir, "columnar")
+    converted = convert_dir(args.json_output_dir, store_dir)
+    print("Converted {} runs to {}".format(converted, store_dir))
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Convert Fortio access logs to columnar files")
+    parser.add_argument(
+        "--json_output_dir",
+        help="directory containing the Fortio json results and access logs",
+        required=True)
+    parser.add_argument(
+        "--store_dir",
+        help="output directory of the columnar files, defaults to <json_output_dir>/columnar",
+        default="")
+    return parser
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
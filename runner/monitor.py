@@ -0,0 +1,202 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Live monitor of a running Fortio test. The access log is followed in the
+# load generator pod and the CPU usage of the targets is read with prometheus
+# instant queries. Every interval the rolling qps, latency percentiles, error
+# rate and CPU usage are printed, and the run is interrupted if a guardrail is
+# breached in consecutive intervals after the warm-up.
+
+from __future__ import print_function
+import collections
+import subprocess
+import threading
+import time
+import numpy as np
+import accesslog
+import inventory
+import prom
+from fortio import METRICS_START_SKIP_DURATION
+
+# limits of a run, 0 disables a check
+GUARDRAILS = collections.namedtuple('Guardrails', ['max_error_percent', 'min_qps_ratio', 'max_p99', 'abort_on_restart'])
+
+# number of consecutive intervals a guardrail has to be breached in
+GUARDRAIL_BREACHES = 2
+
+# rate window of the live cpu query, two scrapes of cAdvisor
+LIVE_RATE_WINDOW = "30s"
+
+# seconds between checks for restarted pods
+RESTART_CHECK_INTERVAL = 30
+
+
+class AccessLogTail:
+    def __init__(self, pod, path, offset, namespace="fortio"):
+        self.cmd = ["kubectl", "-n", namespace, "exec", pod, "-c", "shell", "--",
+                    "tail", "-c", "+" + str(offset + 1), "-F", path]
+        self.lock = threading.Lock()
+        self.lines = []
+        self.process = None
+        self.thread = None
+
+    def start(self):
+        self.process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.thread = threading.Thread(target=self.read, daemon=True)
+        self.thread.start()
+
+    def read(self):
+        for line in self.process.stdout:
+            with self.lock:
+                self.lines.append(line)
+
+    # returns the requests logged since the last call
+    def take(self):
+        with self.lock:
+            lines, self.lines = self.lines, []
+        if not lines:
+            return accesslog.empty_access_log()
+        return accesslog.parse_chunk(b"".join(lines))
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+
+class Monitor:
+    def __init__(self, client_pod, access_log_file, offset, qps, guardrails, prom_url="", resource_usage_targets="",
+                 interval=5, window=10, namespace="fortio", abort_pods=None):
+        self.client_pod = client_pod
+        self.abort_pods = abort_pods or [client_pod]
+        self.namespace = namespace
+        self.qps = qps
+        self.guardrails = guardrails
+        self.prom_url = prom_url
+        self.resource_usage_targets = resource_usage_targets
+        self.interval = interval
+        self.window = window
+        self.tail = AccessLogTail(client_pod, access_log_file, offset, namespace)
+        self.session = prom.new_session(pool_size=1, retries=0) if prom_url else None
+        self.log = accesslog.empty_access_log()
+        self.first_request = None
+        self.breaches = 0
+        self.last_restart_check = time.time()
+        self.aborted = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.tail.start()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.tail.stop()
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            stats = self.update()
+            if stats is None:
+                continue
+            print(format_stats(stats), flush=True)
+            reason = self.check(stats)
+            if reason is not None:
+                self.abort(reason)
+                return
+
+    # adds the new requests and returns the statistics of the last window,
+    # the window ends at the newest request so clock skew does not matter
+    def update(self):
+        new = self.tail.take()
+        if len(new.timestamp):
+            self.log = accesslog.ACCESS_LOG(*[np.concatenate([old, add]) for old, add in zip(self.log, new)])
+        if len(self.log.timestamp) == 0:
+            return None
+        if self.first_request is None:
+            self.first_request = int(self.log.timestamp.min())
+        end = int(self.log.timestamp.max())
+        keep = self.log.timestamp > end - self.window * 10 ** 9
+        self.log = accesslog.ACCESS_LOG(*[column[keep] for column in self.log])
+        latency = self.log.latency
+        stats = {
+            "elapsed": (end - self.first_request) / 10 ** 9,
+            "qps": len(latency) / float(self.window),
+            "p50": float(np.percentile(latency, 50)),
+            "p99": float(np.percentile(latency, 99)),
+            "error_percent": 100.0 * float((~self.log.ok).sum()) / len(latency),
+            "cpu": self.cpu_usage(),
+        }
+        return stats
+
+    def cpu_usage(self):
+        if self.session is None:
+            return {}
+        query = prom.build_metric_query("cpu", prom.select_targets(self.resource_usage_targets),
+                                        rate_window=LIVE_RATE_WINDOW)
+        try:
+            resp = self.session.get(self.prom_url + "/api/v1/query", params={"query": query}, timeout=self.interval)
+            result = resp.json()["data"]["result"]
+        except Exception as e:
+            print("live cpu query failed: {}".format(e))
+            return {}
+        out = collections.OrderedDict()
+        for item in result:
+            key = prom.match_target(item["metric"])
+            if key is not None:
+                # the load generators of a run with several clients are summed
+                out[key] = out.get(key, 0) + prom.to_milli_cpus(float(item["value"][1]))
+        return out
+
+    def check(self, stats):
+        g = self.guardrails
+        if g.abort_on_restart and time.time() - self.last_restart_check >= RESTART_CHECK_INTERVAL:
+            self.last_restart_check = time.time()
+            if inventory.INVENTORY.refresh_if_restarted():
+                return "a pod was replaced or restarted"
+        if stats["elapsed"] < METRICS_START_SKIP_DURATION + self.window:
+            return None
+        reasons = []
+        if g.max_error_percent > 0 and stats["error_percent"] > g.max_error_percent:
+            reasons.append("error rate {:.2f}% above {}%".format(stats["error_percent"], g.max_error_percent))
+        if g.min_qps_ratio > 0 and stats["qps"] < g.min_qps_ratio * self.qps:
+            reasons.append("qps {:.1f} below {} of {}".format(stats["qps"], g.min_qps_ratio, self.qps))
+        if g.max_p99 > 0 and stats["p99"] > g.max_p99:
+            reasons.append("p99 {:.6f}s above {}s".format(stats["p99"], g.max_p99))
+        self.breaches = self.breaches + 1 if reasons else 0
+        if self.breaches >= GUARDRAIL_BREACHES:
+            return ", ".join(reasons)
+        return None
+
+    # interrupts Fortio the way ^C does, it stops and saves the results of
+    # the run so far. The load generator pod shares its process namespace so
+    # that the shell container can signal it. Only the load process is
+    # matched, the fortio server of the main container keeps running.
+    def abort(self, reason):
+        print("Aborting run: " + reason, flush=True)
+        self.aborted = reason
+        for pod in self.abort_pods:
+            subprocess.call(["kubectl", "-n", self.namespace, "exec", pod, "-c", "shell", "--",
+                             "pkill", "-INT", "-f", "fortio load"])
+
+
+def format_stats(stats):
+    line = "t={:.0f}s qps={:.1f} p50={:.3f}ms p99={:.3f}ms errors={:.2f}%".format(
+        stats["elapsed"], stats["qps"], stats["p50"] * 1000, stats["p99"] * 1000, stats["error_percent"])
+    if stats["cpu"]:
+        line += " cpu_milli " + " ".join("{}={:.0f}".format(k, v) for k, v in stats["cpu"].items())
+    return line
@@ -0,0 +1,253 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Off-CPU analysis of the scheduler events get_perfdata.sh records on all
+# CPUs: sched:sched_switch with the stack a thread leaves the CPU with,
+# sched:sched_wakeup of the thread by any task or interrupt and the context
+# switch records of perf record --switch-events that tell when the thread is
+# back on the CPU. Only the threads of the profiled process, whose pid is
+# read from the <labels>.timing.json next to the input, are analyzed.
+#
+#   off-cpu: folded stacks weighted by the microseconds spent off the CPU
+#   wakeup:  folded stacks of the wakers of the threads, one per wakeup
+#   runqlat: delays from becoming runnable (woken up or preempted) to
+#            running again
+#
+# The run queue latency histogram is written for every mode.
+
+from __future__ import print_function
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import re
+import flamegraph
+import histogram
+
+MODES = ["off-cpu", "wakeup", "runqlat"]
+
+# "envoy 1234/1240 [002] 12345.678901: sched:sched_switch: prev_comm=...",
+# perf script prints only the tid of tracepoints unless -F +pid is given
+EVENT_HEADER = re.compile(r"^\s*(\S.*?)\s+(?:(-?\d+)/)?(-?\d+)\s+\[(\d+)\]\s+(\d+\.\d+):\s*(.*)$")
+SWITCH_RECORD = re.compile(r"PERF_RECORD_SWITCH(?:_CPU_WIDE)?\s+(IN|OUT)(\s+preempt)?")
+TRACEPOINT = re.compile(r"^(?:\d+\s+)?(sched:\w+):\s*(.*)$")
+TRACE_FIELD = re.compile(r"(\w+)=(\S+)")
+
+EVENT = collections.namedtuple("Event", ["comm", "pid", "tid", "time", "name", "fields", "stack"])
+
+# log2 buckets of the printed run queue latency histogram, in microseconds
+LOG2_BUCKETS = 24
+
+
+def parse_fields(trace):
+    fields = {}
+    for key, value in TRACE_FIELD.findall(trace):
+        # sched_switch has the same keys for the previous and the next task
+        fields.setdefault(key, value)
+    return fields
+
+
+def new_event(header, stack):
+    comm, pid, tid, _, time, rest = header.groups()
+    switch = SWITCH_RECORD.search(rest)
+    if switch is not None:
+        name = "switch-in" if switch.group(1) == "IN" else "switch-out"
+        fields = {"preempt": bool(switch.group(2))}
+    else:
+        m = TRACEPOINT.match(rest)
+        if m is None:
+            return None
+        name = m.group(1)
+        fields = parse_fields(m.group(2))
+    return EVENT(comm.strip(), int(pid if pid is not None else tid), int(tid), float(time), name, fields, stack[::-1])
+
+
+# streams the events of `perf script --show-switch-events` output, the stack
+# of an event is ordered from the root to the leaf
+def iter_events(lines):
+    header = None
+    stack = []
+    for line in lines:
+        if line.startswith("#"):
+            continue
+        m = EVENT_HEADER.match(line)
+        if m is not None or not line.strip():
+            if header is not None:
+                event = new_event(header, stack)
+                if event is not None:
+                    yield event
+            header = m
+            stack = []
+            continue
+        if header is None:
+            continue
+        frame = flamegraph.STACK_FRAME.match(line)
+        if frame is not None:
+            stack.append(flamegraph.tidy_symbol(frame.group(2), frame.group(3)))
+            continue
+        frame = flamegraph.STACK_FRAME_NO_MODULE.match(line)
+        if frame is not None:
+            stack.append(flamegraph.tidy_symbol(frame.group(2), ""))
+    if header is not None:
+        event = new_event(header, stack)
+        if event is not None:
+            yield event
+
+
+# The events of the threads of the target process are kept, and the wakeups
+# of them which run in the context of the waker. Tracepoint fields hold
+# global pids while the records hold the pids of the pod, sched_switch has
+# both for the thread that leaves the CPU. Without a pid all events are of
+# the target, as in recordings of perf record -p.
+def analyze(events, pid=None):
+    count = 0
+    off_cpu = collections.defaultdict(int)
+    wakeups = collections.defaultdict(int)
+    delays = []
+    tids = {}
+    switched_out = {}
+    runnable = {}
+    for event in events:
+        wakeup = event.name in ("sched:sched_wakeup", "sched:sched_wakeup_new")
+        if pid is not None and not wakeup and event.pid != pid:
+            continue
+        if pid is not None and wakeup and event.fields.get("pid") not in tids:
+            continue
+        count += 1
+        if event.name == "sched:sched_switch":
+            tids[event.fields.get("prev_pid")] = event.tid
+            switched_out[event.tid] = (event.time, event.comm, event.stack)
+            if event.fields.get("prev_state", "").startswith("R"):
+                runnable[event.tid] = event.time
+        elif wakeup:
+            tid = tids.get(event.fields.get("pid"))
+            woken = event.fields.get("comm", "?")
+            wakeups[";".join([event.comm.replace(";", ":") or "?"] + event.stack + ["--", woken])] += 1
+            if tid is not None and tid in switched_out and tid not in runnable:
+                runnable[tid] = event.time
+        elif event.name == "switch-in":
+            out = switched_out.pop(event.tid, None)
+            if out is not None:
+                stack = ";".join([out[1].replace(";", ":")] + out[2])
+                off_cpu[stack] += int(round((event.time - out[0]) * 10 ** 6))
+            since = runnable.pop(event.tid, None)
+            if since is not None:
+                delays.append(event.time - since)
+    return count, off_cpu, wakeups, delays
+
+
+def log2_buckets(delays):
+    counts = [0] * LOG2_BUCKETS
+    for delay in delays:
+        us = int(delay * 10 ** 6)
+        counts[min(max(us, 1).bit_length() - 1, LOG2_BUCKETS - 1)] += 1
+    last = max([i for i, c in enumerate(counts) if c] or [0])
+    return [{"start_us": (1 << i) if i else 0, "end_us": (1 << (i + 1)) - 1, "count": counts[i]}
+            for i in range(last + 1)]
+
+
+def write_runqlat(delays, path):
+    h = histogram.Histogram.from_values(delays)
+    out = {"summary": h.summary(), "log2_us": log2_buckets(delays), "histogram": h.to_fortio()}
+    with open(path, "w+") as f:
+        f.write(json.dumps(out, indent=2))
+    return out
+
+
+# the pid get_perfdata.sh profiled, from the timing file next to its output
+def target_pid(path):
+    timing = flamegraph.output_base(path) + ".timing.json"
+    if not os.path.exists(timing):
+        return None
+    with open(timing, "r") as f:
+        return int(json.load(f)["pid"])
+
+
+def process_file(path, mode="off-cpu", output_dir="", pid=None):
+    if pid is None:
+        pid = target_pid(path)
+    if pid is None:
+        print("{}: no timing file with the profiled pid, all recorded threads are analyzed".format(path))
+    with flamegraph.open_text(path) as f:
+        count, off_cpu, wakeups, delays = analyze(iter_events(f), pid)
+    if count == 0:
+        raise Exception("no scheduler events{} parsed from {}".format(
+            "" if pid is None else " of pid {}".format(pid), path))
+    base = flamegraph.output_base(path, output_dir)
+    if mode in ("off-cpu", "wakeup"):
+        counts = off_cpu if mode == "off-cpu" else wakeups
+        title = "Off-CPU Time Flame Graph (us)" if mode == "off-cpu" else "Wakeup Flame Graph (wakeups)"
+        flamegraph.write_folded(counts, base + flamegraph.FOLDED_SUFFIX)
+        with open(base + flamegraph.SVG_SUFFIX, "w+") as out:
+            out.write(flamegraph.render_svg(counts, title))
+        print("Wrote {} flame graph {}".format(mode, base + flamegraph.SVG_SUFFIX))
+    runqlat = write_runqlat(delays, base + ".runqlat.json")
+    return path, runqlat
+
+
+def process_file_args(args):
+    return process_file(*args)
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    jobs = [(path, args.mode, args.output_dir, args.pid) for path in args.files]
+    processes = max(1, min(args.processes or multiprocessing.cpu_count(), len(jobs)))
+    if processes == 1:
+        results = [process_file_args(job) for job in jobs]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(process_file_args, jobs)
+    for path, runqlat in results:
+        s = runqlat["summary"]
+        print("{}: run queue latency of {} runnable periods, avg {:.1f}us, p50 {:.1f}us, p99 {:.1f}us, max {:.1f}us".format(
+            path, s["count"], s["avg"] * 10 ** 6, s["p50"] * 10 ** 6, s["p99"] * 10 ** 6, s["max"] * 10 ** 6))
+        for bucket in runqlat["log2_us"]:
+            print("  {:>8} -> {:<8} : {}".format(bucket["start_us"], bucket["end_us"], bucket["count"]))
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Off-CPU, wakeup and run queue latency analysis of perf scheduler events")
+    parser.add_argument(
+        "files",
+        help="perf script --show-switch-events output of get_perfdata.sh (.perf or .perf.gz)",
+        nargs="+")
+    parser.add_argument(
+        "--mode",
+        help="off-cpu: flame graph of the time off the CPU, wakeup: flame graph of the wakers, "
+             "runqlat: only the run queue latency histogram",
+        choices=MODES,
+        default="off-cpu")
+    parser.add_argument(
+        "--output_dir",
+        help="output directory, defaults to the directory of each input",
+        default="")
+    parser.add_argument(
+        "--pid",
+        help="pid of the profiled process in the pod, defaults to the pid in the <labels>.timing.json of each input",
+        type=int,
+        default=None)
+    parser.add_argument(
+        "--processes",
+        help="number of files processed in parallel, defaults to the number of cores",
+        type=int,
+        default=0)
+    return parser
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,299 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compares two CPU profiles, e.g. the runs of two setups. Profiles are read
+# from folded stacks or from the SVGs written by flamegraph.pl or
+# flamegraph.py, normalized by their total samples and averaged over the
+# files of each side. Reports the functions and subsystems whose self and
+# inclusive share of the samples changed the most and renders a differential
+# flame graph of the second profile, red where it spends more and blue where
+# it spends less than the first one.
+
+from __future__ import print_function
+import argparse
+import bisect
+import collections
+import re
+from xml.sax.saxutils import unescape
+import flamegraph
+
+SUBSYSTEMS = collections.OrderedDict([
+    ("TLS", r"SSL_|ssl_|ssl3_|tls|Tls|bssl::|EVP_|aes_|sha256|chacha|gcm_|Ssl::|crypto/tls"),
+    ("HTTP/2 codec", r"nghttp2|Http2::|http2|oghttp2|hpack|Hpack"),
+    ("gRPC", r"grpc|Grpc"),
+    # the control plane stream of envoy and of proxyless gRPC
+    ("xDS", r"xds|Xds|GrpcMux|Config::Grpc|Subscription|discovery"),
+    ("syscalls", r"entry_SYSCALL|do_syscall_64|__x64_sys_|__arm64_sys_|syscall\.Syscall|runtime\.entersyscall"),
+])
+
+# <title>name (1,234 samples, 0.01%)</title><rect x="10.0" y="1077" width="0.5" ...
+SVG_FRAME = re.compile(r'<title>(.*?) \(([\d,]+) samples?, [\d.]+%\)</title>\s*'
+                       r'<rect x="([-\d.]+)" y="([-\d.]+)" width="([\d.]+)"')
+
+# tolerance of frame boundaries, the geometry is rounded to 0.1 pixels
+SVG_TOLERANCE = 0.15
+
+# frames are scaled to integer counts of this many parts for rendering
+RENDER_SCALE = 10 ** 9
+
+
+# the parent of a frame contains it within the rounding of the geometry. Near
+# the boundary of two parents the one that still has room for the samples of
+# the frame and overlaps it the most is chosen
+def find_parent(parents, ends, frame, selfs):
+    _, samples, x, _, width = frame
+    best = None
+    best_key = None
+    i = bisect.bisect_left(ends, x + width - SVG_TOLERANCE)
+    while i < len(parents) and parents[i][2] <= x + SVG_TOLERANCE:
+        p = parents[i]
+        overlap = min(x + width, p[2] + p[4]) - max(x, p[2])
+        key = (selfs[id(p)] >= samples, overlap)
+        if best_key is None or key > best_key:
+            best = p
+            best_key = key
+        i += 1
+    return best
+
+
+# rebuilds folded stacks from the frames of a flame graph SVG. The parent of a
+# frame is the frame one level below it that contains it, the self samples of
+# a frame are its samples minus the samples of its children. Frames too narrow
+# to be drawn are counted as self samples of their parent.
+def read_svg(path):
+    with open(path, "r", errors="replace") as f:
+        frames = [(unescape(m.group(1)), int(m.group(2).replace(",", "")), float(m.group(3)), float(m.group(4)),
+                   float(m.group(5))) for m in SVG_FRAME.finditer(f.read())]
+    if not frames:
+        raise Exception("no flame graph frames found in {}".format(path))
+    levels = sorted(set(y for _, _, _, y, _ in frames), reverse=True)
+    by_level = [sorted((f for f in frames if f[3] == y), key=lambda f: f[2]) for y in levels]
+
+    counts = collections.defaultdict(int)
+    stacks = {}
+    selfs = {}
+    for depth, level in enumerate(by_level):
+        parents = [p for p in by_level[depth - 1] if id(p) in stacks] if depth else []
+        ends = [p[2] + p[4] for p in parents]
+        for frame in level:
+            name, samples, x, _, width = frame
+            stack = ()
+            if depth:
+                parent = find_parent(parents, ends, frame, selfs)
+                if parent is None:
+                    continue
+                stack = stacks[id(parent)]
+                selfs[id(parent)] -= samples
+            stacks[id(frame)] = stack + (name,)
+            selfs[id(frame)] = samples
+    for level in by_level:
+        for frame in level:
+            if id(frame) in stacks and selfs[id(frame)] > 0:
+                # the root frame "all" is not part of the folded stacks
+                stack = stacks[id(frame)][1:]
+                if stack:
+                    counts[";".join(stack)] += selfs[id(frame)]
+    return counts
+
+
+def read_profile(path):
+    if path.endswith(".svg"):
+        return read_svg(path)
+    return flamegraph.read_folded(path)
+
+
+# returns {stack: share of the samples} averaged over the files, the first
+# frame (process or thread name) is removed unless keep_comm is set
+def load_profile(paths, keep_comm=False):
+    profile = collections.defaultdict(float)
+    for path in paths:
+        counts = read_profile(path)
+        total = float(sum(counts.values()))
+        for stack, count in counts.items():
+            if not keep_comm:
+                stack = stack.partition(";")[2]
+                if not stack:
+                    continue
+            profile[stack] += count / total / len(paths)
+    return profile
+
+
+# self and inclusive share of every function, recursive frames are counted
+# once per stack
+def function_shares(profile):
+    self_share = collections.defaultdict(float)
+    inclusive = collections.defaultdict(float)
+    for stack, share in profile.items():
+        names = stack.split(";")
+        self_share[names[-1]] += share
+        for name in set(names):
+            inclusive[name] += share
+    return self_share, inclusive
+
+
+# a stack belongs to a subsystem inclusively if any of its frames matches and
+# by self time if its leaf frame matches
+def subsystem_shares(profile, subsystems):
+    patterns = [(name, re.compile(pattern)) for name, pattern in subsystems.items()]
+    self_share = collections.defaultdict(float)
+    inclusive = collections.defaultdict(float)
+    for stack, share in profile.items():
+        names = stack.split(";")
+        for name, pattern in patterns:
+            if pattern.search(names[-1]):
+                self_share[name] += share
+            if any(pattern.search(n) for n in names):
+                inclusive[name] += share
+    return self_share, inclusive
+
+
+def deltas(before, after):
+    keys = set(before) | set(after)
+    return sorted(((k, before.get(k, 0.0), after.get(k, 0.0), after.get(k, 0.0) - before.get(k, 0.0)) for k in keys),
+                  key=lambda row: -abs(row[3]))
+
+
+# share of the samples of every stack prefix, keyed by the frame path of
+# flamegraph.build_frames
+def path_shares(profile):
+    shares = collections.defaultdict(float)
+    for stack, share in profile.items():
+        path = ("all",)
+        shares[path] += share
+        for name in stack.split(";"):
+            path += (name,)
+            shares[path] += share
+    return shares
+
+
+# the frames are drawn in the shape of the second profile, or of the first one
+# if negate is set, and colored by the change from the first to the second
+def render_diff(before, after, title="Differential Flame Graph", negate=False):
+    before_paths = path_shares(before)
+    after_paths = path_shares(after)
+    largest = max([abs(after_paths.get(p, 0.0) - before_paths.get(p, 0.0))
+                   for p in set(after_paths) | set(before_paths)] or [0.0]) or 1.0
+
+    def color(path):
+        delta = after_paths.get(path, 0.0) - before_paths.get(path, 0.0)
+        fade = int(210 * (1.0 - min(1.0, abs(delta) / largest)))
+        if delta > 0:
+            return "rgb(255,{},{})".format(fade, fade)
+        if delta < 0:
+            return "rgb({},{},255)".format(fade, fade)
+        return "rgb(210,210,210)"
+
+    def title_fn(path, samples, total):
+        b = 100.0 * before_paths.get(path, 0.0)
+        a = 100.0 * after_paths.get(path, 0.0)
+        return "{} ({:.2f}% -> {:.2f}%, {:+.2f})".format(path[-1], b, a, a - b)
+
+    shape = before if negate else after
+    counts = {stack: int(round(share * RENDER_SCALE)) for stack, share in shape.items()}
+    counts = {stack: count for stack, count in counts.items() if count > 0}
+    return flamegraph.render_svg(counts, title, color_fn=color, title_fn=title_fn)
+
+
+def print_table(title, rows, top):
+    print(title)
+    print("  {:>9} {:>9} {:>9}  {}".format("before%", "after%", "delta", "name"))
+    for name, b, a, d in rows[:top]:
+        print("  {:9.3f} {:9.3f} {:+9.3f}  {}".format(100 * b, 100 * a, 100 * d, name))
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    subsystems = collections.OrderedDict(SUBSYSTEMS)
+    for subsystem in args.subsystem:
+        name, _, pattern = subsystem.partition("=")
+        subsystems[name] = pattern
+    before = load_profile(args.before, args.keep_comm)
+    after = load_profile(args.after, args.keep_comm)
+
+    before_self, before_inclusive = subsystem_shares(before, subsystems)
+    after_self, after_inclusive = subsystem_shares(after, subsystems)
+    print_table("Subsystems by inclusive time", deltas(before_inclusive, after_inclusive), len(subsystems))
+    print_table("Subsystems by self time", deltas(before_self, after_self), len(subsystems))
+
+    before_self, before_inclusive = function_shares(before)
+    after_self, after_inclusive = function_shares(after)
+    self_rows = deltas(before_self, after_self)
+    inclusive_rows = deltas(before_inclusive, after_inclusive)
+    print_table("Functions by inclusive time", inclusive_rows, args.top)
+    print_table("Functions by self time", self_rows, args.top)
+
+    if args.csv_output:
+        with open(args.csv_output, "w+") as out:
+            out.write("kind,name,before,after,delta\n")
+            for kind, rows in [("self", self_rows), ("inclusive", inclusive_rows)]:
+                for name, b, a, d in rows:
+                    out.write('{},"{}",{},{},{}\n'.format(kind, name.replace('"', '""'), b, a, d))
+        print("Wrote", args.csv_output)
+    if args.svg_output:
+        with open(args.svg_output, "w+") as out:
+            out.write(render_diff(before, after, args.title, args.negate))
+        print("Wrote differential flame graph", args.svg_output)
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Compare two CPU profiles")
+    parser.add_argument(
+        "--before",
+        help="folded stacks or flame graph svgs of the first profile, the shares are averaged over the files",
+        nargs="+",
+        required=True)
+    parser.add_argument(
+        "--after",
+        help="folded stacks or flame graph svgs of the second profile",
+        nargs="+",
+        required=True)
+    parser.add_argument(
+        "--top",
+        help="number of functions to print",
+        type=int,
+        default=20)
+    parser.add_argument(
+        "--subsystem",
+        help="additional subsystem as name=regex, can be repeated",
+        action="append",
+        default=[])
+    parser.add_argument(
+        "--keep_comm",
+        help="keep the process or thread name frame, by default it is removed so that "
+             "differently named processes and threads can be compared",
+        action="store_true")
+    parser.add_argument(
+        "--svg_output",
+        help="output path of the differential flame graph",
+        default="")
+    parser.add_argument(
+        "--negate",
+        help="draw the differential flame graph in the shape of the first profile, "
+             "which shows the frames that disappeared",
+        action="store_true")
+    parser.add_argument(
+        "--title",
+        help="title of the differential flame graph",
+        default="Differential Flame Graph")
+    parser.add_argument(
+        "--csv_output",
+        help="output path of all function deltas",
+        default="")
+    return parser
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
@@ -18,11 +18,103 @@
 # Changes made to adapt test runner to test setups.
 
 from __future__ import print_function
+import collections
 import datetime
 import calendar
 import requests
 import json
+from urllib.parse import urlencode
+from urllib3.util.retry import Retry
 import argparse
+import concurrent.futures
+import heapq
+import os
+import shutil
+import tempfile
+
+
+TARGETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "targets.json")
+
+# resource usage targets by key: namespace, pod name prefix, container name
+# and the regex of the pod names in prometheus, read from targets.json
+TARGET = collections.namedtuple('Target', ['namespace', 'pod', 'container', 'pod_regex'])
+TARGETS = collections.OrderedDict()
+# the target keys of every setup
+SETUPS = collections.OrderedDict()
+DEFAULT_SETUP = ""
+
+
+def load_targets(path=TARGETS_FILE):
+    global DEFAULT_SETUP
+    with open(path, "r") as f:
+        config = json.load(f, object_pairs_hook=collections.OrderedDict)
+    TARGETS.clear()
+    for key, target in config["targets"].items():
+        TARGETS[key] = TARGET(target["namespace"], target["pod"], target["container"],
+                              target.get("pod_regex", target["pod"] + ".*"))
+    SETUPS.clear()
+    for setup, keys in config["setups"].items():
+        unknown = [key for key in keys if key not in TARGETS]
+        if unknown:
+            raise Exception("unknown targets {} of setup {} in {}".format(unknown, setup, path))
+        SETUPS[setup] = list(keys)
+    DEFAULT_SETUP = config.get("default_setup", next(iter(SETUPS), ""))
+
+
+load_targets()
+
+
+# metrics by resource type: query template, scope of the series, column prefix
+# and the conversion of the values. Container metrics are collected for the
+# targets, pod metrics for the pods of the targets and cluster metrics are
+# the sums over all nodes of the cluster, not only the nodes of the targets.
+# The cluster metrics need the node exporter.
+METRIC = collections.namedtuple('Metric', ['template', 'scope', 'column', 'convert', 'unconvert'])
+METRICS = collections.OrderedDict([
+    ("cpu", METRIC("rate(container_cpu_usage_seconds_total{selector}[{rate}])", "container", "cpu_milli_avg_",
+                   lambda v: to_milli_cpus(v), lambda v: from_milli_cpus(v))),
+    ("mem", METRIC("container_memory_usage_bytes{selector}", "container", "mem_MiB_avg_",
+                   lambda v: to_mebibytes(v), lambda v: from_mebibytes(v))),
+    ("throttled", METRIC("rate(container_cpu_cfs_throttled_periods_total{selector}[{rate}])", "container",
+                         "throttled_periods_avg_", float, float)),
+    ("net-rx-bytes", METRIC("rate(container_network_receive_bytes_total{selector}[{rate}])", "pod", "net_rx_KiB_avg_",
+                            lambda v: to_kibibytes(v), lambda v: from_kibibytes(v))),
+    ("net-tx-bytes", METRIC("rate(container_network_transmit_bytes_total{selector}[{rate}])", "pod", "net_tx_KiB_avg_",
+                            lambda v: to_kibibytes(v), lambda v: from_kibibytes(v))),
+    ("net-rx-packets", METRIC("rate(container_network_receive_packets_total{selector}[{rate}])", "pod",
+                              "net_rx_packets_avg_", float, float)),
+    ("net-tx-packets", METRIC("rate(container_network_transmit_packets_total{selector}[{rate}])", "pod",
+                              "net_tx_packets_avg_", float, float)),
+    ("cluster-cpu", METRIC('rate(node_cpu_seconds_total{{mode!="idle"}}[{rate}])', "cluster", "cluster_cpu_milli_avg",
+                           lambda v: to_milli_cpus(v), lambda v: from_milli_cpus(v))),
+    ("cluster-context-switches", METRIC("rate(node_context_switches_total[{rate}])", "cluster",
+                                        "cluster_context_switches_avg", float, float)),
+])
+
+# defaults of the query_range step in seconds and the rate window of the
+# counters, two scrapes of cAdvisor fit in the rate window
+DEFAULT_STEP = 15
+DEFAULT_RATE_WINDOW = "1m"
+
+# prometheus refuses range queries of more points per series, longer ranges
+# are fetched in chunks of at most this many steps
+MAX_POINTS_PER_SERIES = 11000
+
+# number of chunks of a range fetched at the same time
+CHUNK_CONCURRENCY = 4
+
+# prefixes of the per-run usage files of the resource usage sources
+USAGE_SOURCES = collections.OrderedDict([("prometheus", ""), ("cgroup", "cgroup-")])
+
+# the metrics every run has, also used by compare.py and efficiency.py
+RESOURCE_TYPES = ["cpu", "mem"]
+
+CLUSTER_KEY = "cluster"
+
+
+# a query of a required metric is not in the cache in offline mode
+class NotCached(Exception):
+    pass
 
 
 def calculate_average(item, resource_type):
@@ -31,84 +123,316 @@ def calculate_average(item, resource_type):
     for data_point in data_points_list:
         data_sum += float(data_point[1])
     data_avg = float(data_sum / len(data_points_list))
-    if resource_type == "cpu":
-        return to_milli_cpus(data_avg)
-    else:
-        return to_mebibytes(data_avg)
+    return METRICS[resource_type].convert(data_avg)
+
+
+def select_targets(resource_usage_targets):
+    return SETUPS.get(resource_usage_targets, SETUPS.get(DEFAULT_SETUP, []))
+
+
+# the pods of the targets by pod name prefix
+def select_pods(target_keys):
+    pods = collections.OrderedDict()
+    for key in target_keys:
+        target = TARGETS[key]
+        pods.setdefault(target.pod, target)
+    return pods
+
+
+# all keys a metric can have values of
+def metric_keys(resource_type):
+    scope = METRICS[resource_type].scope
+    if scope == "container":
+        return list(TARGETS)
+    if scope == "pod":
+        return list(select_pods(TARGETS))
+    return [CLUSTER_KEY]
+
+
+# the keys a run of a setup has values of
+def selected_keys(resource_type, target_keys):
+    scope = METRICS[resource_type].scope
+    if scope == "container":
+        return list(target_keys)
+    if scope == "pod":
+        return list(select_pods(target_keys))
+    return [CLUSTER_KEY]
 
 
+def column_name(resource_type, key):
+    metric = METRICS[resource_type]
+    return metric.column if metric.scope == "cluster" else metric.column + key
+
+
+# the csv columns of the metrics for all targets
+def metric_columns(resource_types):
+    return [column_name(resource_type, key) for resource_type in resource_types for key in metric_keys(resource_type)]
+
+
+def target_selector(target):
+    return '{{namespace="{}",pod=~"{}",container="{}"}}'.format(target.namespace, target.pod_regex, target.container)
+
+
+def pod_selector(target):
+    return '{{namespace="{}",pod=~"{}"}}'.format(target.namespace, target.pod_regex)
+
+
+def usage_filename(resource_type, filename, source="prometheus"):
+    return USAGE_SOURCES[source] + resource_type + "-usage_" + filename
+
+
+# builds a query that only selects the series of the given targets, e.g.
+# rate(container_cpu_usage_seconds_total{...}[1m]) or rate(...{...}[1m])
+def build_query(template, target_keys, aggregate=True, rate_window=DEFAULT_RATE_WINDOW):
+    query = " or ".join(template.format(selector=target_selector(TARGETS[key]), rate=rate_window)
+                        for key in target_keys)
+    if aggregate:
+        query = "sum by (namespace, pod, container) ({})".format(query)
+    return query
+
+
+# one query of a metric for all targets, pods or the cluster of a run
+def build_metric_query(resource_type, target_keys, aggregate=True, rate_window=DEFAULT_RATE_WINDOW):
+    metric = METRICS[resource_type]
+    if metric.scope == "container":
+        return build_query(metric.template, target_keys, aggregate, rate_window)
+    if metric.scope == "pod":
+        # the series of the network interfaces of a pod are always summed
+        query = " or ".join(metric.template.format(selector=pod_selector(target), rate=rate_window)
+                            for target in select_pods(target_keys).values())
+        return "sum by (namespace, pod) ({})".format(query)
+    return "sum({})".format(metric.template.format(rate=rate_window))
+
+
+# the keys whose series a query selects, older runs were saved from queries
+# of all series of a metric without a selector
+def query_keys(resource_type, query):
+    scope = METRICS[resource_type].scope
+    if scope == "cluster" or "{namespace=" not in query:
+        return metric_keys(resource_type)
+    if scope == "container":
+        return [key for key, target in TARGETS.items() if target_selector(target) in query]
+    return [key for key, target in select_pods(TARGETS).items() if pod_selector(target) in query]
+
+
+def match_target(item_metric):
+    if "pod" not in item_metric or "container" not in item_metric:
+        return None
+    for key, target in TARGETS.items():
+        if "namespace" in item_metric and item_metric["namespace"] != target.namespace:
+            continue
+        if item_metric["pod"].startswith(target.pod) and item_metric["container"] == target.container:
+            return key
+    return None
+
+
+def match_pod(item_metric):
+    if "pod" not in item_metric:
+        return None
+    for key, target in select_pods(TARGETS).items():
+        if "namespace" in item_metric and item_metric["namespace"] != target.namespace:
+            continue
+        if item_metric["pod"].startswith(target.pod):
+            return key
+    return None
+
+
+def match_metric(resource_type, item_metric):
+    scope = METRICS[resource_type].scope
+    if scope == "container":
+        return match_target(item_metric)
+    if scope == "pod":
+        return match_pod(item_metric)
+    return CLUSTER_KEY
+
+
+# the series of several pods of a target, e.g. the load generators of a run
+# with several clients, are summed. Series of the same pod replace each other
 def get_average_within_query_time_range(data, resource_type):
-    val_by_pod_name = {"main_fortioclient": -1, "istio-proxy_istio-ingressgateway": -1,
-                       "http-server_http-server": -1, "demo-service_demo-service": -1,
-                       "istio-proxy_http-server": -1, "istio-proxy_demo-service": -1,
-                       "cilium_cilium-agent": -1}
+    val_by_pod_name = collections.OrderedDict((key, -1) for key in metric_keys(resource_type))
+    pods = collections.defaultdict(set)
     if data["data"]["result"]:
         for item in data["data"]["result"]:
-            item_metric = item["metric"]
-            if "pod" in item_metric and "container" in item_metric:
-                pod_name = item_metric["pod"]
-                container_name = item["metric"]["container"]
-                if "fortioclient" in pod_name and "main" == container_name:
-                    val_by_pod_name["main_fortioclient"] = calculate_average(item, resource_type)
-                if "istio-ingressgateway" in pod_name and "istio-proxy" == container_name:
-                    val_by_pod_name["istio-proxy_istio-ingressgateway"] = calculate_average(item, resource_type)
-                if "http-server" in pod_name and "http-server" == container_name:
-                    val_by_pod_name["http-server_http-server"] = calculate_average(item, resource_type)
-                if "http-server" in pod_name and "istio-proxy" == container_name:
-                    val_by_pod_name["istio-proxy_http-server"] = calculate_average(item, resource_type)
-                if "demo-service" in pod_name and "demo-service" == container_name:
-                    val_by_pod_name["demo-service_demo-service"] = calculate_average(item, resource_type)
-                if "demo-service" in pod_name and "istio-proxy" == container_name:
-                    val_by_pod_name["istio-proxy_demo-service"] = calculate_average(item, resource_type)
-                if "cilium" in pod_name and "cilium-agent" == container_name:
-                    val_by_pod_name["cilium_cilium-agent"] = calculate_average(item, resource_type)
+            key = match_metric(resource_type, item["metric"])
+            if key is not None:
+                value = calculate_average(item, resource_type)
+                pod = item["metric"].get("pod", "")
+                if pods[key] and pod not in pods[key]:
+                    value += val_by_pod_name[key]
+                pods[key].add(pod)
+                val_by_pod_name[key] = value
     return val_by_pod_name
 
 def convert_data_list(item, resource_type):
     data_points_list = item["values"]
     output_list = []
     for data_point in data_points_list:
-        value = -1
-        if resource_type == "cpu":
-            value = to_milli_cpus(float(data_point[1]))
-        else:
-            value = to_mebibytes(float(data_point[1]))
+        value = METRICS[resource_type].convert(float(data_point[1]))
         output_list.append({"timestamp": data_point[0], "value": value})
     return output_list
 
+
+# sums two lists of data points by timestamp
+def sum_data_lists(a, b):
+    values = collections.OrderedDict()
+    for data_point in a + b:
+        values[data_point["timestamp"]] = values.get(data_point["timestamp"], 0) + data_point["value"]
+    return [{"timestamp": t, "value": v} for t, v in sorted(values.items())]
+
+
+def series_labels(resource_type, key):
+    scope = METRICS[resource_type].scope
+    if scope == "container":
+        target = TARGETS[key]
+        return {"namespace": target.namespace, "pod": target.pod, "container": target.container}
+    if scope == "pod":
+        target = select_pods(TARGETS)[key]
+        return {"namespace": target.namespace, "pod": target.pod}
+    return {}
+
+
+# converts the datasets of a per-run json file back to a query_range response
+def datasets_to_response(datasets, resource_type, seed=""):
+    result = []
+    for key in metric_keys(resource_type):
+        if not datasets.get(key):
+            continue
+        values = []
+        for data_point in datasets[key]:
+            values.append([data_point["timestamp"], repr(METRICS[resource_type].unconvert(data_point["value"]))])
+        result.append({"metric": series_labels(resource_type, key), "values": values})
+    return {"status": "success", "data": {"resultType": "matrix", "result": result}, "seed": seed}
+
 def save_to_file_datasets_within_query_time_range(data, resource_type, json_output_dir, filename_suffix, query_url):
-    val_by_pod_name = {"main_fortioclient": [], "istio-proxy_istio-ingressgateway": [],
-                       "http-server_http-server": [], "demo-service_demo-service": [],
-                       "istio-proxy_http-server": [], "istio-proxy_demo-service": [],
-                       "cilium_cilium-agent": [],
-                       "query_url": query_url}
+    val_by_pod_name = collections.OrderedDict((key, []) for key in metric_keys(resource_type))
+    val_by_pod_name["query_url"] = query_url
+    pods = collections.defaultdict(set)
     if data["data"]["result"]:
         for item in data["data"]["result"]:
-            item_metric = item["metric"]
-            if "pod" in item_metric and "container" in item_metric:
-                pod_name = item_metric["pod"]
-                container_name = item["metric"]["container"]
-                if "fortioclient" in pod_name and "main" == container_name:
-                    val_by_pod_name["main_fortioclient"] = convert_data_list(item, resource_type)
-                if "istio-ingressgateway" in pod_name and "istio-proxy" == container_name:
-                    val_by_pod_name["istio-proxy_istio-ingressgateway"] = convert_data_list(item, resource_type)
-                if "http-server" in pod_name and "http-server" == container_name:
-                    val_by_pod_name["http-server_http-server"] = convert_data_list(item, resource_type)
-                if "http-server" in pod_name and "istio-proxy" == container_name:
-                    val_by_pod_name["istio-proxy_http-server"] = convert_data_list(item, resource_type)
-                if "demo-service" in pod_name and "demo-service" == container_name:
-                    val_by_pod_name["demo-service_demo-service"] = convert_data_list(item, resource_type)
-                if "demo-service" in pod_name and "istio-proxy" == container_name:
-                    val_by_pod_name["istio-proxy_demo-service"] = convert_data_list(item, resource_type)
-                if "cilium" in pod_name and "cilium-agent" == container_name:
-                    val_by_pod_name["cilium_cilium-agent"] = convert_data_list(item, resource_type)
-    
+            key = match_metric(resource_type, item["metric"])
+            if key is not None:
+                values = convert_data_list(item, resource_type)
+                pod = item["metric"].get("pod", "")
+                if pods[key] and pod not in pods[key]:
+                    values = sum_data_lists(val_by_pod_name[key], values)
+                pods[key].add(pod)
+                val_by_pod_name[key] = values
+
     # Save to file
-    filename = json_output_dir + "/" + resource_type + "-usage_" + filename_suffix
+    filename = json_output_dir + "/" + usage_filename(resource_type, filename_suffix)
     with open(filename, "w+") as output_file:
         print(filename)
         output_file.write(json.dumps(val_by_pod_name, indent=2))
 
+# the series of the chunks of a range query, spooled to temporary files so
+# that only the chunks being fetched are held in memory. The sum and count of
+# the values are kept for the averages
+class SeriesSpool:
+    SERIES = collections.namedtuple('Series', ['metric', 'path', 'total', 'count'])
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix="prom-spool-")
+        # labels: Series
+        self.series = collections.OrderedDict()
+
+    def add(self, data):
+        for item in data["data"]["result"]:
+            labels = tuple(sorted(item["metric"].items()))
+            series = self.series.get(labels)
+            if series is None:
+                series = self.SERIES(item["metric"], os.path.join(self.dir, str(len(self.series))), 0, 0)
+            total = series.total
+            with open(series.path, "a") as f:
+                for data_point in item["values"]:
+                    f.write("{} {}\n".format(json.dumps(data_point[0]), data_point[1]))
+                    total += float(data_point[1])
+            self.series[labels] = series._replace(total=total, count=series.count + len(item["values"]))
+
+    # (timestamp, value) of a series in time order
+    @staticmethod
+    def values(series):
+        with open(series.path, "r") as f:
+            for line in f:
+                timestamp, value = line.split(" ", 1)
+                yield json.loads(timestamp), value.strip()
+
+    # {key: {pod: series}}, like the other series of a pod the later series
+    # replaces the earlier ones
+    def by_key(self, resource_type):
+        keys = collections.OrderedDict()
+        for series in self.series.values():
+            key = match_metric(resource_type, series.metric)
+            if key is not None:
+                keys.setdefault(key, collections.OrderedDict())[series.metric.get("pod", "")] = series
+        return keys
+
+    def close(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+# the same averages as get_average_within_query_time_range from the sums of
+# the spooled series
+def get_average_of_spool(spool, resource_type):
+    val_by_pod_name = collections.OrderedDict((key, -1) for key in metric_keys(resource_type))
+    for key, pods in spool.by_key(resource_type).items():
+        value = 0
+        for series in pods.values():
+            if series.count:
+                value += METRICS[resource_type].convert(float(series.total / series.count))
+        val_by_pod_name[key] = value
+    return val_by_pod_name
+
+
+# the converted data points of a key, the pods are summed by timestamp while
+# merging their series
+def spooled_data_points(spool, resource_type, pods):
+    convert = METRICS[resource_type].convert
+    if len(pods) == 1:
+        for timestamp, value in spool.values(next(iter(pods.values()))):
+            yield {"timestamp": timestamp, "value": convert(float(value))}
+        return
+    merged = heapq.merge(*[((t, i, convert(float(v))) for t, v in spool.values(series))
+                           for i, series in enumerate(pods.values())])
+    current, total = None, 0
+    for timestamp, _, value in merged:
+        if current is not None and timestamp != current:
+            yield {"timestamp": current, "value": total}
+            total = 0
+        current = timestamp
+        total += value
+    if current is not None:
+        yield {"timestamp": current, "value": total}
+
+
+# writes the per-run json file of the spooled series point by point, in the
+# layout of save_to_file_datasets_within_query_time_range
+def save_to_file_spooled_datasets(spool, resource_type, json_output_dir, filename_suffix, query_url):
+    by_key = spool.by_key(resource_type)
+    filename = json_output_dir + "/" + usage_filename(resource_type, filename_suffix)
+    with open(filename, "w+") as output_file:
+        print(filename)
+        output_file.write("{")
+        for key in metric_keys(resource_type):
+            output_file.write("\n  {}: [".format(json.dumps(key)))
+            first = True
+            for data_point in spooled_data_points(spool, resource_type, by_key.get(key, {})):
+                output_file.write("{}\n    {{\n      \"timestamp\": {},\n      \"value\": {}\n    }}".format(
+                    "" if first else ",", json.dumps(data_point["timestamp"]), json.dumps(data_point["value"])))
+                first = False
+            output_file.write("]," if first else "\n  ],")
+        output_file.write("\n  \"query_url\": {}\n}}".format(json.dumps(query_url)))
+
+
+# returns a session that keeps up to pool_size connections to prometheus alive
+# and retries failed queries with exponential backoff
+def new_session(pool_size=4, retries=3, backoff=0.5):
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1), max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 class Prom:
     # url: base url for prometheus
     def __init__(
@@ -121,7 +445,13 @@ class Prom:
             aggregate=True,
             resource_usage_targets="",
             json_output_dir="",
-            filename_suffix=""):
+            filename_suffix="",
+            session=None,
+            cache=None,
+            metrics=None,
+            step=DEFAULT_STEP,
+            rate_window=DEFAULT_RATE_WINDOW,
+            chunk_concurrency=CHUNK_CONCURRENCY):
         self.url = url
         self.nseconds = nseconds
         self.resource_usage_targets=resource_usage_targets
@@ -140,63 +470,139 @@ class Prom:
         if host is not None:
             self.headers["Host"] = host
         self.aggregate = aggregate
+        self.session = session if session is not None else new_session()
+        self.cache = cache
+        self.step = step
+        self.rate_window = rate_window
+        self.chunk_concurrency = chunk_concurrency
+        self.metrics = metrics if metrics is not None else list(METRICS)
+
+    # fetches a metric of all targets of the run with one query and returns
+    # the averages by key, or None if the metric is not in the offline cache
+    def fetch_metric(self, resource_type):
+        query = build_metric_query(resource_type, select_targets(self.resource_usage_targets), self.aggregate,
+                                   self.rate_window)
+        required = resource_type in RESOURCE_TYPES
+        chunks = self.chunks()
+        # a per-run json file seeded into the cache covers the whole range
+        if len(chunks) > 1 and not (self.cache is not None and
+                                    self.cache.get_seed(resource_type, self.seed_keys(resource_type), self.start,
+                                                        self.end, self.step)):
+            return self.fetch_metric_in_chunks(query, resource_type, chunks, required)
+        data, query_url = self.fetch_by_query(query, resource_type, required=required)
+        if data is None:
+            return None
+        # data seeded from a per-run json file is already saved
+        if not data.get("seed"):
+            save_to_file_datasets_within_query_time_range(data, resource_type, self.json_output_dir,
+                                                          self.filename_suffix, query_url)
+        return get_average_within_query_time_range(data, resource_type)
+
+    # the keys a per-run json file seeded into the cache has to cover
+    def seed_keys(self, resource_type):
+        return selected_keys(resource_type, select_targets(self.resource_usage_targets))
 
     def fetch_container_cpu_usage(self):
-        cpu_query = 'rate(container_cpu_usage_seconds_total[1m])'
-        data, query_url = self.fetch_by_query(cpu_query)
-        save_to_file_datasets_within_query_time_range(data, "cpu", self.json_output_dir, self.filename_suffix, query_url)
-        avg_cpu_dict = get_average_within_query_time_range(data, "cpu")
-        return avg_cpu_dict
+        return self.fetch_metric("cpu")
 
     def fetch_container_memory_usage(self):
-        mem_query = 'container_memory_usage_bytes'
-        data, query_url = self.fetch_by_query(mem_query)
-        save_to_file_datasets_within_query_time_range(data, "mem", self.json_output_dir, self.filename_suffix, query_url)
-        avg_mem_dict = get_average_within_query_time_range(data, "mem")
-        return avg_mem_dict
+        return self.fetch_metric("mem")
 
-    def fetch_targets_cpu_and_mem(self):
+    # the averages of all metrics as csv columns, -1 if a metric or target
+    # has no data
+    def fetch_targets_metrics(self):
         out = {}
+        target_keys = select_targets(self.resource_usage_targets)
+        for resource_type in self.metrics:
+            avg_dict = self.fetch_metric(resource_type) or {}
+            for key in selected_keys(resource_type, target_keys):
+                out[column_name(resource_type, key)] = avg_dict.get(key, -1)
+        return out
 
-        avg_cpu_dict = self.fetch_container_cpu_usage()
-        avg_mem_dict = self.fetch_container_memory_usage()
-
-        out["cpu_milli_avg_main_fortioclient"] = avg_cpu_dict["main_fortioclient"]
-        out["cpu_milli_avg_http-server_http-server"] = avg_cpu_dict["http-server_http-server"]
-        out["cpu_milli_avg_demo-service_demo-service"] = avg_cpu_dict["demo-service_demo-service"]
-        out["mem_MiB_avg_main_fortioclient"] = avg_mem_dict["main_fortioclient"]
-        out["mem_MiB_avg_http-server_http-server"] = avg_mem_dict["http-server_http-server"]
-        out["mem_MiB_avg_demo-service_demo-service"] = avg_mem_dict["demo-service_demo-service"]
-
-        if self.resource_usage_targets == "cilium":
-            out["cpu_milli_avg_cilium_cilium-agent"] = avg_cpu_dict["cilium_cilium-agent"]
-            out["mem_MiB_avg_cilium_cilium-agent"] = avg_mem_dict["cilium_cilium-agent"]
-        elif self.resource_usage_targets == "baseline":
-            out["cpu_milli_avg_istio-proxy_istio-ingressgateway"] = avg_cpu_dict["istio-proxy_istio-ingressgateway"]
-            out["mem_MiB_avg_istio-proxy_istio-ingressgateway"] = avg_mem_dict["istio-proxy_istio-ingressgateway"]
-        else: # sidecar-istio or proxyless-istio
-            out["cpu_milli_avg_istio-proxy_http-server"] = avg_cpu_dict["istio-proxy_http-server"]
-            out["cpu_milli_avg_istio-proxy_demo-service"] = avg_cpu_dict["istio-proxy_demo-service"]
-            out["cpu_milli_avg_istio-proxy_istio-ingressgateway"] = avg_cpu_dict["istio-proxy_istio-ingressgateway"]
-            out["mem_MiB_avg_istio-proxy_http-server"] = avg_mem_dict["istio-proxy_http-server"]
-            out["mem_MiB_avg_istio-proxy_demo-service"] = avg_mem_dict["istio-proxy_demo-service"]
-            out["mem_MiB_avg_istio-proxy_istio-ingressgateway"] = avg_mem_dict["istio-proxy_istio-ingressgateway"]
+    # (start, end) of the chunks of the range, aligned to the step so that the
+    # chunks have the same timestamps as a single query of the range
+    def chunks(self):
+        span = (MAX_POINTS_PER_SERIES - 1) * self.step
+        chunks = []
+        start = self.start
+        while start + span < self.end:
+            chunks.append((start, start + span))
+            start += span + self.step
+        chunks.append((start, self.end))
+        return chunks
 
-        return out
+    def fetch_metric_in_chunks(self, query, resource_type, chunks, required):
+        params = {"query": query, "start": self.start, "end": self.end, "step": self.step}
+        query_url = self.url + "/api/v1/query_range?" + urlencode(params)
+        print("fetching {} in {} chunks".format(query_url, len(chunks)))
+        spool = SeriesSpool()
+        try:
+            for data in self.fetch_chunks(query, chunks, required):
+                if data is None:
+                    return None
+                spool.add(data)
+            save_to_file_spooled_datasets(spool, resource_type, self.json_output_dir, self.filename_suffix, query_url)
+            return get_average_of_spool(spool, resource_type)
+        finally:
+            spool.close()
 
-    def fetch_by_query(self, query):
-        resp = requests.get(self.url + "/api/v1/query_range", {
+    # yields the responses of the chunks in order, fetching up to
+    # chunk_concurrency chunks at the same time
+    def fetch_chunks(self, query, chunks, required):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(self.chunk_concurrency, 1)) as executor:
+            pending = collections.deque()
+            for start, end in chunks:
+                pending.append(executor.submit(self.fetch_range, query, start, end, None, required))
+                if len(pending) >= max(self.chunk_concurrency, 1):
+                    yield pending.popleft().result()[0]
+            while pending:
+                yield pending.popleft().result()[0]
+
+    def fetch_by_query(self, query, resource_type=None, required=True):
+        return self.fetch_range(query, self.start, self.end, resource_type, required)
+
+    def fetch_range(self, query, start, end, resource_type=None, required=True):
+        params = {
             "query": query,
-            "start": self.start,
-            "end": self.end,
-            "step": 15
-        }, headers=self.headers)
+            "start": start,
+            "end": end,
+            "step": self.step
+        }
+
+        if self.cache is not None:
+            data = self.cache.get(query, start, end, self.step)
+            if data is None and resource_type is not None:
+                data = self.cache.get_seed(resource_type, self.seed_keys(resource_type), start, end, self.step)
+            query_url = self.url + "/api/v1/query_range?" + urlencode(params)
+            if data is not None:
+                print("cached", query_url)
+                return data, query_url
+            if self.cache.offline:
+                # runs cached before a metric was added do not have it
+                if not required:
+                    print("not cached, skipped", query_url)
+                    return None, query_url
+                raise NotCached("query not found in cache in offline mode: " + query_url)
+
+        resp = self.session.get(self.url + "/api/v1/query_range", params=params, headers=self.headers)
         print(resp.request.url)
 
         if not resp.ok:
             raise Exception(str(resp))
 
-        return resp.json(), resp.request.url
+        data = resp.json()
+        if self.cache is not None:
+            self.cache.put(query, start, end, self.step, data)
+        return data, resp.request.url
+
+# convert float bytes to kibibytes
+def to_kibibytes(size):
+    return float(size / 1024)
+
+
+def from_kibibytes(size):
+    return float(size * 1024)
+
 
 # convert float bytes to mebibytes
 def to_mebibytes(mem):
@@ -208,16 +614,28 @@ def to_milli_cpus(cpu):
     return float(cpu * 1000.0)
 
 
+def from_mebibytes(mem):
+    return float(mem * 1024 * 1024)
+
+
+def from_milli_cpus(cpu):
+    return float(cpu / 1000.0)
+
+
 def main(argv):
     args = get_parser().parse_args(argv)
+    if args.targets_file:
+        load_targets(args.targets_file)
     p = Prom(args.url, args.nseconds, end=args.end,
-             host=args.host)
-    out = p.fetch_targets_cpu_and_mem()
+             host=args.host, aggregate=not args.no_aggregate,
+             resource_usage_targets=args.resource_usage_targets, metrics=args.metrics, step=args.prom_step,
+             rate_window=args.rate_window)
+    out = p.fetch_targets_metrics()
     print(json.dumps(out, indent=args.indent))    
 
 def get_parser():
     parser = argparse.ArgumentParser(
-        "Fetch cpu and memory stats from prometheus")
+        "Fetch resource usage stats from prometheus")
     parser.add_argument("url", help="prometheus base url")
     parser.add_argument(
         "nseconds", help="duration in seconds of the extract", type=int)
@@ -232,10 +650,43 @@ def get_parser():
         default=None)
     parser.add_argument(
         "--indent", help="pretty print json with indent", default=None)
+    parser.add_argument(
+        "--resource_usage_targets",
+        help="resource usage targets, a setup of the targets file: baseline, cilium, sidecar-istio or "
+             "proxyless-istio",
+        default="")
+    parser.add_argument(
+        "--targets_file",
+        help="json file of the resource usage targets and setups, defaults to targets.json next to prom.py",
+        default="")
+    parser.add_argument(
+        "--metrics",
+        help="metrics to fetch",
+        nargs="+",
+        choices=list(METRICS),
+        default=list(METRICS))
+    parser.add_argument(
+        "--no_aggregate",
+        help="do not sum the series of each pod and container in prometheus",
+        action="store_true")
+    add_resolution_arguments(parser)
 
     return parser
 
 
+# the step and rate window arguments shared with fortio.py
+def add_resolution_arguments(parser):
+    parser.add_argument(
+        "--prom_step",
+        help="query_range step in seconds, at least the scrape interval of cAdvisor",
+        type=int,
+        default=DEFAULT_STEP)
+    parser.add_argument(
+        "--rate_window",
+        help="rate window of the counters, e.g. 30s. It has to cover at least two scrapes",
+        default=DEFAULT_RATE_WINDOW)
+
+
 if __name__ == "__main__":
     import sys
     sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,198 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# On-disk cache of prometheus query_range responses. Entries are addressed by
+# a hash of (query, start, end, step) and stored as gzipped json. Only closed
+# time ranges are cached and they never expire, the cache is kept under a size
+# limit by removing the least recently used entries. The size is counted up
+# by the writes and the directory only scanned again when it is over the limit.
+
+from __future__ import print_function
+import argparse
+import calendar
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import threading
+from urllib.parse import urlparse, parse_qs
+import prom
+
+# a range is closed when its end is this many seconds in the past, after
+# which prometheus will not add more samples to it
+CLOSED_RANGE_MARGIN = 300
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def now():
+    return calendar.timegm(datetime.datetime.utcnow().utctimetuple())
+
+
+class QueryCache:
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        # bytes in the cache directory, None until it is first scanned
+        self.total = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, query, start, end, step):
+        return hashlib.sha256(json.dumps([query, int(start), int(end), int(step)]).encode()).hexdigest()
+
+    # per-run json files only contain the converted values of a resource type,
+    # they are found by resource type and time range instead of the query. The
+    # entry records the keys the query of the file covered
+    def seed_key(self, resource_type, start, end, step):
+        return self.key("seed:" + resource_type, start, end, step)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json.gz")
+
+    def read(self, key):
+        entry = self.read_entry(key)
+        return entry["data"] if entry is not None else None
+
+    def read_entry(self, key):
+        path = self.path(key)
+        try:
+            with gzip.open(path, "rt") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # used as the access time for evicting the least recently used entries
+        os.utime(path)
+        return entry
+
+    def write(self, key, entry):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with gzip.open(tmp_path, "wt") as f:
+            json.dump(entry, f)
+        size = os.path.getsize(tmp_path)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(tmp_path, path)
+        with self.lock:
+            if self.total is not None:
+                self.total += size - replaced
+            scan = self.total is None or self.total > self.max_bytes
+        if scan:
+            self.evict()
+
+    def get(self, query, start, end, step):
+        return self.read(self.key(query, start, end, step))
+
+    # the seeded data of a range if it covers all of the keys
+    def get_seed(self, resource_type, keys, start, end, step):
+        entry = self.read_entry(self.seed_key(resource_type, start, end, step))
+        if entry is None or not set(keys) <= set(entry.get("keys", [])):
+            return None
+        return entry["data"]
+
+    def put(self, query, start, end, step, data):
+        if end > now() - CLOSED_RANGE_MARGIN:
+            return False
+        self.write(self.key(query, start, end, step),
+                   {"query": query, "start": start, "end": end, "step": step, "data": data})
+        return True
+
+    def entries(self):
+        out = []
+        for root, _, files in os.walk(self.cache_dir):
+            for filename in files:
+                if filename.endswith(".json.gz"):
+                    path = os.path.join(root, filename)
+                    st = os.stat(path)
+                    out.append((st.st_mtime, st.st_size, path))
+        return out
+
+    def evict(self):
+        with self.lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+            self.total = total
+
+    # reads the <metric>-usage_ files written by
+    # prom.save_to_file_datasets_within_query_time_range back into the cache
+    def seed_from_dir(self, json_output_dir):
+        seeded = 0
+        for filename in sorted(os.listdir(json_output_dir)):
+            resource_type = filename.split("-usage_", 1)[0]
+            if "-usage_" not in filename or resource_type not in prom.METRICS:
+                continue
+            with open(os.path.join(json_output_dir, filename), "r") as f:
+                datasets = json.load(f)
+            params = parse_qs(urlparse(datasets.get("query_url", "")).query)
+            if not all(p in params for p in ["start", "end", "step"]):
+                continue
+            start, end, step = [int(float(params[p][0])) for p in ["start", "end", "step"]]
+            query = params.get("query", [""])[0]
+            key = self.seed_key(resource_type, start, end, step)
+            if os.path.exists(self.path(key)):
+                continue
+            self.write(key, {"query": query, "keys": prom.query_keys(resource_type, query),
+                             "start": start, "end": end, "step": step,
+                             "data": prom.datasets_to_response(datasets, resource_type, filename)})
+            seeded += 1
+        return seeded
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    cache = QueryCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024)
+    for json_output_dir in args.seed:
+        print("Seeded {} entries from {}".format(cache.seed_from_dir(json_output_dir), json_output_dir))
+    entries = cache.entries()
+    print("{} entries, {:.1f} MiB in {}".format(
+        len(entries), prom.to_mebibytes(sum(size for _, size, _ in entries)), args.cache_dir))
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Seed and inspect the prometheus query cache")
+    parser.add_argument(
+        "--cache_dir",
+        help="cache directory",
+        required=True)
+    parser.add_argument(
+        "--cache_max_mb",
+        help="maximum size of the cache in MiB",
+        type=int,
+        default=1024)
+    parser.add_argument(
+        "--seed",
+        help="json output directory to read cpu-usage_ and mem-usage_ files from, can be repeated",
+        action="append",
+        default=[])
+    return parser
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
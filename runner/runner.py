@@ -28,36 +28,41 @@ import shlex
 import uuid
 import sys
 import multiprocessing
+import time
 from subprocess import getoutput
 from fortio import METRICS_START_SKIP_DURATION, METRICS_END_SKIP_DURATION
+import fortio as fortio_results
+import inventory
+import monitor as run_monitor
+import cgroupsampler
+import prom
 
 APPLICATION_NAMESPACE = "default"
 LOADGENERATOR_NAMESPACE = "fortio"
 KUBE_SYSTEM_NAMESPACE = "kube-system"
-POD = collections.namedtuple('Pod', ['name', 'namespace', 'ip', 'labels'])
+ACCESS_LOG_DIR = "/var/lib/access-logs"
+# seconds to wait for the first request of Fortio before profiling anyway
+FORTIO_START_TIMEOUT = 60
+FORTIO_START_POLL_INTERVAL = 0.5
+# seconds from launching the clients of a run to their common start time,
+# enough for kubectl exec to reach all load generator pods
+CLIENT_START_DELAY = 5
+# targets of the load modes that drive the demo-service directly instead of
+# the ingress and the http-server, its gRPC ping service and TCP echo port
+DEMO_SERVICE_HOST = "demo-service." + APPLICATION_NAMESPACE + ".svc.cluster.local"
+LOAD_MODE_URLS = {
+    "http": "",
+    "grpc": DEMO_SERVICE_HOST + ":7070",
+    "tcp": "tcp://" + DEMO_SERVICE_HOST + ":8078",
+}
+# PeerAuthentication of setups/*/direct-load-mtls.yaml that lets the load
+# generator outside of the mesh reach those ports with STRICT mTLS
+DIRECT_LOAD_PEER_AUTHENTICATION = "demo-service-direct-load"
 processes = []
 
-def pod_info(filterstr="", namespace=APPLICATION_NAMESPACE, multi_ok=True):
-    cmd = "kubectl -n {namespace} get pod {filterstr}  -o json".format(
-        namespace=namespace, filterstr=filterstr)
-    op = getoutput(cmd)
-    o = json.loads(op)
-    items = o['items']
-
-    if not multi_ok and len(items) > 1:
-        raise Exception("more than one found " + op)
-
-    if not items:
-        raise Exception("no pods found with command [" + cmd + "]")
-
-    i = items[0]
-    return POD(i['metadata']['name'], i['metadata']['namespace'],
-               i['status']['podIP'], i['metadata']['labels'])
-
-
 def run_command(command):
     process = subprocess.Popen(shlex.split(command))
-    process.wait()
+    return process.wait()
 
 def kubectl_exec(pod, remote_cmd, runfn=run_command, namespace=LOADGENERATOR_NAMESPACE, container=None):
     c = ""
@@ -69,7 +74,20 @@ def kubectl_exec(pod, remote_cmd, runfn=run_command, namespace=LOADGENERATOR_NAM
         c=c,
         namespace=namespace)
     print(cmd, flush=True)
-    runfn(cmd)
+    return runfn(cmd)
+
+# runs a load generator command at the given unix time, the exit code of the
+# process is that of kubectl
+def start_client(pod, fortio_cmd, start_at=0):
+    delay = start_at - time.time()
+    if delay > 0:
+        time.sleep(delay)
+    sys.exit(kubectl_exec(pod, fortio_cmd))
+
+# the share of the client with the given index of a total, the first clients
+# get the remainder
+def client_share(total, index, clients):
+    return total // clients + (1 if index < total % clients else 0)
 
 class Fortio:
     def __init__(
@@ -79,24 +97,58 @@ class Fortio:
             duration=None,
             frequency=None,
             perf_targets=None,
+            profile_mode="on-cpu",
             extra_labels=None,
             results_dir=None,
-            url=""):
+            url="",
+            pods=None,
+            monitor=None,
+            clients=1,
+            sampler=None,
+            load_mode="http",
+            grpc_streams=1,
+            payload_size=0):
         self.run_id = str(uuid.uuid4()).partition('-')[0]
         self.conn = conn
         self.qps = qps
         self.duration = duration
         self.frequency = frequency
         self.perf_targets = perf_targets
+        self.profile_mode = profile_mode
         self.extra_labels = extra_labels
         self.labels = self.generate_test_labels()
         self.results_dir = results_dir
         self.url = url
         # bucket resolution in seconds
         self.r = "0.001"
-        self.http_server = pod_info("-lapp.kubernetes.io/name=http-server", namespace=APPLICATION_NAMESPACE)
-        self.demo_service = pod_info("-lapp.kubernetes.io/name=demo-service", namespace=APPLICATION_NAMESPACE)
-        self.client = pod_info("-lapp.kubernetes.io/name=loadgenerator", namespace=LOADGENERATOR_NAMESPACE)
+        self.pods = pods if pods is not None else inventory.INVENTORY
+        self.http_server = self.pods.pod("http-server", APPLICATION_NAMESPACE)
+        self.demo_service = self.pods.pod("demo-service", APPLICATION_NAMESPACE)
+        # the qps and connections are split over the clients, one per load generator pod
+        self.clients = clients
+        self.client_pods = self.pods.pods_of("loadgenerator", LOADGENERATOR_NAMESPACE)[:clients]
+        if len(self.client_pods) < clients:
+            raise Exception("{} clients requested but only {} load generator pods are running, "
+                            "scale the fortioclient deployment".format(clients, len(self.client_pods)))
+        if clients > 1 and conn < clients:
+            raise Exception("{} connections can not be split over {} clients".format(conn, clients))
+        self.client = self.client_pods[0]
+        # keyword arguments of the live monitor, None disables it
+        self.monitor = monitor
+        self.aborted = None
+        # the clients that exited with an error, e.g. kubectl or Fortio failed
+        self.failed = []
+        # keyword arguments of the cgroup samplers, None disables them
+        self.sampler = sampler
+        # http through the ingress, or grpc (the ping service) or tcp (echo)
+        # of the demo-service
+        self.load_mode = load_mode
+        self.grpc_streams = grpc_streams
+        self.payload_size = payload_size
+        if not self.url:
+            self.url = LOAD_MODE_URLS[load_mode]
+        if not self.url:
+            raise Exception("--url is required in {} load mode".format(load_mode))
 
     def generate_test_labels(self):
         labels = self.run_id
@@ -106,95 +158,473 @@ class Fortio:
         labels += "_" + self.extra_labels
         return labels
 
-    def generate_fortio_cmd(self):
+    def client_labels(self, index):
+        if self.clients == 1:
+            return ""
+        return "_client-{}-of-{}".format(index + 1, self.clients)
+
+    def access_log_file(self, index=0):
+        return ACCESS_LOG_DIR + "/access-log-file_" + self.extra_labels + self.client_labels(index).replace("_", "-") + ".json"
+
+    def client_qps(self, index=0):
+        if self.clients == 1 or self.qps <= 0:
+            return self.qps
+        return client_share(self.qps, index, self.clients)
+
+    # the options of the load mode
+    def load_options(self):
+        options = ""
+        if self.load_mode == "http":
+            options = "-httpbufferkb=128 "
+        elif self.load_mode == "grpc":
+            # unary pings echoing the payload, with concurrent streams on
+            # each connection
+            options = "-grpc -ping -s {} ".format(self.grpc_streams)
+        if self.payload_size > 0:
+            # the http requests become POSTs of the payload
+            options += "-payload-size {} ".format(self.payload_size)
+        return options
+
+    def generate_fortio_cmd(self, index=0):
         fortio_cmd = (
             "fortio load -uniform -nocatchup -c {conn} -qps {qps} -t {duration}s -a -r {r} "
-            "-httpbufferkb=128 -labels {labels} -access-log-file {access_log_file} {url}").format(
-            conn=self.conn,
-            qps=self.qps,
+            "{options}-labels {labels} -access-log-file {access_log_file} {url}").format(
+            conn=client_share(self.conn, index, self.clients),
+            qps=self.client_qps(index),
             duration=self.duration,
             r=self.r,
-            labels=self.labels,
-            access_log_file="/var/lib/access-logs/access-log-file_" + self.extra_labels + ".json",
+            options=self.load_options(),
+            labels=self.labels + self.client_labels(index),
+            access_log_file=self.access_log_file(index),
             url=self.url)
         return fortio_cmd
 
     def run(self):
         print('-------------- Running test --------------')
-        p = multiprocessing.Process(target=kubectl_exec,
-                                    args=[self.client.name, self.generate_fortio_cmd()])
-        p.start()
-        processes.append(p)
+        access_log_file = self.access_log_file()
+        offset = remote_file_size(self.client.name, access_log_file)
+        # the clients are started together at the same time
+        start_at = time.time() + CLIENT_START_DELAY if self.clients > 1 else 0
+
+        samplers = []
+        if self.sampler is not None:
+            duration = self.duration + (CLIENT_START_DELAY if start_at else 0) + cgroupsampler.SAMPLER_SLACK
+            samplers = cgroupsampler.new_samplers(self.pods, prom.select_targets(self.sampler["resource_usage_targets"]),
+                                                  self.sampler["interval"], duration, APPLICATION_NAMESPACE)
+            for sampler in samplers:
+                sampler.start()
+        clients = []
+        for index, client in enumerate(self.client_pods):
+            p = multiprocessing.Process(target=start_client,
+                                        args=[client.name, self.generate_fortio_cmd(index), start_at])
+            p.start()
+            processes.append(p)
+            clients.append((client.name, p))
+        launched = max(time.time(), start_at)
+
+        live = None
+        if self.monitor is not None:
+            # the first client is followed, an abort stops all of them
+            live = run_monitor.Monitor(self.client.name, access_log_file, offset, self.client_qps(),
+                                       abort_pods=[c.name for c in self.client_pods], **self.monitor)
+            live.start()
 
         if self.perf_targets != "":
+            # profile only the window the resource usage and latency are measured in
+            fortio_start = wait_for_fortio_start(self.client.name, access_log_file, offset)
+            if fortio_start is None:
+                print("Fortio start not seen in {}, profiling relative to the launch time".format(access_log_file))
+                fortio_start = launched
+            perf_start = fortio_start + METRICS_START_SKIP_DURATION
+            perf_duration = self.duration - METRICS_START_SKIP_DURATION - METRICS_END_SKIP_DURATION
+            print("Fortio started at {:.3f}, {:.3f}s after launch, profiling {}s from {:.3f}".format(
+                fortio_start, fortio_start - launched, perf_duration, perf_start))
+
             perf_target_list = self.perf_targets.split(",")
 
             for perf_target in perf_target_list:
                 perf_target_elements = perf_target.split("_")
                 perf_label = self.labels + "_f_" + str(self.frequency) + "_t_" + perf_target
+                if self.profile_mode != "on-cpu":
+                    perf_label += "_m_" + self.profile_mode
                 
                 if perf_target_elements[0] == "http-server":
                     p = multiprocessing.Process(target=run_perf,
-                                                args=[self.http_server.name, perf_label, self.duration, self.frequency, APPLICATION_NAMESPACE, perf_target_elements[1], self.results_dir])
+                                                args=[self.http_server.name, perf_label, perf_duration, self.frequency, APPLICATION_NAMESPACE, perf_target_elements[1], self.results_dir, perf_start, fortio_start, self.profile_mode])
                     p.start()
                     processes.append(p)
                 elif perf_target_elements[0] == "demo-service":
                     p = multiprocessing.Process(target=run_perf,
-                                                args=[self.demo_service.name, perf_label, self.duration, self.frequency, APPLICATION_NAMESPACE, perf_target_elements[1], self.results_dir])
+                                                args=[self.demo_service.name, perf_label, perf_duration, self.frequency, APPLICATION_NAMESPACE, perf_target_elements[1], self.results_dir, perf_start, fortio_start, self.profile_mode])
                     p.start()
                     processes.append(p)
                 else:
+                    pod = self.pods.pod_by_name(perf_target_elements[0], KUBE_SYSTEM_NAMESPACE, node=self.http_server.node)
                     p = multiprocessing.Process(target=run_perf,
-                                                args=[perf_target_elements[0], perf_label, self.duration, self.frequency, KUBE_SYSTEM_NAMESPACE, perf_target_elements[1], self.results_dir])
+                                                args=[pod.name, perf_label, perf_duration, self.frequency, KUBE_SYSTEM_NAMESPACE, perf_target_elements[1], self.results_dir, perf_start, fortio_start, self.profile_mode])
                     p.start()
                     processes.append(p)
 
         for process in processes:
             process.join()
+        del processes[:]
+        self.failed = [name for name, p in clients if p.exitcode != 0]
+        if self.failed:
+            print("Load generator failed on " + ", ".join(self.failed))
+
+        if live is not None:
+            live.stop()
+            self.aborted = live.aborted
+
+        if samplers:
+            samples = collections.OrderedDict()
+            for sampler in samplers:
+                # an aborted run ends before the samplers
+                samples.update(sampler.collect(timeout=None if self.aborted is None else 0))
+            cgroupsampler.save_samples(self.sampler["output_dir"], self.run_id, self.sampler["interval"], samples)
 
 LOCAL_FLAMEDIR = os.path.dirname(os.path.abspath(__file__))
 PERF_PROXY_FILE = "/get_proxy_perf.sh"
 LOCAL_FLAME_PROXY_FILE_PATH = LOCAL_FLAMEDIR + PERF_PROXY_FILE
 
-def run_perf(pod, labels, duration, frequency, namespace, process_name, results_dir):
+def run_perf(pod, labels, duration, frequency, namespace, process_name, results_dir, start=0, fortio_start=0, mode="on-cpu"):
     exitcode, res = subprocess.getstatusoutput(LOCAL_FLAME_PROXY_FILE_PATH +
-                                               " -p {pod} -n {namespace} -d {duration} -f {frequency} -a {perf_data_filename} -e {process_name} -r {results_dir}".format(
-                                                   pod=pod, namespace=namespace, duration=duration, frequency=frequency, perf_data_filename=labels, process_name=process_name, results_dir=results_dir))
+                                               " -p {pod} -n {namespace} -d {duration} -f {frequency} -a {perf_data_filename} -e {process_name} -r {results_dir} -s {start} -m {mode}".format(
+                                                   pod=pod, namespace=namespace, duration=duration, frequency=frequency, perf_data_filename=labels, process_name=process_name, results_dir=results_dir, start=start, mode=mode))
 
     print("run flame graph status: {}".format(exitcode))
     print("flame graph script output: {}".format(res.strip()))
+    record_perf_timing(os.path.join(results_dir, labels + ".timing.json"), start, duration, fortio_start)
+
+
+# adds the requested window to the start and end times get_perfdata.sh
+# recorded in the pod, the skew is how late perf started
+def record_perf_timing(timing_file, start, duration, fortio_start):
+    if not os.path.exists(timing_file):
+        print("perf timing not found: " + timing_file)
+        return
+    with open(timing_file, "r") as f:
+        timing = json.load(f)
+    timing["fortio_start"] = fortio_start
+    timing["requested_start"] = start
+    timing["requested_duration"] = duration
+    timing["start_skew"] = timing["start"] - start
+    with open(timing_file, "w+") as f:
+        f.write(json.dumps(timing, indent=2))
+    print("perf started {:.3f}s after the requested start, wrote {}".format(timing["start_skew"], timing_file))
+
+
+def remote_file_size(pod, path, namespace=LOADGENERATOR_NAMESPACE):
+    out = getoutput("kubectl --namespace {namespace} exec {pod} -c shell -- sh -c 'stat -c %s {path} 2>/dev/null || echo 0'".format(
+        namespace=namespace, pod=pod, path=path))
+    try:
+        return int(out.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return 0
+
+
+# returns the unix time of the first request Fortio logged after offset, or
+# None if there was none within the timeout
+def wait_for_fortio_start(pod, path, offset, namespace=LOADGENERATOR_NAMESPACE, timeout=FORTIO_START_TIMEOUT):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        out = getoutput("kubectl --namespace {namespace} exec {pod} -c shell -- sh -c 'tail -c +{offset} {path} 2>/dev/null | head -n 1'".format(
+            namespace=namespace, pod=pod, offset=offset + 1, path=path))
+        try:
+            return json.loads(out.strip().splitlines()[-1])["timestamp"] / 10 ** 9
+        except (ValueError, KeyError, IndexError, TypeError):
+            time.sleep(FORTIO_START_POLL_INTERVAL)
+    return None
+
+# parses "100", "100,200,500" or an inclusive range "100:500:100"
+def parse_int_list(value):
+    values = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if ":" in part:
+            bounds = [int(b) for b in part.split(":")]
+            if len(bounds) == 2:
+                bounds.append(1)
+            if len(bounds) != 3 or bounds[2] <= 0:
+                raise argparse.ArgumentTypeError("invalid range " + part)
+            values.extend(range(bounds[0], bounds[1] + 1, bounds[2]))
+        else:
+            values.append(int(part))
+    if not values:
+        raise argparse.ArgumentTypeError("empty list " + value)
+    return values
+
+
+def generate_sweep_points(args):
+    points = []
+    for qps in args.qps:
+        for conn in args.conn:
+            for repetition in range(1, args.repetitions + 1):
+                extra_labels = args.extra_labels
+                if len(args.qps) > 1:
+                    extra_labels += "-qps-" + str(qps)
+                if len(args.conn) > 1:
+                    extra_labels += "-c-" + str(conn)
+                if args.repetitions > 1:
+                    extra_labels += "-" + str(repetition)
+                points.append({"qps": qps, "conn": conn, "repetition": repetition, "extra_labels": extra_labels})
+    return points
+
+
+def read_manifest(manifest):
+    completed = {}
+    if not os.path.exists(manifest):
+        return completed
+    with open(manifest, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # a partially written last line after a crash
+                print("skipping malformed manifest line: " + line)
+                continue
+            # aborted and failed points are run again
+            if entry.get("aborted") or entry.get("failed"):
+                continue
+            completed[entry["extra_labels"]] = entry
+    return completed
+
+
+def append_manifest(manifest, entry):
+    with open(manifest, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def monitor_options(args):
+    if not args.monitor:
+        return None
+    guardrails = run_monitor.GUARDRAILS(args.abort_error_percent, args.abort_min_qps_ratio, args.abort_p99,
+                                        args.abort_on_restart)
+    return {"guardrails": guardrails, "prom_url": args.prom_url, "resource_usage_targets": args.resource_usage_targets,
+            "interval": args.monitor_interval, "window": args.monitor_window}
+
+
+def sampler_options(args):
+    if args.cgroup_interval <= 0:
+        return None
+    return {"interval": args.cgroup_interval, "resource_usage_targets": args.resource_usage_targets,
+            "output_dir": args.json_output_dir}
+
+
+# the load generator is not in the mesh, so with STRICT mTLS in the
+# application namespace the demo-service rejects its plaintext requests
+def check_direct_load(load_mode, namespace=APPLICATION_NAMESPACE):
+    if load_mode == "http":
+        return
+    out = getoutput("kubectl --namespace {} get peerauthentications -o json".format(namespace))
+    try:
+        items = json.loads(out)["items"]
+    except (ValueError, KeyError):
+        # no Istio in the cluster
+        return
+    names = [item["metadata"]["name"] for item in items]
+    strict = [item["metadata"]["name"] for item in items
+              if not item["spec"].get("selector") and item["spec"].get("mtls", {}).get("mode") == "STRICT"]
+    if strict and DIRECT_LOAD_PEER_AUTHENTICATION not in names:
+        raise Exception("the {} load mode can not reach the demo-service with the STRICT mTLS of {}, "
+                        "apply setups/<setup>/direct-load-mtls.yaml for these runs".format(load_mode, ", ".join(strict)))
+
 
 def run_perf_test(args):
     min_duration = METRICS_START_SKIP_DURATION + METRICS_END_SKIP_DURATION
 
-    fortio = Fortio(
-        conn=args.conn,
-        qps=args.qps,
-        duration=args.duration,
-        frequency=args.frequency,
-        perf_targets=args.perf_targets,
-        extra_labels=args.extra_labels,
-        results_dir=args.results_dir,
-        url=args.url)
-
-    if fortio.duration <= min_duration:
+    if args.duration <= min_duration:
         print("Duration must be greater than {min_duration}".format(
             min_duration=min_duration))
         exit(1)
 
-    fortio.run()
+    check_direct_load(args.load_mode)
+
+    # fortio.py reads the samples from its json output directory, which is not
+    # the results directory the Fortio results are first copied to
+    if args.cgroup_interval > 0 and not args.json_output_dir:
+        raise Exception("--cgroup_interval requires --json_output_dir, the json output directory of fortio.py "
+                        "the cgroup samples are read from")
+
+    if args.search:
+        return search_max_throughput(args)
+
+    points = generate_sweep_points(args)
+    manifest = args.manifest
+    if manifest == "" and len(points) > 1:
+        manifest = os.path.join(args.results_dir, "sweep-manifest_" + args.extra_labels + ".jsonl")
+
+    completed = {}
+    if manifest != "":
+        completed = read_manifest(manifest)
+        print("Sweep of {} points, {} already completed according to {}".format(
+            len(points), len([p for p in points if p["extra_labels"] in completed]), manifest))
+
+    first = True
+    for point in points:
+        if point["extra_labels"] in completed:
+            print("Skipping completed point " + point["extra_labels"])
+            continue
+
+        if not first and args.cooldown > 0:
+            print("Cooling down for {}s".format(args.cooldown))
+            time.sleep(args.cooldown)
+        if not first:
+            inventory.INVENTORY.refresh_if_restarted()
+        first = False
+
+        fortio = Fortio(
+            conn=point["conn"],
+            qps=point["qps"],
+            duration=args.duration,
+            frequency=args.frequency,
+            perf_targets=args.perf_targets,
+            profile_mode=args.profile_mode,
+            extra_labels=point["extra_labels"],
+            results_dir=args.results_dir,
+            url=args.url,
+            monitor=monitor_options(args),
+            clients=args.clients,
+            sampler=sampler_options(args),
+            load_mode=args.load_mode,
+            grpc_streams=args.grpc_streams,
+            payload_size=args.payload_size)
+
+        start = time.time()
+        fortio.run()
+
+        if manifest != "":
+            entry = dict(point)
+            entry.update({"labels": fortio.labels, "run_id": fortio.run_id, "start": start, "end": time.time()})
+            if fortio.aborted:
+                entry["aborted"] = fortio.aborted
+            if fortio.failed:
+                entry["failed"] = fortio.failed
+            append_manifest(manifest, entry)
+
+def load_run_result(json_output_dir, run_id):
+    fortio_results.sync_results(json_output_dir)
+    fortio_results.merge_client_results(json_output_dir)
+    for filename in sorted(os.listdir(json_output_dir)):
+        if fortio_results.is_fortio_result(filename) and fortio_results.run_id_of_result(filename) == run_id:
+            with open(os.path.join(json_output_dir, filename), "r") as f:
+                return json.load(f, strict=False)
+    raise Exception("result of run {} not found in {}".format(run_id, json_output_dir))
+
+
+# returns the step of a search with the checks of a run: the achieved rate
+# is within the tolerance of the requested one, the errors are below the
+# threshold and the p99 latency meets the slo
+def evaluate_step(data, qps, args):
+    gd = fortio_results.convert_data(data)
+    actual = float(data["ActualQPS"])
+    step = {
+        "qps": qps,
+        "labels": gd["Labels"],
+        "ActualQPS": actual,
+        "errorPercent": gd.get("errorPercent", 0),
+        "p99": gd.get("p99", -1),
+        "qps_ok": actual >= qps * (1 - args.qps_tolerance),
+        "errors_ok": gd.get("errorPercent", 0) <= args.max_error_percent,
+        "slo_ok": args.p99_slo <= 0 or gd.get("p99", 0) <= args.p99_slo,
+    }
+    step["ok"] = step["qps_ok"] and step["errors_ok"] and step["slo_ok"]
+    return step
+
+
+def write_search_steps(steps, csv_output):
+    keys = ["qps", "ActualQPS", "errorPercent", "p99", "qps_ok", "errors_ok", "slo_ok", "ok", "labels"]
+    with open(csv_output, "w+") as out:
+        out.write(",".join(keys) + "\n")
+        for step in steps:
+            out.write(",".join(str(step[k]) for k in keys) + "\n")
+
+
+# ramps the qps up by the search factor until a run fails the checks and then
+# bisects between the last passing and the first failing qps. The knee is
+# the highest qps that passed.
+def search_max_throughput(args):
+    json_output_dir = args.json_output_dir or args.results_dir
+    conn = args.conn[0]
+    steps = []
+
+    def run_step(qps):
+        if steps and args.cooldown > 0:
+            print("Cooling down for {}s".format(args.cooldown))
+            time.sleep(args.cooldown)
+        if steps:
+            inventory.INVENTORY.refresh_if_restarted()
+        fortio = Fortio(
+            conn=conn,
+            qps=qps,
+            duration=args.duration,
+            frequency=args.frequency,
+            perf_targets="",
+            extra_labels=args.extra_labels + "-search-qps-" + str(qps),
+            results_dir=args.results_dir,
+            url=args.url,
+            monitor=monitor_options(args),
+            clients=args.clients,
+            sampler=sampler_options(args),
+            load_mode=args.load_mode,
+            grpc_streams=args.grpc_streams,
+            payload_size=args.payload_size)
+        fortio.run()
+        step = evaluate_step(load_run_result(json_output_dir, fortio.run_id), qps, args)
+        if fortio.aborted or fortio.failed:
+            # the partial result of an aborted run does not pass
+            step["ok"] = False
+        steps.append(step)
+        print("Search step qps={qps} ActualQPS={ActualQPS:.1f} errorPercent={errorPercent:.3f} p99={p99} ok={ok}".format(**step))
+        write_search_steps(steps, os.path.join(args.results_dir, "search_" + args.extra_labels + ".csv"))
+        return step["ok"]
+
+    low = 0
+    high = None
+    qps = args.qps[0]
+    while high is None:
+        if run_step(qps):
+            low = qps
+            if qps >= args.search_max_qps:
+                break
+            qps = min(int(qps * args.search_factor) or qps + 1, args.search_max_qps)
+        else:
+            high = qps
+
+    while high is not None and high - low > max(1, int(low * args.search_precision)):
+        qps = (low + high) // 2
+        if run_step(qps):
+            low = qps
+        else:
+            high = qps
+
+    if low == 0:
+        print("No qps passed the checks, lowest failing qps {}".format(high))
+    else:
+        print("Knee at {} qps with {} connections{}".format(
+            low, conn, "" if high is not None else ", the search maximum"))
+    print("Wrote search steps to " + os.path.join(args.results_dir, "search_" + args.extra_labels + ".csv"))
+    return 0
+
 
 def get_parser():
     parser = argparse.ArgumentParser("Run performance test")
     parser.add_argument(
         "--conn",
-        help="number of connections",
-        type=int,
+        help="number of connections, comma separated list or start:stop[:step] range",
+        type=parse_int_list,
         required=True)
     parser.add_argument(
         "--qps",
-        help="qps, comma separated list",
-        type=int,
+        help="qps, comma separated list or start:stop[:step] range",
+        type=parse_int_list,
         required=True)
     parser.add_argument(
         "--duration",
@@ -210,6 +640,13 @@ def get_parser():
         "--perf_targets",
         help="perf targets",
         default="")
+    parser.add_argument(
+        "--profile_mode",
+        help="on-cpu: sampled CPU flame graph, off-cpu: flame graph of the time the threads are off the CPU, "
+             "wakeup: flame graph of the wakers of the threads, runqlat: run queue latency histogram. "
+             "The modes other than on-cpu also write the run queue latency histogram of each perf target",
+        choices=["on-cpu", "off-cpu", "wakeup", "runqlat"],
+        default="on-cpu")
     parser.add_argument(
         "--extra_labels",
         help="extra labels",
@@ -220,8 +657,136 @@ def get_parser():
         required=True)
     parser.add_argument(
         "--url",
-        help="url that Fortio will connect to",
-        required=True)
+        help="url that Fortio will connect to, required in the http load mode. Defaults to the demo-service in the "
+             "grpc and tcp load modes",
+        default="")
+    parser.add_argument(
+        "--load_mode",
+        help="http: HTTP requests through the ingress to the http-server and the demo-service, "
+             "grpc: unary gRPC pings of the demo-service, tcp: TCP echo of the demo-service",
+        choices=sorted(LOAD_MODE_URLS),
+        default="http")
+    parser.add_argument(
+        "--grpc_streams",
+        help="number of concurrent gRPC streams, each making one ping at a time, on each connection in the grpc "
+             "load mode",
+        type=int,
+        default=1)
+    parser.add_argument(
+        "--payload_size",
+        help="bytes of payload sent and echoed back with each request, "
+             "the http requests become POSTs. 0 uses the default of Fortio",
+        type=int,
+        default=0)
+    parser.add_argument(
+        "--clients",
+        help="number of load generator pods the qps and connections are split over, "
+             "their results are merged by fortio.py",
+        type=int,
+        default=1)
+    parser.add_argument(
+        "--repetitions",
+        help="number of repetitions of each qps and connection point",
+        type=int,
+        default=1)
+    parser.add_argument(
+        "--cooldown",
+        help="seconds to wait between sweep points",
+        type=int,
+        default=30)
+    parser.add_argument(
+        "--manifest",
+        help="manifest of completed sweep points used to resume a sweep, "
+             "defaults to a file in the results directory when sweeping",
+        default="")
+    parser.add_argument(
+        "--search",
+        help="search the highest qps that passes the checks, starting from the first --qps value "
+             "with the first --conn value",
+        action="store_true")
+    parser.add_argument(
+        "--search_max_qps",
+        help="highest qps the search tries",
+        type=int,
+        default=20000)
+    parser.add_argument(
+        "--search_factor",
+        help="factor the qps is multiplied by while ramping up",
+        type=float,
+        default=2.0)
+    parser.add_argument(
+        "--search_precision",
+        help="the bisection stops when the failing and passing qps are this fraction apart",
+        type=float,
+        default=0.05)
+    parser.add_argument(
+        "--qps_tolerance",
+        help="fraction the ActualQPS may be below the requested qps",
+        type=float,
+        default=0.02)
+    parser.add_argument(
+        "--max_error_percent",
+        help="highest errorPercent of a passing run",
+        type=float,
+        default=0.1)
+    parser.add_argument(
+        "--p99_slo",
+        help="highest p99 latency in seconds of a passing run, 0 disables the check",
+        type=float,
+        default=0)
+    parser.add_argument(
+        "--json_output_dir",
+        help="json output directory of fortio.py the Fortio results are synced to during a search, defaults to the "
+             "results directory. The cgroup samples are saved to it, so it is required with --cgroup_interval",
+        default="")
+    parser.add_argument(
+        "--monitor",
+        help="print live qps, latency, errors and CPU usage during each run and abort runs that breach the guardrails",
+        action="store_true")
+    parser.add_argument(
+        "--prom_url",
+        help="prometheus url of the live CPU usage, e.g. http://localhost:9090, CPU usage is not shown if empty",
+        default="")
+    parser.add_argument(
+        "--resource_usage_targets",
+        help="setup whose containers the live CPU usage is shown and sampled of: sidecar-istio, proxyless-istio, "
+             "cilium or baseline",
+        default="sidecar-istio")
+    parser.add_argument(
+        "--monitor_interval",
+        help="seconds between live updates",
+        type=int,
+        default=5)
+    parser.add_argument(
+        "--monitor_window",
+        help="seconds of requests the live statistics are computed over",
+        type=int,
+        default=10)
+    parser.add_argument(
+        "--abort_error_percent",
+        help="abort a run if the live error rate is above this percentage, 0 disables the guardrail",
+        type=float,
+        default=0)
+    parser.add_argument(
+        "--abort_min_qps_ratio",
+        help="abort a run if the live qps is below this fraction of the requested qps, 0 disables the guardrail",
+        type=float,
+        default=0)
+    parser.add_argument(
+        "--abort_p99",
+        help="abort a run if the live p99 latency in seconds is above this, 0 disables the guardrail",
+        type=float,
+        default=0)
+    parser.add_argument(
+        "--abort_on_restart",
+        help="abort a run if a pod is replaced or restarted during it",
+        action="store_true")
+    parser.add_argument(
+        "--cgroup_interval",
+        help="seconds between samples of the cgroup CPU and memory counters of the containers next to an ubuntu "
+             "container, e.g. 1 or 0.2. 0 disables the sampling",
+        type=float,
+        default=0)
 
     return parser
 
@@ -0,0 +1,415 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Local stand-ins of the cluster for running fortio.py and prom.py without
+# one. A stand-in root directory holds the /var/lib of the load generator
+# pod, either copied from a json output directory of earlier runs or
+# generated with any number of requests, and a kubectl script in <root>/bin
+# that lists made up pods and runs the exec commands of fortio.py and
+# runner.py locally on that directory. The prometheus stand-in answers
+# query_range and instant queries from the cpu-usage_ and mem-usage_ files of
+# the replayed runs or with generated series.
+
+from __future__ import print_function
+import argparse
+import collections
+import datetime
+import json
+import os
+import re
+import shutil
+import stat
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import fortio
+import histogram
+import inventory
+import prom
+
+REMOTE_ROOT = "var/lib"
+
+KUBECTL = r"""#!/bin/bash
+# kubectl stand-in written by standin.py: lists the pods of pods.json and runs
+# exec commands locally with /var/lib of the pod under the stand-in root
+ROOT="$(cd "$(dirname "$0")/.." && pwd)"
+ARGS=("$@")
+CMD=()
+for i in "${!ARGS[@]}"; do
+  if [ "${ARGS[$i]}" = "--" ]; then
+    CMD=("${ARGS[@]:$((i + 1))}")
+    break
+  fi
+done
+case " $* " in
+  *" get pods "*)
+    cat "${ROOT}/pods.json";;
+  *" exec "*)
+    for i in "${!CMD[@]}"; do
+      CMD[$i]="${CMD[$i]//\/var\/lib/${ROOT}/var/lib}"
+    done
+    case "${CMD[0]}" in
+      find) "${CMD[@]}" | sed "s#^${ROOT}##";;
+      tar|stat|tail|head|cat|sh) "${CMD[@]}";;
+      *) echo "kubectl stand-in does not run ${CMD[0]}" >&2; exit 1;;
+    esac;;
+  *)
+    echo "kubectl stand-in does not support: $*" >&2
+    exit 1;;
+esac
+"""
+
+# pods of the stand-in: name, namespace, app label, k8s-app label
+PODS = [
+    ("fortioclient-7d9c5b6f4-standin", "fortio", "loadgenerator", None),
+    ("http-server-5f6d8c7b9-standin", "default", "http-server", None),
+    ("demo-service-6b7c9d8f5-standin", "default", "demo-service", None),
+    ("cilium-standin", "kube-system", None, "cilium"),
+]
+
+# per target: cpu cores and memory MiB of the generated series
+SYNTHETIC_USAGE = {
+    "main_fortioclient": (0.2, 40),
+    "istio-proxy_istio-ingressgateway": (0.3, 60),
+    "http-server_http-server": (0.05, 10),
+    "demo-service_demo-service": (0.05, 10),
+    "istio-proxy_http-server": (0.15, 50),
+    "istio-proxy_demo-service": (0.15, 50),
+    "cilium_cilium-agent": (0.1, 180),
+}
+
+# rates of the other metrics of every target, pod or the cluster in prometheus
+# units, e.g. bytes per second
+SYNTHETIC_RATES = {
+    "throttled": 0.5,
+    "net-rx-bytes": 200 * 1024,
+    "net-tx-bytes": 200 * 1024,
+    "net-rx-packets": 300,
+    "net-tx-packets": 300,
+    "cluster-cpu": 1.2,
+    "cluster-context-switches": 20000,
+}
+
+# {namespace="default",pod=~"http-server.*",container="istio-proxy"} or
+# {namespace="default",pod=~"http-server.*"} of the pod metrics
+SELECTOR = re.compile(r'namespace="([^"]*)",pod=~"([^"]*)"(?:,container="([^"]*)")?}')
+
+# access log lines are generated and written in chunks of this many requests
+WRITE_CHUNK = 1 << 20
+
+
+def pods_json():
+    items = []
+    for name, namespace, app, k8s_app in PODS:
+        labels = {}
+        if app is not None:
+            labels[inventory.APP_LABEL] = app
+        if k8s_app is not None:
+            labels["k8s-app"] = k8s_app
+        items.append({
+            "metadata": {"name": name, "namespace": namespace, "labels": labels, "uid": str(uuid.uuid5(uuid.NAMESPACE_DNS, name))},
+            "spec": {"nodeName": "standin-node"},
+            "status": {"phase": "Running", "podIP": "10.0.0.{}".format(len(items) + 10),
+                       "containerStatuses": [{"restartCount": 0}]},
+        })
+    return {"items": items}
+
+
+# creates the stand-in root with the kubectl script and the pod list, and
+# returns the directory to prepend to PATH
+def init_root(root):
+    for d in fortio.REMOTE_RESULTS_DIRS:
+        os.makedirs(os.path.join(root, REMOTE_ROOT, d), exist_ok=True)
+    bin_dir = os.path.join(root, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    kubectl = os.path.join(bin_dir, "kubectl")
+    with open(kubectl, "w+") as f:
+        f.write(KUBECTL)
+    os.chmod(kubectl, os.stat(kubectl).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    with open(os.path.join(root, "pods.json"), "w+") as f:
+        f.write(json.dumps(pods_json(), indent=2))
+    return bin_dir
+
+
+# copies the Fortio results and access logs of a json output directory into
+# the pod of the stand-in
+def replay_results(json_output_dir, root):
+    copied = 0
+    for filename in sorted(os.listdir(json_output_dir)):
+        if fortio.is_fortio_result(filename):
+            remote_dir = "fortio"
+        elif filename.startswith("access-log-file_"):
+            remote_dir = "access-logs"
+        else:
+            continue
+        shutil.copyfile(os.path.join(json_output_dir, filename), os.path.join(root, REMOTE_ROOT, remote_dir, filename))
+        copied += 1
+    print("Copied {} result files of {} to {}".format(copied, json_output_dir, root))
+    return copied
+
+
+def write_access_log(path, timestamps, latencies, threads, ok):
+    with open(path, "w+") as out:
+        for i in range(0, len(timestamps), WRITE_CHUNK):
+            end = i + WRITE_CHUNK
+            out.write("".join(
+                '{{"latency":{:.9f},"timestamp":{},"thread":{},"ok":{},"details":"{}"}}\n'.format(
+                    lat, ts, th, "true" if o else "false", "200" if o else "503")
+                for lat, ts, th, o in zip(latencies[i:end].tolist(), timestamps[i:end].tolist(),
+                                          threads[i:end].tolist(), ok[i:end].tolist())))
+
+
+# writes a Fortio result and its access log of a generated run with the
+# given number of requests spread evenly over the duration
+def generate_run(root, index, requests, duration, conn, label, start, rng, error_rate=0.0001):
+    run_id = "{:08x}".format(int(rng.integers(0, 1 << 32)))
+    qps = requests / float(duration)
+    extra_labels = "{}-{}".format(label, index)
+    access_log = "access-log-file_" + extra_labels + ".json"
+    timestamps = (start * 10 ** 9 + np.arange(requests, dtype=np.int64) * int(10 ** 9 / qps)).astype(np.int64)
+    latencies = rng.lognormal(np.log(0.0045), 0.15, requests)
+    threads = np.arange(requests) % conn
+    ok = rng.random(requests) >= error_rate
+    write_access_log(os.path.join(root, REMOTE_ROOT, "access-logs", access_log), timestamps, latencies, threads, ok)
+
+    started = datetime.datetime.utcfromtimestamp(start)
+    errors = int((~ok).sum())
+    data = {
+        "RunType": "HTTP",
+        "Labels": "{}_qps_{}_c_{}_d_{}_{}".format(run_id, int(round(qps)), conn, duration, extra_labels),
+        "StartTime": started.strftime("%Y-%m-%dT%H:%M:%S.000000000Z"),
+        "RequestedQPS": str(int(round(qps))),
+        "RequestedDuration": "{}s".format(duration),
+        "ActualQPS": qps,
+        "ActualDuration": duration * 10 ** 9,
+        "NumThreads": conn,
+        "DurationHistogram": histogram.Histogram.from_values(latencies).to_fortio(),
+        "RetCodes": dict([("200", requests - errors)] + ([("503", errors)] if errors else [])),
+        "Sizes": {"Count": requests, "Min": 223, "Max": 223, "Sum": 223 * requests, "Avg": 223.0},
+        "AccessLoggerInfo": "mode json to /var/lib/access-logs/" + access_log,
+    }
+    data["ID"] = "{}_{}_qps_{}_c_{}_d_{}_{}".format(
+        started.strftime("%Y-%m-%d-%H%M%S"), run_id, int(round(qps)), conn, duration, extra_labels.replace("-", "_"))
+    with open(os.path.join(root, REMOTE_ROOT, "fortio", data["ID"] + ".json"), "w+") as out:
+        out.write(json.dumps(data, indent=2))
+    return data["ID"]
+
+
+def generate_results(root, runs, requests, duration=300, conn=10, label="standin", seed=0, start=1682362094):
+    rng = np.random.default_rng(seed)
+    for i in range(runs):
+        # the runs follow each other with a pause like in a sweep
+        generate_run(root, i + 1, requests, duration, conn, label, start + i * (duration + 30), rng)
+    print("Generated {} runs of {} requests in {}".format(runs, requests, root))
+
+
+# answers prometheus queries from the datasets of replayed runs and with
+# generated series for the targets and times no run covers
+class PrometheusStandIn:
+    def __init__(self, replay_dir=""):
+        # resource type: [(first timestamp, last timestamp, datasets)]
+        self.replay = collections.defaultdict(list)
+        if replay_dir:
+            for filename in sorted(os.listdir(replay_dir)):
+                for resource_type in prom.METRICS:
+                    if filename.startswith(resource_type + "-usage_"):
+                        with open(os.path.join(replay_dir, filename), "r") as f:
+                            datasets = json.load(f)
+                        timestamps = [p["timestamp"] for k in prom.metric_keys(resource_type)
+                                      for p in datasets.get(k) or []]
+                        if timestamps:
+                            self.replay[resource_type].append((min(timestamps), max(timestamps), datasets))
+
+    def replayed(self, resource_type, key, start, end):
+        values = []
+        for first, last, datasets in self.replay[resource_type]:
+            if last < start or first > end:
+                continue
+            for point in datasets.get(key) or []:
+                if start <= point["timestamp"] <= end:
+                    values.append([point["timestamp"], repr(prom.METRICS[resource_type].unconvert(point["value"]))])
+        return values
+
+    @staticmethod
+    def generated(resource_type, key, timestamps):
+        cores, mebibytes = SYNTHETIC_USAGE.get(key, (0.1, 50))
+        # deterministic noise of every target and timestamp
+        noise = [(zlib.crc32("{}{}{}".format(resource_type, key, t).encode()) & 0xffff) / 65535.0 - 0.5
+                 for t in timestamps]
+        if resource_type == "cpu":
+            return [[t, repr(cores * (1 + 0.2 * n))] for t, n in zip(timestamps, noise)]
+        if resource_type == "mem":
+            return [[t, repr(prom.from_mebibytes(mebibytes * (1 + 0.02 * n)))] for t, n in zip(timestamps, noise)]
+        rate = SYNTHETIC_RATES.get(resource_type, 1.0)
+        return [[t, repr(rate * (1 + 0.2 * n))] for t, n in zip(timestamps, noise)]
+
+    @staticmethod
+    def resource_type_of(query):
+        for resource_type, metric in prom.METRICS.items():
+            if metric.template.split("{")[0].replace("rate(", "") in query:
+                return resource_type
+        raise Exception("unknown metric of query " + query)
+
+    # the keys and series labels of the targets, pods or cluster of a query
+    @staticmethod
+    def selected(resource_type, query):
+        if prom.METRICS[resource_type].scope == "cluster":
+            return [(prom.CLUSTER_KEY, {})]
+        selected = []
+        for namespace, pod_regex, container in SELECTOR.findall(query):
+            for key, target in prom.TARGETS.items():
+                if target.namespace != namespace or target.pod_regex != pod_regex:
+                    continue
+                if container and target.container == container:
+                    selected.append((key, {"namespace": namespace, "pod": target.pod + "-standin",
+                                           "container": container}))
+                    break
+                if not container:
+                    selected.append((target.pod, {"namespace": namespace, "pod": target.pod + "-standin"}))
+                    break
+        return selected
+
+    def series(self, query, timestamps):
+        resource_type = self.resource_type_of(query)
+        result = []
+        for key, labels in self.selected(resource_type, query):
+            values = self.replayed(resource_type, key, timestamps[0], timestamps[-1])
+            if not values:
+                values = self.generated(resource_type, key, timestamps)
+            result.append({"metric": labels, "values": values})
+        return result
+
+    def query_range(self, query, start, end, step):
+        timestamps = list(range(int(float(start)), int(float(end)) + 1, max(int(float(step)), 1)))
+        return {"status": "success", "data": {"resultType": "matrix", "result": self.series(query, timestamps)}}
+
+    def query(self, query, time):
+        result = self.series(query, [int(float(time))])
+        for item in result:
+            item["value"] = item.pop("values")[-1]
+        return {"status": "success", "data": {"resultType": "vector", "result": result}}
+
+
+def handler_for(standin):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            try:
+                if url.path == "/api/v1/query_range":
+                    body = standin.query_range(params["query"], params["start"], params["end"], params.get("step", 15))
+                elif url.path == "/api/v1/query":
+                    body = standin.query(params["query"], params.get("time", time.time()))
+                else:
+                    self.send_error(404)
+                    return
+            except KeyError as e:
+                self.send_error(400, "missing parameter {}".format(e))
+                return
+            out = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+
+# serves the prometheus stand-in in a background thread and returns the
+# server and its url, port 0 picks a free port
+def start_prometheus(replay_dir="", port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler_for(PrometheusStandIn(replay_dir)))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+# prepares the stand-in root from a replayed or generated set of runs
+def prepare(root, replay_dir="", runs=3, requests=30000, duration=300, conn=10, seed=0):
+    bin_dir = init_root(root)
+    if replay_dir:
+        replay_results(replay_dir, root)
+    else:
+        generate_results(root, runs, requests, duration, conn, seed=seed)
+    return bin_dir
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    bin_dir = prepare(args.root, args.replay, args.runs, args.requests, args.duration, args.conn, args.seed)
+    server, url = start_prometheus(args.replay, args.port)
+    print("Prometheus stand-in at {}, use the kubectl stand-in with:".format(url))
+    print("  export PATH={}:$PATH".format(bin_dir))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Serve kubectl and prometheus stand-ins for running fortio.py without a cluster")
+    parser.add_argument(
+        "--root",
+        help="stand-in root directory with the files of the load generator pod and the kubectl script",
+        required=True)
+    parser.add_argument(
+        "--replay",
+        help="json output directory of earlier runs to replay, e.g. ../data/sidecar-istio/json. "
+             "If blank, runs are generated",
+        default="")
+    parser.add_argument(
+        "--runs",
+        help="number of generated runs",
+        type=int,
+        default=3)
+    parser.add_argument(
+        "--requests",
+        help="number of requests of each generated run",
+        type=int,
+        default=30000)
+    parser.add_argument(
+        "--duration",
+        help="duration in seconds of each generated run",
+        type=int,
+        default=300)
+    parser.add_argument(
+        "--conn",
+        help="number of connections of each generated run",
+        type=int,
+        default=10)
+    parser.add_argument(
+        "--seed",
+        help="seed of the generated runs",
+        type=int,
+        default=0)
+    parser.add_argument(
+        "--port",
+        help="port of the prometheus stand-in",
+        type=int,
+        default=9090)
+    return parser
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
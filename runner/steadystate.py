@@ -0,0 +1,283 @@
+# Copyright (C) 2023 Ville Pihlava
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Steady state detection of a run in place of the fixed skip of the first and
+# last 15 seconds. The warm-up is cut with MSER-5 (the marginal standard error
+# rule on means of 5 second batches) of the per second throughput and p50
+# latency of the access log and the CPU usage of the targets, the cool-down
+# likewise from the end of the run. The longest cut of the series is used.
+# The cuts of a run are saved in steady-state_<result file> and applied by
+# fortio.metrics_window to the prometheus window and the access log.
+
+from __future__ import print_function
+import argparse
+import json
+import math
+import os
+import numpy as np
+import accesslog
+import cgroupsampler
+import efficiency
+import fortio
+import histogram
+import latencystore
+import prom
+
+STEADY_STATE_PREFIX = "steady-state_"
+
+# seconds of a batch of MSER-5
+MSER_BATCH = 5
+
+# at most this fraction of a series is cut from either end
+MAX_CUT_FRACTION = 0.5
+
+# seconds of steady state a run has to keep, otherwise the fixed skips are used
+MIN_STEADY_SECONDS = 30
+
+# the latency statistics of the csv that are computed again within the cuts
+LATENCY_KEYS = ["min", "max", "avg", "p50", "p75", "p90", "p99", "p99.9"]
+
+
+# the number of values to cut from the start of a series. Of every
+# truncation of up to max_fraction of the batches the one with the smallest
+# marginal standard error of the remaining batch means is chosen
+def mser_cut(values, batch=MSER_BATCH, max_fraction=MAX_CUT_FRACTION):
+    n = len(values) // batch
+    if n < 4:
+        return 0
+    means = np.asarray(values[:n * batch], dtype=np.float64).reshape(n, batch).mean(axis=1)
+    # sums of the batch means from every truncation point to the end
+    s1 = np.cumsum(means[::-1])[::-1]
+    s2 = np.cumsum((means ** 2)[::-1])[::-1]
+    d = np.arange(int(n * max_fraction) + 1)
+    k = n - d
+    stat = (s2[d] - s1[d] ** 2 / k) / k ** 2
+    return int(np.argmin(stat)) * batch
+
+
+# fills the seconds without a value with the previous value, or the next
+# value at the start of the series
+def fill_gaps(values):
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return None
+    index = np.where(valid, np.arange(len(values)), 0)
+    np.maximum.accumulate(index, out=index)
+    filled = values[index]
+    filled[:np.argmax(valid)] = values[np.argmax(valid)]
+    return filled
+
+
+# {name: values of every second of the run} of the access log
+def access_log_series(log, run_start, seconds):
+    out = {}
+    if len(log.timestamp) == 0:
+        return out
+    second = log.timestamp // 10 ** 9 - run_start
+    inside = (second >= 0) & (second < seconds)
+    out["rps"] = np.bincount(second[inside], minlength=seconds).astype(np.float64)
+    keys, _, values = accesslog.grouped_percentiles(second[inside], log.latency[inside].astype(np.float64), [50])
+    p50 = np.full(seconds, np.nan)
+    p50[keys] = values[:, 0]
+    out["p50"] = p50
+    return out
+
+
+# {name: values of every second} of the datasets of a usage file, a rate is
+# moved back by half its window like in efficiency.py
+def usage_series(datasets, run_start, seconds, shift=0):
+    grid = np.arange(run_start, run_start + seconds, dtype=np.float64)
+    out = {}
+    for key in prom.TARGETS:
+        points = datasets.get(key) or []
+        if len(points) < 2:
+            continue
+        timestamps = np.array([p["timestamp"] for p in points], dtype=np.float64) - shift
+        values = np.array([p["value"] for p in points], dtype=np.float64)
+        resampled = np.full(seconds, np.nan)
+        inside = (grid >= timestamps[0]) & (grid <= timestamps[-1])
+        resampled[inside] = np.interp(grid[inside], timestamps, values)
+        out["cpu_" + key] = resampled
+    return out
+
+
+# the CPU usage of the whole run from the cgroup samples of the run, or from
+# prometheus if it has none
+def cpu_series(json_output_dir, filename, run_start, seconds, fetcher=None):
+    path = os.path.join(json_output_dir, cgroupsampler.SAMPLES_PREFIX + fortio.run_id_of_result(filename) + ".json")
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        cpu, _ = cgroupsampler.to_usage(data["samples"], data["interval"], run_start, run_start + seconds)
+        return usage_series(cpu, run_start, seconds, data["interval"] / 2.0)
+    if fetcher is None:
+        return {}
+    datasets = fetcher(run_start, seconds)
+    if datasets is None:
+        return {}
+    return usage_series(datasets, run_start, seconds, datasets["rate_window"] / 2.0)
+
+
+# returns a fetcher of the CPU usage datasets of a whole run from prometheus,
+# the step is raised to stay within a single query
+def prometheus_cpu_fetcher(url, resource_usage_targets, aggregate=True, session=None, cache=None,
+                           step=prom.DEFAULT_STEP, rate_window=prom.DEFAULT_RATE_WINDOW):
+    def fetch(run_start, seconds):
+        run_step = max(step, int(math.ceil(seconds / float(prom.MAX_POINTS_PER_SERIES - 1))))
+        p = prom.Prom(url, seconds, start=run_start, resource_usage_targets=resource_usage_targets,
+                      aggregate=aggregate, session=session, cache=cache, step=run_step, rate_window=rate_window)
+        query = prom.build_metric_query("cpu", prom.select_targets(resource_usage_targets), aggregate, rate_window)
+        data, _ = p.fetch_by_query(query, required=False)
+        if data is None:
+            return None
+        datasets = {}
+        for item in data["data"]["result"]:
+            key = prom.match_target(item["metric"])
+            if key is not None:
+                datasets[key] = prom.convert_data_list(item, "cpu")
+        datasets["rate_window"] = int(rate_window[:-1]) * efficiency.RATE_WINDOW_UNITS[rate_window[-1]]
+        return datasets
+    return fetch
+
+
+def run_log(json_output_dir, filename, data, columnar_output_dir=""):
+    if columnar_output_dir:
+        try:
+            return latencystore.open_run(columnar_output_dir, fortio.run_id_of_result(filename))
+        except Exception:
+            pass
+    access_log = accesslog.access_log_filename(data)
+    if access_log is None or not os.path.exists(os.path.join(json_output_dir, access_log)):
+        return None
+    return accesslog.read_access_log(os.path.join(json_output_dir, access_log))
+
+
+# detects the cuts of a run and saves them, returns None if the run has no
+# access log
+def detect(json_output_dir, filename, data, gd, columnar_output_dir="", fetcher=None):
+    log = run_log(json_output_dir, filename, data, columnar_output_dir)
+    if log is None:
+        return None
+    run_start = int(fortio.run_start(gd))
+    seconds = int(gd["ActualDuration"])
+    series = access_log_series(log, run_start, seconds)
+    series.update(cpu_series(json_output_dir, filename, run_start, seconds, fetcher))
+
+    cuts = {}
+    for name, values in series.items():
+        values = fill_gaps(values)
+        if values is None:
+            continue
+        cuts[name] = [mser_cut(values), mser_cut(values[::-1])]
+    warmup = max([c[0] for c in cuts.values()] or [0])
+    cooldown = max([c[1] for c in cuts.values()] or [0])
+    result = {"method": "mser-5", "warmup": warmup, "cooldown": cooldown, "series": cuts}
+    if seconds - warmup - cooldown < MIN_STEADY_SECONDS:
+        print("... {} steady state of {}s is too short, using the fixed skips".format(
+            gd["Labels"], seconds - warmup - cooldown))
+        result.update(method="fixed", warmup=fortio.METRICS_START_SKIP_DURATION,
+                      cooldown=fortio.METRICS_END_SKIP_DURATION)
+    path = os.path.join(json_output_dir, STEADY_STATE_PREFIX + filename)
+    with open(path, "w+") as f:
+        f.write(json.dumps(result, indent=2))
+    print("... {} warm-up {}s, cool-down {}s ({})".format(gd["Labels"], result["warmup"], result["cooldown"], path))
+    return result
+
+
+def read_cuts(json_output_dir, filename):
+    path = os.path.join(json_output_dir, STEADY_STATE_PREFIX + filename)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+# sets the cuts of a run if it has detected ones, returns True if it has
+def apply_cuts(json_output_dir, filename, gd):
+    cuts = read_cuts(json_output_dir, filename)
+    if cuts is None:
+        return False
+    gd["WarmupCut"] = cuts["warmup"]
+    gd["CooldownCut"] = cuts["cooldown"]
+    return True
+
+
+# the latency statistics of the csv from the requests within the cuts. The
+# requests are put in the Fortio buckets of the run, so the percentiles are
+# interpolated like those of the runs without cuts
+def apply_to_latencies(json_output_dir, filename, data, gd, columnar_output_dir=""):
+    log = run_log(json_output_dir, filename, data, columnar_output_dir)
+    if log is None:
+        return False
+    start, duration = fortio.metrics_window(gd)
+    if columnar_output_dir and isinstance(log.timestamp, np.memmap):
+        log = latencystore.window(log, start, start + duration)
+    else:
+        log = accesslog.trim(log, start, start + duration)
+    if len(log.latency) == 0:
+        return False
+    run = histogram.Histogram.from_fortio(data["DurationHistogram"])
+    summary = histogram.Histogram.from_values_like(log.latency, run).summary(accesslog.PERCENTILES)
+    for key in LATENCY_KEYS:
+        gd[key] = summary[key]
+    return True
+
+
+def main(argv):
+    args = get_parser().parse_args(argv)
+    fetcher = None
+    if args.prometheus:
+        fetcher = prometheus_cpu_fetcher(args.prometheus, args.resource_usage_targets, rate_window=args.rate_window)
+    for filename in sorted(os.listdir(args.json_output_dir)):
+        if not fortio.is_fortio_result(filename):
+            continue
+        with open(os.path.join(args.json_output_dir, filename), "r") as f:
+            data = json.load(f, strict=False)
+        gd = fortio.convert_data(data)
+        result = detect(args.json_output_dir, filename, data, gd, fetcher=fetcher)
+        if result is not None and args.verbose:
+            for name, (warmup, cooldown) in sorted(result["series"].items()):
+                print("    {:<45} warm-up {:>4}s  cool-down {:>4}s".format(name, warmup, cooldown))
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser("Detect the steady state of the runs of a json output directory")
+    parser.add_argument(
+        "--json_output_dir",
+        help="directory containing the Fortio json results and access logs",
+        required=True)
+    parser.add_argument(
+        "--prometheus",
+        help="prometheus url of the CPU usage of the runs without cgroup samples, not used if blank",
+        default="")
+    parser.add_argument(
+        "--resource_usage_targets",
+        help="setup of the targets whose CPU usage is used",
+        default="")
+    parser.add_argument(
+        "--rate_window",
+        help="rate window of the CPU usage",
+        default=prom.DEFAULT_RATE_WINDOW)
+    parser.add_argument(
+        "--verbose",
+        help="print the cuts of every series",
+        action="store_true")
+    return parser
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,105 @@
+// Code generated by protoc-gen-go-grpc. DO NOT EDIT.
+// versions:
+// - protoc-gen-go-grpc v1.2.0
+// - protoc             v3.21.12
+// source: ping.proto
+
+package demoservice
+
+import (
+	context "context"
+	grpc "google.golang.org/grpc"
+	codes "google.golang.org/grpc/codes"
+	status "google.golang.org/grpc/status"
+)
+
+// This is a compile-time assertion to ensure that this generated file
+// is compatible with the grpc package it is being compiled against.
+// Requires gRPC-Go v1.32.0 or later.
+const _ = grpc.SupportPackageIsVersion7
+
+// PingServerClient is the client API for PingServer service.
+//
+// For semantics around ctx use and closing/ending streaming RPCs, please refer to https://pkg.go.dev/google.golang.org/grpc/?tab=doc#ClientConn.NewStream.
+type PingServerClient interface {
+	Ping(ctx context.Context, in *PingMessage, opts ...grpc.CallOption) (*PingMessage, error)
+}
+
+type pingServerClient struct {
+	cc grpc.ClientConnInterface
+}
+
+func NewPingServerClient(cc grpc.ClientConnInterface) PingServerClient {
+	return &pingServerClient{cc}
+}
+
+func (c *pingServerClient) Ping(ctx context.Context, in *PingMessage, opts ...grpc.CallOption) (*PingMessage, error) {
+	out := new(PingMessage)
+	err := c.cc.Invoke(ctx, "/fgrpc.PingServer/Ping", in, out, opts...)
+	if err != nil {
+		return nil, err
+	}
+	return out, nil
+}
+
+// PingServerServer is the server API for PingServer service.
+// All implementations must embed UnimplementedPingServerServer
+// for forward compatibility
+type PingServerServer interface {
+	Ping(context.Context, *PingMessage) (*PingMessage, error)
+	mustEmbedUnimplementedPingServerServer()
+}
+
+// UnimplementedPingServerServer must be embedded to have forward compatible implementations.
+type UnimplementedPingServerServer struct {
+}
+
+func (UnimplementedPingServerServer) Ping(context.Context, *PingMessage) (*PingMessage, error) {
+	return nil, status.Errorf(codes.Unimplemented, "method Ping not implemented")
+}
+func (UnimplementedPingServerServer) mustEmbedUnimplementedPingServerServer() {}
+
+// UnsafePingServerServer may be embedded to opt out of forward compatibility for this service.
+// Use of this interface is not recommended, as added methods to PingServerServer will
+// result in compilation errors.
+type UnsafePingServerServer interface {
+	mustEmbedUnimplementedPingServerServer()
+}
+
+func RegisterPingServerServer(s grpc.ServiceRegistrar, srv PingServerServer) {
+	s.RegisterService(&PingServer_ServiceDesc, srv)
+}
+
+func _PingServer_Ping_Handler(srv interface{}, ctx context.Context, dec func(interface{}) error, interceptor grpc.UnaryServerInterceptor) (interface{}, error) {
+	in := new(PingMessage)
+	if err := dec(in); err != nil {
+		return nil, err
+	}
+	if interceptor == nil {
+		return srv.(PingServerServer).Ping(ctx, in)
+	}
+	info := &grpc.UnaryServerInfo{
+		Server:     srv,
+		FullMethod: "/fgrpc.PingServer/Ping",
+	}
+	handler := func(ctx context.Context, req interface{}) (interface{}, error) {
+		return srv.(PingServerServer).Ping(ctx, req.(*PingMessage))
+	}
+	return interceptor(ctx, in, info, handler)
+}
+
+// PingServer_ServiceDesc is the grpc.ServiceDesc for PingServer service.
+// It's only intended for direct use with grpc.RegisterService,
+// and not to be introspected or modified (even as a copy)
+var PingServer_ServiceDesc = grpc.ServiceDesc{
+	ServiceName: "fgrpc.PingServer",
+	HandlerType: (*PingServerServer)(nil),
+	Methods: []grpc.MethodDesc{
+		{
+			MethodName: "Ping",
+			Handler:    _PingServer_Ping_Handler,
+		},
+	},
+	Streams:  []grpc.StreamDesc{},
+	Metadata: "ping.proto",
+}
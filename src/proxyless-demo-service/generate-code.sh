@@ -5,4 +5,8 @@
 
 protoc --proto_path ../../protobuf --go_out=. --go-grpc_out=. \
     --go_opt=Mdemoservice.proto=./demoservice --go-grpc_opt=Mdemoservice.proto=./demoservice \
-    demoservice.proto
\ No newline at end of file
+    demoservice.proto
+
+protoc --proto_path ../../protobuf --go_out=. --go-grpc_out=. \
+    --go_opt=Mping.proto=./demoservice --go-grpc_opt=Mping.proto=./demoservice \
+    ping.proto
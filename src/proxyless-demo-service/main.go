@@ -6,13 +6,17 @@ package main
 import (
 	"context"
 	"fmt"
+	"io"
 	"log"
 	"net"
 	"os"
+	"time"
 
 	pb "proxy-comparison/demo-service/demoservice"
 
 	"google.golang.org/grpc"
+	"google.golang.org/grpc/health"
+	healthpb "google.golang.org/grpc/health/grpc_health_v1"
 
 	"google.golang.org/grpc/credentials"
 	"google.golang.org/grpc/credentials/insecure"
@@ -30,6 +34,39 @@ func (s *concatenationServiceServer) Concatenate(ctx context.Context, concatenat
 	return &pb.ConcatenatedString{Str: concatenationRequest.Str1 + concatenationRequest.Str2}, nil
 }
 
+type pingServer struct {
+	pb.UnimplementedPingServerServer
+}
+
+// echoes the message with its payload like the ping server of Fortio, the
+// target of the gRPC load of the runner
+func (s *pingServer) Ping(ctx context.Context, in *pb.PingMessage) (*pb.PingMessage, error) {
+	if in.DelayNanos > 0 {
+		time.Sleep(time.Duration(in.DelayNanos))
+	}
+	return &pb.PingMessage{Seq: in.Seq, Ts: time.Now().UnixNano(), Payload: in.Payload, DelayNanos: in.DelayNanos}, nil
+}
+
+// echoes the bytes of every connection back, the target of the TCP load of
+// the runner
+func serveTCPEcho(port string) {
+	lis, err := net.Listen("tcp", fmt.Sprintf(":%s", port))
+	if err != nil {
+		log.Fatal(err)
+	}
+	for {
+		conn, err := lis.Accept()
+		if err != nil {
+			log.Print(err)
+			continue
+		}
+		go func() {
+			defer conn.Close()
+			io.Copy(conn, conn)
+		}()
+	}
+}
+
 func main() {
 	port := os.Getenv("PORT")
 	if port == "" {
@@ -38,6 +75,12 @@ func main() {
 
 	log.Printf("PORT: %s", port)
 
+	echoPort := os.Getenv("TCP_ECHO_PORT")
+	if echoPort != "" {
+		log.Printf("TCP_ECHO_PORT: %s", echoPort)
+		go serveTCPEcho(echoPort)
+	}
+
 	var err error
 	serverCredentials, err = xdscredentials.NewServerCredentials(xdscredentials.ServerOptions{FallbackCreds: insecure.NewCredentials()})
 	if err != nil {
@@ -51,6 +94,8 @@ func main() {
 
 	grpcServer := xds.NewGRPCServer(grpc.Creds(serverCredentials))
 	pb.RegisterConcatenationServiceServer(grpcServer, &concatenationServiceServer{})
+	pb.RegisterPingServerServer(grpcServer, &pingServer{})
+	healthpb.RegisterHealthServer(grpcServer, health.NewServer())
 	err = grpcServer.Serve(lis)
 	if err != nil {
 		log.Fatal(err)